@@ -1,7 +1,16 @@
 import discord
+import io
 from discord import Forbidden, app_commands
 from discord.ext import commands
-from typing import Dict, List
+from typing import Dict, List, Literal
+
+from Utils.LoopMonitor import LOOP_MONITOR
+from Utils.MemoryBudget import MEMORY_TRACKER
+from Utils.Profiler import PROFILE_LOCK, ProfileProcess
+from Utils.Sharding import ShardGuilds, ShardIdsOf, ShardLatencies
+
+# Intents this cog needs when LeanIntents is on, see Utils/Intents.py
+REQUIRED_INTENTS = ("guilds",)
 
 class Moderation(commands.Cog):
     def __init__(self, client):
@@ -18,7 +27,19 @@ class Moderation(commands.Cog):
 
     @app_commands.command(name="ping", description="Ping the bot")
     async def ping(self, interaction: discord.Interaction):
-        await interaction.response.send_message(f"Pong! {round(self.client.latency * 1000)}ms")
+        stats = getattr(self.client, "shard_stats", None)
+        if not isinstance(self.client, commands.AutoShardedBot) or stats is None:
+            await interaction.response.send_message(f"Pong! {round(self.client.latency * 1000)}ms")
+            return
+
+        latencies = dict(ShardLatencies(self.client))
+        guilds = ShardGuilds("", self.client)
+        lines = [f"Pong! {round(self.client.latency * 1000)}ms average over {len(latencies)} shards (this server is on shard {interaction.guild.shard_id if interaction.guild else 0})"]
+        for shard in ShardIdsOf(self.client):
+            latency = latencies.get(shard, float("nan"))
+            latencyText = f"{round(latency * 1000)}ms" if latency == latency else "connecting"
+            lines.append(f"Shard {shard}: {latencyText}, {stats.rate(shard):.1f} events/s, {guilds.get(('', str(shard)), 0)} servers")
+        await interaction.response.send_message("\n".join(lines)[:2000])
 
     @app_commands.command(name="purge", description="Clear chat messages")
     @app_commands.checks.has_permissions(manage_messages=True)
@@ -49,6 +70,48 @@ class Moderation(commands.Cog):
         except Exception as e:
             await interaction.followup.send(f"Error reloading cogs: {e}", ephemeral=True)
 
+    @app_commands.command(name="blockers", description="Show what blocked the event loop the longest")
+    @app_commands.check(is_allowed_user)
+    async def blockers(self, interaction: discord.Interaction, count: app_commands.Range[int, 1, 50] = 10):
+        summary = LOOP_MONITOR.summary(count)
+        if not LOOP_MONITOR.blockers:
+            await interaction.response.send_message(f"```\n{summary}\n```", ephemeral=True)
+            return
+        # The stacks don't fit in a message, they come as a file
+        stacks = discord.File(io.BytesIO(LOOP_MONITOR.stacks(count).encode()), filename="blockers.txt")
+        await interaction.response.send_message(f"```\n{summary[:1900]}\n```", file=stacks, ephemeral=True)
+
+    @app_commands.command(name="profile", description="Profile the bot for a few seconds and show where the time goes")
+    @app_commands.describe(seconds="How long to sample", threads="Sample all threads, not only the event loop")
+    @app_commands.check(is_allowed_user)
+    async def profile(self, interaction: discord.Interaction, seconds: app_commands.Range[int, 1, 120] = 10, threads: bool = False):
+        if PROFILE_LOCK.locked():
+            await interaction.response.send_message("A profile is already running, try again when it's done.", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        profiler = await ProfileProcess(seconds, all_threads=threads)
+        # Collapsed stacks, open with speedscope.app or flamegraph.pl
+        stacks = discord.File(io.BytesIO(profiler.collapsed().encode()), filename=f"profile-{self.client.user.name.lower()}-{discord.utils.utcnow():%Y%m%d-%H%M%S}.folded")
+        await interaction.followup.send(f"```\n{profiler.summary()[:1900]}\n```", file=stacks, ephemeral=True)
+
+    @app_commands.command(name="memory", description="Show the memory held by each cog, or trace allocations")
+    @app_commands.describe(action="state: memory per cog and cache, snapshot: start tracing or compare with the last snapshot, stop: stop tracing")
+    @app_commands.check(is_allowed_user)
+    async def memory(self, interaction: discord.Interaction, action: Literal["state", "snapshot", "stop"] = "state"):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        if action == "stop":
+            await interaction.followup.send(MEMORY_TRACKER.stop_tracing(), ephemeral=True)
+            return
+        if action == "state":
+            await interaction.followup.send(f"```\n{(await MEMORY_TRACKER.report())[:1900]}\n```", ephemeral=True)
+            return
+        summary, details = await MEMORY_TRACKER.snapshot()
+        if not details:
+            await interaction.followup.send(summary, ephemeral=True)
+            return
+        diff = discord.File(io.BytesIO(details.encode()), filename=f"memory-{discord.utils.utcnow():%Y%m%d-%H%M%S}.txt")
+        await interaction.followup.send(f"```\n{summary[:1900]}\n```", file=diff, ephemeral=True)
+
     @app_commands.command(name="kick", description="Kick a member from the server")
     @app_commands.checks.has_permissions(kick_members=True)
     @app_commands.check(is_allowed_user)
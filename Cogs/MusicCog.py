@@ -4,10 +4,17 @@ import discord
 import traceback
 from discord import app_commands, FFmpegPCMAudio, PCMVolumeTransformer
 from discord.ext import commands
-from yt_dlp import YoutubeDL
 from typing import Optional
 from enum import Enum
 
+from Utils.LazyImport import LazyImport
+
+# Only needed once someone plays something from YouTube
+yt_dlp = LazyImport("yt_dlp")
+
+# Intents this cog needs when LeanIntents is on, voice states tell it where users are
+REQUIRED_INTENTS = ("guilds", "voice_states")
+
 class RepeatMode(Enum):
     NONE = 0
     TRACK = 1
@@ -104,11 +111,16 @@ class Music(commands.Cog):
         self.user_last_channel = {}
         self.active_views = []
         self.local_files_cache = []
-        self.refresh_local_files_cache()
         self.search_lock = asyncio.Lock()
 
+    async def cog_load(self):
+        # Listing the songs folder can be slow on a network drive, keep it off the event loop
+        await asyncio.to_thread(self.prepare_songs_folder)
+
+    def prepare_songs_folder(self):
         if not os.path.exists("Songs"):
             os.makedirs("Songs")
+        self.refresh_local_files_cache()
 
     def refresh_local_files_cache(self):
         self.local_files_cache = [
@@ -221,7 +233,7 @@ class Music(commands.Cog):
         }
 
         try:
-            with YoutubeDL(ytdl_opts) as ytdl:
+            with yt_dlp.YoutubeDL(ytdl_opts) as ytdl:
                 is_search = url.startswith('ytsearch')
                 data = await asyncio.wait_for(
                     asyncio.to_thread(
@@ -1,48 +1,58 @@
 import discord
 import asyncio
+import copy
 from discord import app_commands
 from discord.ext import commands, tasks
 from datetime import datetime, timedelta
-import json
-import os
 import random
 from typing import List, Dict
-import pytz
 import aiohttp
 import html
 
-def LoadJson(filename: str) -> dict:
-    """
-    Loads JSON data from a file. If the file doesn't exist or is invalid, it returns an empty dictionary.
-    """
-    if not os.path.exists(filename):
-        print(f"Warning: {filename} does not exist. Returning an empty dictionary.")
-        return {}
-
-    try:
-        with open(filename, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        print(f"Error: {filename} is empty or contains invalid JSON. Returning an empty dictionary.")
-        return {}
-    except Exception as e:
-        print(f"Unexpected error while loading {filename}: {e}")
-        return {}
-
-def SaveJson(filename: str, data: dict) -> None:
-    """
-    Saves a dictionary to a file in JSON format. Ensures the directory exists.
-    """
-    # Ensure the directory exists
-    folder = os.path.dirname(filename)
-    if folder and not os.path.exists(folder):
-        os.makedirs(folder)
-
-    try:
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        print(f"Error: Failed to save data to {filename}. Exception: {e}")
+from Utils.LazyImport import LazyImport
+from Utils.Storage import Collection, LoadJson, OpenStore, Store, WriteBehind
+
+pytz = LazyImport("pytz")
+
+# Intents this cog needs when LeanIntents is on, members it shows are looked up on demand
+REQUIRED_INTENTS = ("guilds",)
+
+# State kept in the quiz_settings collection, one row per key
+DEFAULT_SETTINGS = {
+    "current_quiz": {},
+    "quiz_time": "06:00",
+    "reveal_time": "18:00",
+    "quiz_channel_id": None,
+    "quiz_started": False,
+    "quiz_finished_today": False,
+    "enabled_categories": ["General Knowledge"],
+    "session_token": None
+}
+
+def QuestionRow(question: dict, category: str, used: bool) -> dict:
+    return {**question, "category": category, "used": used}
+
+def ImportQuizJson(store: Store):
+    """Copies quiz-data.json, questions.json and used-questions.json into the store, once."""
+    data = LoadJson("DataFiles/quiz-data.json")
+    questions = LoadJson("DataFiles/questions.json")
+    used_questions = LoadJson("DataFiles/used-questions.json")
+    if not (data or questions or used_questions):
+        return
+    current_quiz = dict(data.get("current_quiz") or {})
+    answers = current_quiz.pop("answers", {})
+    settings = {key: value for key, value in data.items() if key != "points"}
+    settings["current_quiz"] = current_quiz
+    rows = {}
+    for pool, used in ((questions, False), (used_questions, True)):
+        for category, items in pool.items():
+            for question in items:
+                rows[question["question"]] = QuestionRow(question, category, used)
+    store.collection("quiz_settings").put_many(settings)
+    store.collection("quiz_points").put_many(data.get("points", {}))
+    store.collection("quiz_answers").put_many(answers)
+    store.collection("quiz_questions").put_many(rows)
+    print(f"Imported the quiz from DataFiles: {len(data.get('points', {}))} players with points, {len(rows)} questions")
 
 
 class QuizView(discord.ui.View):
@@ -76,28 +86,83 @@ class QuizView(discord.ui.View):
 class Quiz(commands.Cog):
     def __init__(self, client):
         self.client = client
-        self.data: Dict = LoadJson("DataFiles/quiz-data.json")
-        self.questions: Dict[str, List] = LoadJson("DataFiles/questions.json")
-        self.used_questions: Dict[str, List] = LoadJson("DataFiles/used-questions.json")
+        self.data: Dict = {}
+        self.questions: Dict[str, List] = {}
+        self.used_questions: Dict[str, List] = {}
         self.category_mapping = {}
-
-        if not self.data:
-            self.data = {
-                "current_quiz": {},
-                "points": {},
-                "quiz_time": "06:00",
-                "reveal_time": "18:00",
-                "quiz_channel_id": None,
-                "quiz_started": False,
-                "quiz_finished_today": False,
-                "enabled_categories": ["General Knowledge"],
-                "session_token": None
-            }
-            SaveJson("DataFiles/quiz-data.json", self.data)
+        self.settings: Collection = None
+        self.points: Collection = None
+        self.answers: Collection = None
+        self.question_rows: Collection = None
+        self.writes: WriteBehind = None
+
+    async def cog_load(self):
+        # Reading the store happens in a thread, so loading the cogs doesn't block the event loop
+        await asyncio.to_thread(self.load_data)
+        self.writes.start()
+
+    async def cog_unload(self):
+        await self.writes.stop()
+        # Settings and questions are queued without waiting, a reload must not read the store before they land
+        await self.settings.store.writer.wait()
+
+    def load_data(self):
+        """Reads the quiz state and questions from the store, importing the old JSON files the first time"""
+        store = OpenStore()
+        store.import_once("quiz", ImportQuizJson)
+        self.settings = store.collection("quiz_settings")
+        self.points = store.collection("quiz_points")
+        self.answers = store.collection("quiz_answers")
+        self.question_rows = store.collection("quiz_questions")
+
+        # Answers and points are written in the background, see save_answer
+        self.writes = WriteBehind(store, "quiz", {
+            "quiz_answers": lambda user_id: self.data["current_quiz"].get("answers", {}).get(user_id),
+            "quiz_points": lambda user_id: self.data["points"].get(user_id),
+        })
+
+        settings = self.settings.load()
+        self.data = {**copy.deepcopy(DEFAULT_SETTINGS), **settings}
+        self.data["points"] = self.points.load()
+        if self.data["current_quiz"]:
+            self.data["current_quiz"]["answers"] = self.answers.load()
+        self.questions = {}
+        self.used_questions = {}
+        for row in self.question_rows.load().values():
+            pool = self.used_questions if row.pop("used", False) else self.questions
+            pool.setdefault(row["category"], []).append(row)
+
+        if not settings:
+            self.save_state()
         else:
             if self.data.get("quiz_started") and not self.data.get("current_quiz"):
                 self.data["quiz_started"] = False
-                SaveJson("DataFiles/quiz-data.json", self.data)
+                self.save_state()
+
+    def save_state(self):
+        """Writes the quiz settings and current question, which don't grow with the players. Points and answers are written per player."""
+        current_quiz = {key: value for key, value in self.data["current_quiz"].items() if key != "answers"}
+        rows = self.settings.encode({**{key: value for key, value in self.data.items() if key not in ("points", "current_quiz")}, "current_quiz": current_quiz})
+        clear_answers = not self.data["current_quiz"].get("answers")
+
+        def write():
+            with self.settings.store.batch():
+                self.settings.put_rows(rows)
+                if clear_answers:
+                    self.answers.clear()
+
+        # Saves waiting in a row are written once with the latest settings, unless one clears the answers
+        self.settings.store.writer.submit(write, key=None if clear_answers else "quiz_settings")
+
+    def save_answer(self, user_id: str):
+        """Marks the player's answer and points as changed, they are written with the next flush."""
+        self.writes.mark("quiz_answers", user_id)
+        self.writes.mark("quiz_points", user_id)
+
+    def save_questions(self, questions: List, used: bool):
+        """Writes (category, question) pairs, marking them as used or back in the pool."""
+        rows = self.question_rows.encode({question["question"]: QuestionRow(question, category, used) for category, question in questions})
+        self.question_rows.store.writer.submit(lambda: self.question_rows.put_rows(rows))
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -137,7 +202,7 @@ class Quiz(commands.Cog):
             # Reset daily flags at midnight
             if current_time.hour == 0 and current_time.minute == 0:
                 self.data["quiz_finished_today"] = False
-                SaveJson("DataFiles/quiz-data.json", self.data)
+                self.save_state()
 
             # Skip the logic if the quiz is finished today
             if self.data.get("quiz_finished_today", True):
@@ -155,13 +220,13 @@ class Quiz(commands.Cog):
 
             # Check if it's time to reveal answers (6 PM)
             if current_time >= reveal_time_today and self.data.get("quiz_started") == True:
-                SaveJson("DataFiles/quiz-data.json", self.data)  # Immediate save
+                self.save_state()  # Immediate save
                 
                 success = await self.start_quiz()
                 if not success:
                     self.data["quiz_started"] = False
                     self.data["quiz_finished_today"] = False
-                    SaveJson("DataFiles/quiz-data.json", self.data)
+                    self.save_state()
                     print("Failed to start quiz, resetting state")
 
             # Answer Reveal Logic
@@ -173,7 +238,7 @@ class Quiz(commands.Cog):
                 self.data["quiz_started"] = False
                 self.data["quiz_finished_today"] = True
                 await self.reveal_answers()
-                SaveJson("DataFiles/quiz-data.json", self.data)
+                self.save_state()
 
         except Exception as e:
             print(f"Error in check_quiz_time: {e}")
@@ -181,7 +246,7 @@ class Quiz(commands.Cog):
             # Full state reset on critical failure
             self.data["quiz_started"] = False
             self.data["quiz_finished_today"] = False
-            SaveJson("DataFiles/quiz-data.json", self.data)
+            self.save_state()
             import traceback
             traceback.print_exc()
 
@@ -224,7 +289,7 @@ class Quiz(commands.Cog):
             try:
                 print("No session token found, requesting new one...")
                 self.data["session_token"] = await self.get_session_token()
-                SaveJson("DataFiles/quiz-data.json", self.data)
+                self.save_state()
             except Exception as e:
                 print(f"Error getting session token: {e}")
                 return False
@@ -248,12 +313,12 @@ class Quiz(commands.Cog):
                     elif data["response_code"] == 3:
                         print("Token expired, requesting new one...")
                         self.data["session_token"] = await self.get_session_token()
-                        SaveJson("DataFiles/quiz-data.json", self.data)
+                        self.save_state()
                         return await self.fetch_questions_from_api()
                     elif data["response_code"] == 4:
                         print("Token empty, resetting...")
                         self.data["session_token"] = await self.reset_session_token(self.data["session_token"])
-                        SaveJson("DataFiles/quiz-data.json", self.data)
+                        self.save_state()
                         return await self.fetch_questions_from_api()
                     elif data["response_code"] != 0:
                         print(f"Unknown API error: {data['response_code']}")
@@ -315,7 +380,7 @@ class Quiz(commands.Cog):
                     for cat, questions in self.questions.items():
                         print(f"- {cat}: {len(questions)} questions")
 
-                    SaveJson("DataFiles/questions.json", self.questions)
+                    self.save_questions(new_questions, used=False)
                     return len(new_questions) > 0
 
         except Exception as e:
@@ -372,7 +437,7 @@ class Quiz(commands.Cog):
                 "correct_index": question["correct_index"],
                 "category": category
             })
-            SaveJson("DataFiles/quiz-data.json", self.data)
+            self.save_state()
 
             view = QuizView(
                 question["question"],
@@ -403,9 +468,8 @@ class Quiz(commands.Cog):
             if question not in self.used_questions[category]:  # Prevent duplicates
                 self.used_questions[category].append(question)
             
-            # Save both files
-            SaveJson("DataFiles/questions.json", self.questions)
-            SaveJson("DataFiles/used-questions.json", self.used_questions)
+            # Only this question's row changes
+            self.save_questions([(category, question)], used=True)
 
         except Exception as e:
             print(f"Error moving question to used: {e}")
@@ -425,7 +489,7 @@ class Quiz(commands.Cog):
                 self.data["points"][user_id] = 0
             self.data["points"][user_id] += 1
         
-        SaveJson("DataFiles/quiz-data.json", self.data)
+        self.save_answer(user_id)
         await interaction.response.send_message(
             "✅ Correct!" if correct else f"❌ Wrong! The correct answer is: {correct_answer}", ephemeral=True, delete_after=60)
 
@@ -449,10 +513,10 @@ class Quiz(commands.Cog):
         )
 
         self.data["current_quiz"]["revealed"] = True
-        SaveJson("DataFiles/quiz-data.json", self.data)
+        self.save_state()
         # Reset current quiz after reveal
         self.data["current_quiz"] = {}
-        SaveJson("DataFiles/quiz-data.json", self.data)
+        self.save_state()
 
     def get_failure_reason(self) -> str:
         """Returns detailed failure explanation"""
@@ -483,7 +547,7 @@ class Quiz(commands.Cog):
     @commands.has_permissions(administrator=True)
     async def set_quiz_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
         self.data["quiz_channel_id"] = channel.id
-        SaveJson("DataFiles/quiz-data.json", self.data)
+        self.save_state()
         await interaction.response.send_message(f"Quiz channel set to {channel.mention}", ephemeral=True, delete_after=5)
 
     @app_commands.command(name="set_quiz_time", description="Set the daily quiz start time (24-hour format, HH:MM)")
@@ -499,7 +563,7 @@ class Quiz(commands.Cog):
             self.data["reveal_time"] = end_time_obj.strftime("%H:%M")  # Store the time as a string
 
             # Save the updated data
-            SaveJson("DataFiles/quiz-data.json", self.data)
+            self.save_state()
             
             # Send a confirmation message
             await interaction.response.send_message(f"Daily quiz time set to {start_time} and results reveal time set to {end_time}", ephemeral=True, delete_after=10)
@@ -511,14 +575,14 @@ class Quiz(commands.Cog):
     async def start_quiz_command(self, interaction: discord.Interaction):
         # Initial state reset
         self.data["quiz_started"] = True
-        SaveJson("DataFiles/quiz-data.json", self.data)
+        self.save_state()
         
         try:
             success = await self.start_quiz()
             if success:
                 await interaction.response.send_message("✅ Quiz started successfully!", ephemeral=True, delete_after=5)
                 self.data["quiz_finished_today"] = False
-                SaveJson("DataFiles/quiz-data.json", self.data)
+                self.save_state()
             else:
                 # Get failure reason
                 failure_reason = self.get_failure_reason()
@@ -530,7 +594,7 @@ class Quiz(commands.Cog):
         finally:
             if not self.data.get("current_quiz"):
                 self.data["quiz_started"] = False
-                SaveJson("DataFiles/quiz-data.json", self.data)
+                self.save_state()
 
     @app_commands.command(name="list_categories", description="List all available quiz categories")
     async def list_categories(self, interaction: discord.Interaction):
@@ -568,7 +632,7 @@ class Quiz(commands.Cog):
         
         if category not in self.data["enabled_categories"]:
             self.data["enabled_categories"].append(category)
-            SaveJson("DataFiles/quiz-data.json", self.data)
+            self.save_state()
             await interaction.response.send_message(f"Enabled category: {category}", ephemeral=True)
         else:
             await interaction.response.send_message(f"Category {category} is already enabled", ephemeral=True)
@@ -581,10 +645,16 @@ class Quiz(commands.Cog):
         # Leaderboard Section
         points_data = self.data["points"]
         sorted_users = sorted(points_data.items(), key=lambda x: x[1], reverse=True)[:10]  # Top 10
+        current_quiz = self.data.get("current_quiz", {})
+
+        # Members that aren't cached may have to be fetched, which can take longer than Discord waits for a response
+        await interaction.response.defer(ephemeral=True)
+        user_ids = [int(user_id) for user_id, _ in sorted_users] + [int(user_id) for user_id in current_quiz.get("answers", {})]
+        members = await self.find_members(interaction.guild, user_ids)
         
         leaderboard = []
         for idx, (user_id, points) in enumerate(sorted_users, 1):
-            user = interaction.guild.get_member(int(user_id))
+            user = members.get(int(user_id))
             leaderboard.append(f"{idx}. {user.mention if user else 'Unknown User'} - {points} pts")
         
         embed.add_field(
@@ -594,7 +664,6 @@ class Quiz(commands.Cog):
         )
 
         # Current Question Section
-        current_quiz = self.data.get("current_quiz", {})
         if current_quiz:
             question_status = [
                 f"**Question:** {current_quiz.get('question', 'N/A')}",
@@ -622,7 +691,7 @@ class Quiz(commands.Cog):
             wrong_users = []
             
             for user_id, answer in current_quiz.get("answers", {}).items():
-                user = interaction.guild.get_member(int(user_id))
+                user = members.get(int(user_id))
                 if user:
                     name = user.display_name
                     if answer["correct"]:
@@ -648,7 +717,14 @@ class Quiz(commands.Cog):
                 inline=False
             )
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+    async def find_members(self, guild: discord.Guild, user_ids: List[int]) -> Dict[int, discord.Member]:
+        """Looks members up through the bot's member lookup, which fetches the ones discord.py didn't cache."""
+        lookup = getattr(self.client, "member_lookup", None)
+        if lookup is None:
+            return {user_id: guild.get_member(user_id) for user_id in user_ids}
+        return await lookup.many(guild, user_ids)
 
     @app_commands.command(name="points", description="Check your quiz points")
     async def show_points(self, interaction: discord.Interaction):
@@ -661,6 +737,7 @@ class Quiz(commands.Cog):
     @commands.has_permissions(administrator=True)
     async def reset_questions(self, interaction: discord.Interaction):
         # Move all used questions back to their categories
+        returned = [(category, question) for category, questions in self.used_questions.items() for question in questions]
         for category in self.used_questions:
             if category not in self.questions:
                 self.questions[category] = []
@@ -669,8 +746,7 @@ class Quiz(commands.Cog):
         # Clear used questions
         self.used_questions = {category: [] for category in self.used_questions}
         
-        SaveJson("DataFiles/questions.json", self.questions)
-        SaveJson("DataFiles/used-questions.json", self.used_questions)
+        self.save_questions(returned, used=False)
         
         await interaction.response.send_message("All questions have been reset!", ephemeral=True)
 
@@ -680,7 +756,7 @@ class Quiz(commands.Cog):
         """Emergency reset command"""
         self.data["quiz_started"] = False
         self.data["current_quiz"] = {}
-        SaveJson("DataFiles/quiz-data.json", self.data)
+        self.save_state()
         await interaction.response.send_message("✅ Quiz state forcibly reset", ephemeral=True)
 
 async def setup(client):
@@ -4,27 +4,27 @@ from discord.ui import Button, View
 from discord.ext import commands
 from discord import app_commands
 import asyncio
-import json
-import os
 import random
 import datetime
 from typing import Dict
 
-def LoadJson(filename: str) -> dict:
-    if not os.path.exists(filename):
-        return {}
-    try:
-        with open(filename, 'r') as f:
-            return json.load(f)
-    except:
-        return {}
-
-def SaveJson(filename: str, data: dict) -> None:
-    folder = os.path.dirname(filename)
-    if folder:
-        os.makedirs(folder, exist_ok=True)  # Creates folders if missing, no errors
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4)
+from Utils.Storage import Collection, LoadJson, OpenStore, Store, WriteBehind
+
+# Intents this cog needs when LeanIntents is on
+REQUIRED_INTENTS = ("guilds",)
+
+def ImportRPGJson(store: Store):
+    """Copies players.json, shop-items.json and monsters.json into the store, once."""
+    players = LoadJson("DataFiles/rpgFiles/players.json")
+    shop_data = LoadJson("DataFiles/rpgFiles/shop-items.json")
+    monsters = LoadJson("DataFiles/rpgFiles/monsters.json")
+    store.collection("rpg_players").put_many(players)
+    if shop_data:
+        store.collection("rpg_shop").put_list(shop_data.get("items", []))
+    if monsters:
+        store.collection("rpg_monsters").put_list(monsters)
+    if players or shop_data or monsters:
+        print(f"Imported the RPG from DataFiles: {len(players)} players")
 
 class RPGView(discord.ui.View):
     def __init__(self, cog, user_id):
@@ -140,7 +140,7 @@ class BattleView(discord.ui.View):
         user = self.cog.get_user(self.user_id)
         if random.random() < 0.5:  # 50% chance to flee
             del user["current_monster"]
-            SaveJson("DataFiles/rpgFiles/players.json", self.cog.user_data)
+            self.cog.save_players(self.user_id)
             await interaction.response.edit_message(
                 content="🏃♂️ You successfully fled!",
                 embed=None,
@@ -154,7 +154,7 @@ class BattleView(discord.ui.View):
             if user["health"] <= 0:
                 response = "💀 You were defeated!"
                 del user["current_monster"]
-            SaveJson("DataFiles/rpgFiles/players.json", self.cog.user_data)
+            self.cog.save_players(self.user_id)
             await self.create_embed()
             await interaction.response.edit_message(content=response, embed=self.embed, view=self)
 
@@ -240,7 +240,7 @@ class SkillChoiceView(discord.ui.View):
     async def select_skill(self, interaction: discord.Interaction, skill_name: str):
         user = self.cog.get_user(self.user_id)
         user["skills"].append(skill_name)
-        SaveJson("DataFiles/rpgFiles/players.json", self.cog.user_data)
+        self.cog.save_players(self.user_id)
         await interaction.response.edit_message(
             content=f"✅ Learned **{skill_name}**!",
             view=None
@@ -249,9 +249,13 @@ class SkillChoiceView(discord.ui.View):
 class RPG(commands.Cog):
     def __init__(self, client):
         self.client = client
-        self.user_data: Dict = LoadJson("DataFiles/rpgFiles/players.json")
-        self.shop_data: Dict = LoadJson("DataFiles/rpgFiles/shop-items.json")
-        self.monsters: Dict = LoadJson("DataFiles/rpgFiles/monsters.json")
+        self.user_data: Dict = {}
+        self.shop_data: Dict = {}
+        self.monsters: Dict = {}
+        self.players: Collection = None
+        self.shop_items: Collection = None
+        self.monster_rows: Collection = None
+        self.writes: WriteBehind = None
         self.regen_task = None
 
         self.SKILLS = {
@@ -271,6 +275,20 @@ class RPG(commands.Cog):
             "shield": {"type": "armor", "value": 5}
         }
 
+    def load_data(self):
+        """Reads the players, shop and monsters from the store, creating the default shop and monsters if missing"""
+        store = OpenStore()
+        store.import_once("rpg", ImportRPGJson)
+        self.players = store.collection("rpg_players")
+        self.shop_items = store.collection("rpg_shop")
+        self.monster_rows = store.collection("rpg_monsters")
+        self.user_data = self.players.load()
+        items = self.shop_items.load_list()
+        self.shop_data = {"items": items} if items else {}
+        self.monsters = self.monster_rows.load_list()
+        # Players and shop items are changed in memory and written in the background
+        self.writes = WriteBehind(store, "rpg", {"rpg_players": lambda user_id: self.user_data.get(user_id), "rpg_shop": self.read_shop_item})
+
         if not self.shop_data:
             self.shop_data = {
                 "items": [
@@ -280,7 +298,7 @@ class RPG(commands.Cog):
                     {"name": "rare_artifact", "price": 500, "stock": 1, "type": "special"}
                 ]
             }
-            SaveJson("DataFiles/rpgFiles/shop-items.json", self.shop_data)
+            self.shop_items.put_list(self.shop_data["items"])
 
         if not self.monsters:
             self.monsters = [
@@ -306,7 +324,18 @@ class RPG(commands.Cog):
                 {"name": "Kraken", "min_level": 20, "max_level": 25, "health": 250, "attack": 18}
             ]
 
-            SaveJson("DataFiles/rpgFiles/monsters.json", self.monsters)  # Fix path
+            self.monster_rows.put_list(self.monsters)
+
+    def save_players(self, *user_ids: str):
+        """Marks these players as changed, the write-behind cache writes their rows with the next flush."""
+        self.writes.mark("rpg_players", *user_ids)
+
+    def save_shop_items(self, *indexes: int):
+        self.writes.mark("rpg_shop", *indexes)
+
+    def read_shop_item(self, index: str):
+        items = self.shop_data.get("items", [])
+        return items[int(index)] if int(index) < len(items) else None
 
     def get_user(self, user_id: str) -> dict:
         if user_id not in self.user_data:
@@ -335,13 +364,17 @@ class RPG(commands.Cog):
         return self.user_data[user_id]
 
     async def cog_load(self):
-        """Start the regeneration task when cog loads"""
+        """Load the game data and start the regeneration task when cog loads"""
+        # File reads happen in a thread, so loading the cogs doesn't block the event loop
+        await asyncio.to_thread(self.load_data)
+        self.writes.start()
         self.regen_task = asyncio.create_task(self.regen_resources())
 
-    def cog_unload(self):
-        """Cancel regeneration task on cog unload"""
+    async def cog_unload(self):
+        """Cancel regeneration task and write the pending changes on cog unload"""
         if self.regen_task and not self.regen_task.done():
             self.regen_task.cancel()
+        await self.writes.stop()
 
     async def restock_shop(self):
         await self.client.wait_until_ready()
@@ -352,17 +385,14 @@ class RPG(commands.Cog):
                 # Ensure the user's shop has items and stock exists
                 if "items" in user_shop and len(user_shop["items"]) > 0:
                     user_shop["items"][0]["stock"] += 1
-            SaveJson("DataFiles/rpgFiles/shop-items.json", self.shop_data)
+            self.save_shop_items(0)
 
     async def regen_resources(self):
         await self.client.wait_until_ready()
         while not self.client.is_closed():
             await asyncio.sleep(60)
             # Regenerate stamina and mana for each user
-            for user in self.user_data.values():
-                user["stamina"] = min(user["max_stamina"], user["stamina"] + 10)
-                user["mana"] = min(user["max_mana"], user["mana"] + 10)
-            SaveJson("DataFiles/rpgFiles/players.json", self.user_data)
+            self.save_players(*self.regenerate())
 
     @commands.Cog.listener()
     async def on_interaction(self, interaction: discord.Interaction):
@@ -386,10 +416,19 @@ class RPG(commands.Cog):
         await self.client.wait_until_ready()
         while not self.client.is_closed():
             await asyncio.sleep(60)
-            for user in self.user_data.values():
-                user["stamina"] = min(user["max_stamina"], user["stamina"] + 10)
-                user["mana"] = min(user["max_mana"], user["mana"] + 10)
-            SaveJson("DataFiles/rpgFiles/players.json", self.user_data)
+            self.save_players(*self.regenerate())
+
+    def regenerate(self):
+        """Adds 10 stamina and mana to every player and returns the players that changed, players at their maximum aren't rewritten"""
+        changed = []
+        for user_id, user in self.user_data.items():
+            stamina = min(user["max_stamina"], user["stamina"] + 10)
+            mana = min(user["max_mana"], user["mana"] + 10)
+            if stamina != user["stamina"] or mana != user["mana"]:
+                user["stamina"] = stamina
+                user["mana"] = mana
+                changed.append(user_id)
+        return changed
 
     async def handle_purchase(self, interaction: discord.Interaction, custom_id: str):
         user_id = str(interaction.user.id)
@@ -415,9 +454,9 @@ class RPG(commands.Cog):
         user["inventory"][item_data["name"]] = user["inventory"].get(item_data["name"], 0) + 1
         self.shop_data["items"][item_idx]["stock"] -= 1
 
-        # Save changes
-        SaveJson("DataFiles/rpgFiles/players.json", self.user_data)
-        SaveJson("DataFiles/rpgFiles/shop-items.json", self.shop_data)
+        # Save changes, both are written with the same flush
+        self.save_players(user_id)
+        self.save_shop_items(item_idx)
 
         # Update view
         shop_view = ShopView(self, user_id)
@@ -436,7 +475,7 @@ class RPG(commands.Cog):
             return
         
         self.get_user(user_id)
-        SaveJson("DataFiles/rpgFiles/players.json", self.user_data)
+        self.save_players(user_id)
         await interaction.response.send_message("🎉 Welcome to the RPG! Use `/playrpg` to access your adventure menu!", ephemeral=True)
 
     @app_commands.command(name="playrpg", description="Access your RPG menu")
@@ -483,7 +522,7 @@ class RPG(commands.Cog):
                 response = "🌲 You explored but found nothing..."
             
             user["cooldowns"]["explore"] = current_time
-            SaveJson("DataFiles/rpgFiles/players.json", self.user_data)
+            self.save_players(user_id)
             return response
 
     async def process_attack(self, interaction: discord.Interaction, skill_name: str = None) -> str:
@@ -560,7 +599,7 @@ class RPG(commands.Cog):
                 response = "💀 You were defeated... Use a potion or visit the shop to heal!"
                 del user["current_monster"]
 
-        SaveJson("DataFiles/rpgFiles/players.json", self.user_data)
+        self.save_players(str(interaction.user.id))
         return response
 
 
@@ -618,7 +657,7 @@ class RPG(commands.Cog):
             user["defense"] += item_data["value"]
             response = f"🛡️ Defense increased by {item_data['value']}!"
         
-        SaveJson("DataFiles/rpgFiles/players.json", self.user_data)
+        self.save_players(user_id)
         await interaction.response.send_message(response, ephemeral=True)
 
 async def setup(client):
@@ -0,0 +1,90 @@
+"""
+Compares prompt evaluation with and without Ollama context reuse over a scripted conversation.
+
+    python Tools/BenchContextReuse.py --model Tamaneko
+    python Tools/BenchContextReuse.py --fake
+
+"history" sends the whole conversation through /api/chat every turn, like the bot does by default.
+"reuse" sends only the new message through /api/generate together with the context returned by the
+previous turn (ContextReuse=true). The prompt tokens and prompt eval time are what Ollama reports.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ollama
+
+NANOSECONDS = 1e9
+CONVERSATION = [
+    "Zernder: hey, are you around?",
+    "Zernder: I'm trying to pick a game for tonight, any ideas?",
+    "Kiri: we have four people, something co-op would be best",
+    "Zernder: we played Deep Rock last week, want something different",
+    "Kiri: nothing too long either, we have maybe two hours",
+    "Zernder: what about something with building?",
+    "Kiri: ok and which of those runs on a potato laptop",
+    "Zernder: cool, thanks! what snacks go with that?",
+]
+
+async def RunHistory(client, model, turns):
+    messages = []
+    results = []
+    for text in turns:
+        messages.append({"role": "user", "content": text})
+        started = time.monotonic()
+        response = await client.chat(model=model, messages=messages, stream=False)
+        results.append((response.get("prompt_eval_count", 0), response.get("prompt_eval_duration", 0) / NANOSECONDS, time.monotonic() - started))
+        messages.append({"role": "assistant", "content": response["message"]["content"]})
+    return results
+
+async def RunReuse(client, model, turns):
+    context = None
+    results = []
+    for text in turns:
+        started = time.monotonic()
+        response = await client.generate(model=model, prompt=text, context=context, stream=False)
+        results.append((response.get("prompt_eval_count", 0), response.get("prompt_eval_duration", 0) / NANOSECONDS, time.monotonic() - started))
+        context = response.get("context")
+    return results
+
+def Report(name, results):
+    print(f"\n{name}")
+    print(f"{'turn':>4} {'prompt tokens':>14} {'prompt eval':>12} {'total':>8}")
+    for turn, (tokens, prompt_time, total) in enumerate(results, 1):
+        print(f"{turn:>4} {tokens:>14} {prompt_time:>11.3f}s {total:>7.2f}s")
+    tokens = sum(result[0] for result in results)
+    prompt_time = sum(result[1] for result in results)
+    print(f" sum {tokens:>14} {prompt_time:>11.3f}s {sum(result[2] for result in results):>7.2f}s")
+    return tokens, prompt_time
+
+async def Main():
+    parser = argparse.ArgumentParser(description="Benchmark Ollama context reuse")
+    parser.add_argument("--host", default=os.getenv("OllamaHost"))
+    parser.add_argument("--model", default="Tamaneko")
+    parser.add_argument("--turns", type=int, default=len(CONVERSATION))
+    parser.add_argument("--fake", action="store_true", help="Run against Tools/FakeOllama.py instead of a real server")
+    args = parser.parse_args()
+
+    host = args.host
+    if args.fake:
+        from Tools.FakeOllama import FakeOllama
+        server = FakeOllama(0, latency=0.01, token_delay=0.0, prompt_delay=0.0005)
+        server.start()
+        host = server.url
+
+    turns = (CONVERSATION * (args.turns // len(CONVERSATION) + 1))[:args.turns]
+    client = ollama.AsyncClient(host=host)
+    # Load the model first so neither run pays for it
+    await client.generate(model=args.model, prompt="", keep_alive="10m")
+
+    history = Report("history (chat API, full conversation every turn)", await RunHistory(client, args.model, turns))
+    reuse = Report("reuse (generate API with returned context)", await RunReuse(client, args.model, turns))
+    if history[0] and reuse[1]:
+        print(f"\nReuse evaluated {reuse[0] / history[0]:.0%} of the prompt tokens, prompt eval time {history[1] / reuse[1]:.1f}x faster")
+
+if __name__ == "__main__":
+    asyncio.run(Main())
@@ -0,0 +1,146 @@
+"""
+Compares the default intents with LeanIntents for a bot in one synthetic large guild.
+
+    python Tools/BenchIntents.py --members 100000 --online 0.3
+
+Each mode runs in its own process. The bot's client is created the way main.py creates it
+(same intents and member cache options), then the guild is fed to discord.py's connection
+state the way the gateway delivers it: with all intents a GUILD_CREATE with the online members
+and their presences followed by the member chunks of the startup chunking, in lean mode only the
+GUILD_CREATE without members or presences. Reported are the resident memory the guild added,
+the members discord.py keeps and the time spent processing the events. The gateway round trips
+of chunking are not included, on a real connection they add to the startup time of the full mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+GUILD_ID = 1 << 40
+BOT_ID = GUILD_ID + 1
+CHUNK_SIZE = 1000
+
+def MemberPayload(user_id: int) -> dict:
+    return {
+        "user": {"id": str(user_id), "username": f"user{user_id % 10_000_000}", "global_name": f"User {user_id % 10_000_000}", "discriminator": "0", "avatar": None},
+        "roles": [],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "nick": None,
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+def PresencePayload(user_id: int) -> dict:
+    return {
+        "user": {"id": str(user_id)},
+        "status": "online",
+        "activities": [{"name": "Some Game", "type": 0, "created_at": 1700000000000}],
+        "client_status": {"desktop": "online"},
+    }
+
+def GuildPayload(members: int, online: int, full: bool) -> dict:
+    channels = [{"id": str(GUILD_ID + 100 + index), "type": 0, "name": f"channel-{index}", "position": index, "permission_overwrites": []} for index in range(50)]
+    data = {
+        "id": str(GUILD_ID),
+        "name": "Synthetic Guild",
+        "owner_id": str(GUILD_ID + 2),
+        "roles": [{"id": str(GUILD_ID), "name": "@everyone", "permissions": "0", "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+        "channels": channels,
+        "threads": [],
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "voice_states": [],
+        "member_count": members,
+        "large": True,
+        "unavailable": False,
+        "members": [MemberPayload(BOT_ID)],
+        "presences": [],
+    }
+    if full:
+        # Large guilds come with the online members (up to the large threshold) and their presences
+        first = [BOT_ID + 1 + index for index in range(min(online, 250))]
+        data["members"] += [MemberPayload(user_id) for user_id in first]
+        data["presences"] = [PresencePayload(user_id) for user_id in first]
+    return data
+
+async def RunMode(members: int, online_fraction: float) -> dict:
+    import discord
+    from discord.state import ChunkRequest
+
+    from main import COG_SETS, BuildBot
+    from Utils.Intents import BotIntents, MemberCacheOptions
+    from Utils.Metrics import ResidentMemoryBytes
+
+    intents = BotIntents(COG_SETS["tama"] + COG_SETS["saki"])
+    client = BuildBot("bench", command_prefix="!", intents=intents, **MemberCacheOptions(intents))
+    state = client._connection
+    state.user = discord.ClientUser(state=state, data={"id": str(BOT_ID), "username": "bench", "discriminator": "0", "avatar": None, "bot": True})
+    online = int(members * online_fraction)
+    before = ResidentMemoryBytes()
+    started = time.perf_counter()
+
+    guild = state._add_guild_from_data(GuildPayload(members, online, intents.members))
+    chunk_count = 0
+    if intents.members and state._chunk_guilds:
+        # What discord.py does after GUILD_CREATE when chunk_guilds_at_startup is on
+        request = ChunkRequest(guild.id, 0, asyncio.get_running_loop(), state._get_guild, cache=state.member_cache_flags.joined)
+        state._chunk_requests[request.nonce] = request
+        chunk_count = (members + CHUNK_SIZE - 1) // CHUNK_SIZE
+        for index in range(chunk_count):
+            ids = range(BOT_ID + index * CHUNK_SIZE, BOT_ID + min(members, (index + 1) * CHUNK_SIZE))
+            state.parse_guild_members_chunk({
+                "guild_id": str(GUILD_ID),
+                "members": [MemberPayload(user_id) for user_id in ids],
+                "presences": [PresencePayload(user_id) for user_id in ids if user_id - BOT_ID <= online] if intents.presences else [],
+                "chunk_index": index,
+                "chunk_count": chunk_count,
+                "nonce": request.nonce,
+            })
+    elapsed = time.perf_counter() - started
+    after = ResidentMemoryBytes()
+    return {
+        "intents": intents.value,
+        "members_cached": len(guild.members),
+        "chunks": chunk_count,
+        "seconds": elapsed,
+        "guild_mb": (after - before) / 1024 / 1024,
+        "resident_mb": after / 1024 / 1024,
+    }
+
+def Measure(lean: bool, members: int, online: float) -> dict:
+    env = dict(os.environ, LeanIntents="true" if lean else "false")
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--members", str(members), "--online", str(online)]
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark process failed:\n{result.stdout}\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def Main():
+    parser = argparse.ArgumentParser(description="Compare default and lean intents on a synthetic large guild")
+    parser.add_argument("--members", type=int, default=100_000)
+    parser.add_argument("--online", type=float, default=0.3, help="Fraction of members with a presence")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # main.py parses its own arguments on import
+        sys.argv = [sys.argv[0]]
+        print(json.dumps(asyncio.run(RunMode(args.members, args.online))))
+        return
+
+    print(f"Synthetic guild: {args.members} members, {args.online:.0%} online")
+    print(f"{'mode':<8}{'members kept':>14}{'chunks':>8}{'startup s':>11}{'guild MB':>10}{'RSS MB':>9}")
+    for name, lean in (("all", False), ("lean", True)):
+        result = Measure(lean, args.members, args.online)
+        print(f"{name:<8}{result['members_cached']:>14}{result['chunks']:>8}{result['seconds']:>11.2f}{result['guild_mb']:>10.1f}{result['resident_mb']:>9.1f}")
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,107 @@
+"""
+Measures the long-term memory index: disk size, resident memory and search latency.
+
+    python Tools/BenchMemory.py --rows 1000000 --dtype int8
+    python Tools/BenchMemory.py --rows 1000000 --dtype float16 --dim 768
+
+Vectors are random, which is the worst case for nothing (the scan is brute force, so the
+latency only depends on rows x dim), and texts are short synthetic messages. Embedding time
+is not included; with --host the script also times one embed call per query against Ollama.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from Utils.LongTermMemory import GuildIndex
+from Utils.Metrics import ResidentMemoryBytes
+
+def ResidentMB() -> float:
+    return ResidentMemoryBytes() / 1024 / 1024
+
+def DiskMB(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 1024 / 1024
+
+def Percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def Main():
+    parser = argparse.ArgumentParser(description="Benchmark the long-term memory vector index")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=768, help="768 for nomic-embed-text")
+    parser.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    parser.add_argument("--batch", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--path", help="Directory for the index (a temporary one by default)")
+    parser.add_argument("--host", help="Also time embedding calls against this Ollama host")
+    parser.add_argument("--embed-model", default=os.getenv("EmbedModel", "nomic-embed-text"))
+    args = parser.parse_args()
+
+    path = args.path or tempfile.mkdtemp(prefix="memory-bench-")
+    rng = np.random.default_rng(0)
+    started_rss = ResidentMB()
+    index = GuildIndex(path, args.dim, args.dtype)
+
+    started = time.monotonic()
+    for start in range(0, args.rows, args.batch):
+        count = min(args.batch, args.rows - start)
+        vectors = rng.standard_normal((count, args.dim), dtype=np.float32)
+        texts = [f"User{row % 500}: message number {row} about topic {row % 97}" for row in range(start, start + count)]
+        index.add(vectors, texts, [row % 20 for row in range(start, start + count)])
+    build = time.monotonic() - started
+    index.close()
+    del vectors, texts
+
+    started_rss = ResidentMB()
+    index = GuildIndex(path, args.dim, args.dtype)
+    opened_rss = ResidentMB()
+    queries = rng.standard_normal((args.queries + 1, args.dim), dtype=np.float32)
+    started = time.monotonic()
+    index.search(queries[0], args.top_k)
+    first = time.monotonic() - started
+    timings = []
+    for query in queries[1:]:
+        started = time.monotonic()
+        index.search(query, args.top_k)
+        timings.append(time.monotonic() - started)
+    searched_rss = ResidentMB()
+
+    print(f"{args.rows:,} rows, {args.dim} dimensions, {args.dtype}")
+    print(f"  build            {build:.1f}s ({args.rows / build:,.0f} rows/s)")
+    print(f"  disk             {DiskMB(path):,.0f} MB allocated, {index.used_bytes() / 1024 / 1024:,.0f} MB used ({index.used_bytes() / args.rows:.0f} bytes per message)")
+    print(f"  RSS after open   {opened_rss - started_rss:+,.0f} MB")
+    print(f"  RSS after search {searched_rss - started_rss:+,.0f} MB (mapped pages, reclaimable page cache)")
+    print(f"  first search     {first * 1000:.0f} ms")
+    print(f"  search p50       {Percentile(timings, 0.5) * 1000:.0f} ms, p99 {Percentile(timings, 0.99) * 1000:.0f} ms")
+
+    if args.host:
+        import ollama
+        client = ollama.AsyncClient(host=args.host)
+
+        async def Embed():
+            await client.embed(model=args.embed_model, input=["warm up"])
+            timings = []
+            for row in range(args.queries):
+                started = time.monotonic()
+                await client.embed(model=args.embed_model, input=[f"what did we say about topic {row}?"])
+                timings.append(time.monotonic() - started)
+            return timings
+
+        timings = asyncio.run(Embed())
+        print(f"  embed p50        {Percentile(timings, 0.5) * 1000:.0f} ms, p99 {Percentile(timings, 0.99) * 1000:.0f} ms ({args.embed_model})")
+
+    index.close()
+    if not args.path:
+        shutil.rmtree(path)
+
+if __name__ == "__main__":
+    Main()
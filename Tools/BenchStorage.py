@@ -0,0 +1,152 @@
+"""
+Measures how many RPG clicks per second the bot sustains with each way of saving players.
+
+    python Tools/BenchStorage.py --players 100000 --active 200 --seconds 5
+
+Every click runs the RPG cog's explore_action for one of the --active players (the ones playing
+right now, out of --players saved), like the Explore button, and saves the way the mode says:
+
+    json          rewrite players.json with indent=4 on every click (before the store)
+    row           upsert the player's row in the store on every click
+    write-behind  mark the player as changed, the cog's write-behind cache flushes in the background
+
+The clicks run back to back on the event loop, the final flush is part of the time.
+
+    python Tools/BenchStorage.py --players 100000 --full-save
+
+saves every player at once instead (like a regeneration tick that changed them all) and reports
+how long the event loop stalled: json.dump on the loop, the store written on the loop, and the
+write-behind cache, which encodes on the loop in slices and writes on the store's writer thread.
+Runs in a temporary folder, DataFiles is not touched.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ("json", "row", "write-behind")
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+class FakeInteraction:
+    def __init__(self, user_id: int):
+        self.user = FakeUser(user_id)
+
+class FakeClient:
+    pass
+
+def Player() -> dict:
+    return {
+        "level": 1, "health": 100, "max_health": 100, "stamina": 100, "max_stamina": 100, "mana": 100, "max_mana": 100,
+        "attack": 10, "defense": 5, "experience": 0, "gold": 0, "inventory": {"potion": 1}, "cooldowns": {}, "skills": [],
+    }
+
+async def RunMode(mode: str, players: int, active: int, seconds: float) -> dict:
+    from Cogs.RPGCog import RPG
+    from Utils.Storage import OpenStore
+
+    store = OpenStore(f"DataFiles/{mode}.db")
+    store.collection("rpg_players").put_many({str(user_id): Player() for user_id in range(players)})
+    store.set_meta("imported:rpg", "1")
+    os.environ["StoragePath"] = store.path
+    cog = RPG(FakeClient())
+    cog.load_data()
+    cog.writes.start()
+    if mode == "json":
+        def save_players(*user_ids):
+            with open("DataFiles/rpgFiles/players.json", "w", encoding="utf-8") as f:
+                json.dump(cog.user_data, f, indent=4)
+        cog.save_players = save_players
+    elif mode == "row":
+        cog.save_players = lambda *user_ids: cog.players.put_many({user_id: cog.user_data[user_id] for user_id in user_ids})
+
+    rng = random.Random(1)
+    clicks = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        user_id = rng.randrange(min(active, players))
+        # Clear the 5 second explore cooldown, so every click does the work
+        cog.user_data[str(user_id)]["cooldowns"].pop("explore", None)
+        await cog.explore_action(FakeInteraction(user_id))
+        clicks += 1
+        if clicks % 50 == 0:
+            # Let the flusher run like it would between interactions
+            await asyncio.sleep(0)
+    await cog.writes.stop()
+    elapsed = time.perf_counter() - started
+    return {"clicks": clicks, "seconds": elapsed, "rows": store.writes - players - 1}
+
+async def Heartbeat(lags: list, stop: asyncio.Event, period: float = 0.001):
+    # How late a 1ms sleep wakes up is how long the loop was busy with something else
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(period)
+        lags.append(time.perf_counter() - started - period)
+
+async def FullSave(mode: str, players: int) -> dict:
+    from Utils.Storage import OpenStore, WriteBehind
+
+    store = OpenStore(f"DataFiles/full-{mode}.db")
+    user_data = {str(user_id): Player() for user_id in range(players)}
+    writes = WriteBehind(store, f"full-{mode}", {"rpg_players": user_data.get})
+    writes.mark("rpg_players", *user_data)
+    lags, stop = [], asyncio.Event()
+    heartbeat = asyncio.create_task(Heartbeat(lags, stop))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    if mode == "json":
+        with open("DataFiles/rpgFiles/players.json", "w", encoding="utf-8") as f:
+            json.dump(user_data, f, indent=4)
+    elif mode == "store":
+        store.collection("rpg_players").put_many(user_data)
+    else:
+        await writes.flush()
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.05)
+    stop.set()
+    await heartbeat
+    return {"seconds": elapsed, "max_lag": max(lags), "stalled": sum(lag for lag in lags if lag > 0.01)}
+
+def Main():
+    parser = argparse.ArgumentParser(description="Compare RPG clicks per second with JSON files, row writes and the write-behind cache")
+    parser.add_argument("--players", type=int, default=10_000)
+    parser.add_argument("--active", type=int, default=200, help="Players clicking during the run")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Seconds per mode")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--full-save", action="store_true", help="Measure the event loop lag of saving every player at once")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-storage-")
+    os.makedirs(os.path.join(workdir, "DataFiles", "rpgFiles"))
+    shutil.copy(os.path.join(ROOT, "DataFiles", "rpgFiles", "monsters.json"), os.path.join(workdir, "DataFiles", "rpgFiles"))
+    os.chdir(workdir)
+    try:
+        if args.full_save:
+            print(f"Saving {args.players} players at once")
+            print(f"{'mode':<14}{'save':>9}{'max loop lag':>14}{'loop stalled':>14}")
+            for mode in ("json", "store", "write-behind"):
+                result = asyncio.run(FullSave(mode, args.players))
+                print(f"{mode:<14}{result['seconds']:>8.2f}s{result['max_lag'] * 1000:>12.1f}ms{result['stalled']:>13.2f}s")
+            return
+        print(f"{args.players} players, {args.active} of them clicking, {args.seconds:.0f}s per mode")
+        print(f"{'mode':<14}{'clicks':>9}{'clicks/s':>11}{'rows written':>14}")
+        for mode in args.modes.split(","):
+            result = asyncio.run(RunMode(mode, args.players, args.active, args.seconds))
+            print(f"{mode:<14}{result['clicks']:>9}{result['clicks'] / result['seconds']:>11.1f}{result['rows'] if mode != 'json' else 0:>14}")
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,36 @@
+"""
+Compares the resident memory of running Tama and Saki as two processes against one combined process.
+
+    python Tools/CompareMemory.py
+
+Each configuration is started with main.py --dry-run, which imports everything, creates the
+bots and loads their cogs without connecting to Discord, then prints its resident memory.
+Guild and member caches come on top of this once the bots are connected, and those are not
+shared between the bots either way.
+"""
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESIDENT = re.compile(r"([\d.]+) MB resident")
+
+def Measure(bot: str) -> float:
+    result = subprocess.run([sys.executable, "main.py", bot, "--dry-run"], cwd=ROOT, capture_output=True, text=True)
+    match = RESIDENT.search(result.stdout)
+    if result.returncode != 0 or not match:
+        raise RuntimeError(f"main.py {bot} --dry-run failed:\n{result.stdout}\n{result.stderr}")
+    return float(match.group(1))
+
+def Main():
+    tama = Measure("tama")
+    saki = Measure("saki")
+    both = Measure("both")
+    print(f"tama alone    {tama:8.1f} MB")
+    print(f"saki alone    {saki:8.1f} MB")
+    print(f"two processes {tama + saki:8.1f} MB")
+    print(f"one process   {both:8.1f} MB ({both - tama - saki:+.1f} MB, {both / (tama + saki):.0%})")
+
+if __name__ == "__main__":
+    Main()
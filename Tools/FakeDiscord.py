@@ -0,0 +1,356 @@
+"""
+Stand-in for Discord's gateway and REST API, for load testing the bots without a connection.
+
+Tools/LoadTest.py starts it and points discord.py at it. The bots log in, identify over a
+real websocket (zlib-stream compressed like Discord's), receive READY and one synthetic guild,
+and their REST calls (messages, edits, interaction responses, member fetches, command sync) are
+answered locally after --rest-latency seconds. Message creation is limited to 5 per 5 seconds
+per bot and channel with 429s like Discord does. Every bot message and interaction response is recorded,
+so the load test can measure how long each event took to be answered.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import WSMsgType, web
+
+GUILD_ID = 100_000_000_000_000_000
+PLACEHOLDER = "💭"
+
+class Account:
+    """A bot account the fake server knows, identified by its token."""
+    def __init__(self, name: str, token: str, user_id: int):
+        self.name = name
+        self.token = token
+        self.id = user_id
+        self.session = None
+
+    def user(self) -> Dict:
+        return {"id": str(self.id), "username": self.name, "global_name": self.name, "discriminator": "0", "avatar": None, "bot": True}
+
+class GatewaySession:
+    def __init__(self, socket: web.WebSocketResponse):
+        self.socket = socket
+        self.compressor = zlib.compressobj()
+        self.sequence = 0
+        self.lock = asyncio.Lock()
+
+    async def send(self, payload: Dict):
+        data = self.compressor.compress(json.dumps(payload).encode()) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        async with self.lock:
+            await self.socket.send_bytes(data)
+
+    async def dispatch(self, event: str, data: Dict):
+        self.sequence += 1
+        await self.send({"op": 0, "t": event, "s": self.sequence, "d": data})
+
+class ChannelLimit:
+    """Discord's 5 messages per 5 seconds per bot and channel, as a fixed window."""
+    def __init__(self, rate: int = 5, per: float = 5.0):
+        self.rate = rate
+        self.per = per
+        self.reset_at = 0.0
+        self.used = 0
+
+    def take(self):
+        """Returns (allowed, remaining, reset_after)."""
+        now = time.monotonic()
+        if now >= self.reset_at:
+            self.reset_at = now + self.per
+            self.used = 0
+        if self.used >= self.rate:
+            return False, 0, self.reset_at - now
+        self.used += 1
+        return True, self.rate - self.used, self.reset_at - now
+
+def Json(data, status: int = 200, headers: Dict[str, str] = None) -> web.Response:
+    # discord.py only decodes bodies whose content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(data).encode(), status=status, headers=headers, content_type="application/json")
+
+def Timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class FakeDiscord:
+    def __init__(self, accounts: List[Account], channels: List[str], members: int = 50, rest_latency: float = 0.05, rate_limits: bool = True, port: int = 0, host: str = "127.0.0.1"):
+        self.accounts = {account.token: account for account in accounts}
+        self.host = host
+        self.port = port
+        self.rest_latency = rest_latency
+        self.rate_limits = rate_limits
+        self.member_ids = [GUILD_ID + 1000 + index for index in range(members)]
+        self.member_set = set(self.member_ids)
+        self.channels = {name: GUILD_ID + 100 + index for index, name in enumerate(channels)}
+        self.ids = itertools.count(GUILD_ID + 10_000_000)
+        self.limits: Dict[tuple, ChannelLimit] = {}
+        self.interaction_tokens: Dict[str, int] = {}
+        self.requests: Dict[str, int] = {}
+        self.rate_limited = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.runner: Optional[web.AppRunner] = None
+        self.ready = threading.Event()
+        # Called with (kind, key, content, monotonic time) for bot messages and interaction responses
+        self.on_response: Callable[[str, int, str, float], None] = lambda kind, key, content, at: None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> threading.Thread:
+        """Serves from its own event loop in a background thread, so it doesn't share the bots' loop."""
+        thread = threading.Thread(target=self._run, name="fake-discord", daemon=True)
+        thread.start()
+        self.ready.wait()
+        return thread
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._serve())
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _serve(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/gateway/", self.gateway)
+        app.router.add_route("*", "/api/v10/{path:.*}", self.rest)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def call(self, coroutine, timeout: float = None):
+        """Runs a coroutine on the server's loop from another thread."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def point_discord_py(self):
+        """Makes discord.py use this server for REST and the gateway."""
+        import discord.http
+        import yarl
+        from discord.gateway import DiscordWebSocket
+        discord.http.Route.BASE = f"{self.url}/api/v10"
+        DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(f"ws://{self.host}:{self.port}/gateway/")
+
+    # Payloads
+
+    def member(self, user_id: int, bot: Account = None) -> Dict:
+        user = bot.user() if bot else {"id": str(user_id), "username": f"user{user_id % 100000}", "global_name": f"User {user_id % 100000}", "discriminator": "0", "avatar": None}
+        return {"user": user, "roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "nick": None, "deaf": False, "mute": False, "flags": 0}
+
+    def guild(self) -> Dict:
+        return {
+            "id": str(GUILD_ID),
+            "name": "Load Test",
+            "owner_id": str(self.member_ids[0]),
+            "roles": [{"id": str(GUILD_ID), "name": "@everyone", "permissions": str((1 << 41) - 1), "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+            "channels": [{"id": str(channel_id), "type": 0, "name": name, "position": index, "permission_overwrites": []} for index, (name, channel_id) in enumerate(self.channels.items())],
+            "threads": [],
+            "emojis": [],
+            "stickers": [],
+            "features": [],
+            "voice_states": [],
+            "member_count": len(self.member_ids) + len(self.accounts),
+            "large": False,
+            "unavailable": False,
+            "members": [self.member(account.id, account) for account in self.accounts.values()] + [self.member(user_id) for user_id in self.member_ids],
+            "presences": [],
+        }
+
+    def message(self, channel_id: int, author: Dict, content: str, message_id: int = None, mentions: List[Dict] = None) -> Dict:
+        return {
+            "id": str(message_id or next(self.ids)),
+            "channel_id": str(channel_id),
+            "guild_id": str(GUILD_ID),
+            "author": author,
+            "content": content,
+            "timestamp": Timestamp(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": mentions or [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+            "flags": 0,
+            "components": [],
+        }
+
+    # Gateway
+
+    async def gateway(self, request: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse(max_msg_size=0)
+        await socket.prepare(request)
+        session = GatewaySession(socket)
+        account = None
+        await session.send({"op": 10, "d": {"heartbeat_interval": 41250}})
+        async for message in socket:
+            if message.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(message.data)
+            op = payload.get("op")
+            if op == 1:
+                await session.send({"op": 11})
+            elif op == 2:
+                account = self.accounts.get(payload["d"]["token"])
+                if account is None:
+                    await socket.close(code=4004)
+                    break
+                account.session = session
+                await session.dispatch("READY", {
+                    "v": 10,
+                    "user": account.user(),
+                    "guilds": [{"id": str(GUILD_ID), "unavailable": True}],
+                    "session_id": f"session-{account.id}",
+                    "resume_gateway_url": f"ws://{self.host}:{self.port}/gateway/",
+                    "application": {"id": str(account.id), "flags": 0},
+                })
+                await session.dispatch("GUILD_CREATE", self.guild())
+            elif op == 8:
+                data = payload["d"]
+                ids = [int(user_id) for user_id in data.get("user_ids") or []] or self.member_ids
+                members = [self.member(user_id) for user_id in ids if user_id in self.member_set]
+                await session.dispatch("GUILD_MEMBERS_CHUNK", {"guild_id": str(GUILD_ID), "members": members, "chunk_index": 0, "chunk_count": 1, "nonce": data.get("nonce")})
+        if account is not None and account.session is session:
+            account.session = None
+        return socket
+
+    async def dispatch(self, accounts: List[Account], event: str, data: Dict):
+        await asyncio.gather(*(account.session.dispatch(event, data) for account in accounts if account.session))
+
+    # REST
+
+    async def rest(self, request: web.Request) -> web.StreamResponse:
+        path = request.match_info["path"]
+        parts = path.split("/")
+        route = "/".join("{token}" if index == 2 and parts[0] in ("interactions", "webhooks") else "{id}" if part.isdigit() else part for index, part in enumerate(parts))
+        self.requests[f"{request.method} {route}"] = self.requests.get(f"{request.method} {route}", 0) + 1
+        body = await request.read()
+        data = json.loads(body) if body and request.content_type == "application/json" else {}
+        if request.content_type.startswith("multipart/"):
+            data = await self._multipart_json(request, body)
+        await asyncio.sleep(self.rest_latency)
+        token = request.headers.get("Authorization", "").removeprefix("Bot ")
+        account = self.accounts.get(token)
+        now = time.monotonic()
+
+        if path == "users/@me":
+            return Json(account.user())
+        if path == "oauth2/applications/@me":
+            return Json({"id": str(account.id), "name": account.name, "description": "", "icon": None, "bot_public": True, "bot_require_code_grant": False, "owner": account.user(), "verify_key": "", "flags": 0, "team": None})
+        if path in ("gateway", "gateway/bot"):
+            return Json({"url": f"ws://{self.host}:{self.port}/gateway/", "shards": 1, "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1}})
+        if parts[0] == "applications" and parts[-1] == "commands":
+            commands = data if isinstance(data, list) else []
+            return Json([{**command, "id": str(next(self.ids)), "application_id": parts[1], "version": "1"} for command in commands])
+
+        if parts[0] == "channels" and len(parts) >= 3 and parts[2] == "messages":
+            channel_id = int(parts[1])
+            if request.method == "POST" and len(parts) == 3:
+                # The limit is per bot and channel
+                limit = self.limits.setdefault((token, channel_id), ChannelLimit())
+                allowed, remaining, reset_after = limit.take() if self.rate_limits else (True, 5, 5.0)
+                headers = {"X-RateLimit-Limit": "5", "X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset-After": f"{reset_after:.3f}", "X-RateLimit-Bucket": f"channel-{channel_id}"}
+                if not allowed:
+                    self.rate_limited += 1
+                    return Json({"message": "You are being rate limited.", "retry_after": round(reset_after, 3), "global": False}, status=429, headers={**headers, "X-RateLimit-Scope": "user", "Retry-After": str(int(reset_after) + 1)})
+                content = data.get("content") or ""
+                self.on_response("message", channel_id, content, now)
+                return Json(self.message(channel_id, account.user(), content), headers=headers)
+            if request.method == "PATCH" and len(parts) == 4:
+                content = data.get("content") or ""
+                self.on_response("edit", channel_id, content, now)
+                return Json({**self.message(channel_id, account.user(), content, int(parts[3])), "edited_timestamp": Timestamp()})
+            if request.method == "GET" and len(parts) == 3:
+                return Json([])
+            return web.Response(status=204)
+
+        if parts[0] == "interactions" and parts[-1] == "callback":
+            interaction_id = int(parts[1])
+            kind = data.get("type", 4)
+            content = (data.get("data") or {}).get("content") or ""
+            # 5 and 6 only acknowledge, the reply follows through the webhook
+            self.on_response("ack" if kind in (5, 6) else "reply", interaction_id, content, now)
+            return web.Response(status=204)
+        if parts[0] == "webhooks" and len(parts) >= 3:
+            interaction_id = self.interaction_tokens.get(parts[2])
+            if interaction_id is not None:
+                self.on_response("reply", interaction_id, data.get("content") or "", now)
+            # Webhook calls carry no token, the path has the application (= bot user) id
+            application = next((bot for bot in self.accounts.values() if str(bot.id) == parts[1]), None)
+            channel_id = next(iter(self.channels.values()))
+            return Json(self.message(channel_id, self.member(int(parts[1]), application)["user"], data.get("content") or ""))
+
+        if parts[0] == "guilds" and len(parts) == 4 and parts[2] == "members" and request.method == "GET":
+            user_id = int(parts[3])
+            if user_id in self.member_set:
+                return Json(self.member(user_id))
+            return Json({"message": "Unknown Member", "code": 10007}, status=404)
+        if request.method == "GET":
+            return Json([] if path.endswith("s") else {})
+        return web.Response(status=204)
+
+    async def _multipart_json(self, request: web.Request, body: bytes) -> Dict:
+        # Messages with files send their JSON as the payload_json part
+        marker = b'name="payload_json"'
+        start = body.find(marker)
+        if start < 0:
+            return {}
+        start = body.find(b"\r\n\r\n", start) + 4
+        end = body.find(b"\r\n--", start)
+        try:
+            return json.loads(body[start:end])
+        except ValueError:
+            return {}
+
+    # Events sent to the bots
+
+    def send_message(self, accounts: List[Account], channel: str, user_id: int, content: str, mentions: List[Account] = ()) -> int:
+        """Sends a MESSAGE_CREATE from a member to the bots, returns the channel id."""
+        channel_id = self.channels[channel]
+        member = self.member(user_id)
+        data = self.message(channel_id, member["user"], content, mentions=[account.user() for account in mentions])
+        data["member"] = {key: value for key, value in member.items() if key != "user"}
+        asyncio.run_coroutine_threadsafe(self.dispatch(accounts, "MESSAGE_CREATE", data), self.loop)
+        return channel_id
+
+    def send_interaction(self, account: Account, channel: str, user_id: int, data: Dict, kind: int = 2, message: Dict = None) -> int:
+        """Sends an INTERACTION_CREATE for a command (kind 2) or a component (kind 3), returns its id."""
+        interaction_id = next(self.ids)
+        token = f"token-{interaction_id}"
+        self.interaction_tokens[token] = interaction_id
+        channel_id = self.channels[channel]
+        payload = {
+            "id": str(interaction_id),
+            "application_id": str(account.id),
+            "type": kind,
+            "token": token,
+            "version": 1,
+            "guild_id": str(GUILD_ID),
+            "channel_id": str(channel_id),
+            "channel": {"id": str(channel_id), "type": 0, "name": channel, "guild_id": str(GUILD_ID), "position": 0, "permission_overwrites": []},
+            "member": {**self.member(user_id), "permissions": str((1 << 41) - 1)},
+            "app_permissions": str((1 << 41) - 1),
+            "locale": "en-US",
+            "guild_locale": "en-US",
+            "entitlements": [],
+            "authorizing_integration_owners": {"0": str(GUILD_ID)},
+            "context": 0,
+            "data": data,
+        }
+        if message is not None:
+            payload["message"] = message
+        asyncio.run_coroutine_threadsafe(self.dispatch([account], "INTERACTION_CREATE", payload), self.loop)
+        return interaction_id
+
+    def stop(self):
+        if self.loop is None:
+            return
+        if self.runner is not None:
+            self.call(self.runner.cleanup(), timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,198 @@
+"""
+Stand-in for an Ollama server, for trying the bots without a GPU box.
+
+    python Tools/FakeOllama.py --port 11435 --latency 0.5
+    OllamaHosts=http://127.0.0.1:11434,http://127.0.0.1:11435 python main.py --bot tama
+
+Implements the parts of the API the bots use: /api/chat (streamed and not), /api/generate,
+/api/embeddings, /api/tags and /api/ps. --fail-rate and --hang-rate make it misbehave so
+failover and circuit breaking can be watched.
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NANOSECONDS = 1_000_000_000
+
+class FakeOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, latency: float = 0.2, token_delay: float = 0.02, fail_rate: float = 0.0, hang_rate: float = 0.0, load_time: float = 0.0, host: str = "127.0.0.1", prompt_delay: float = 0.0):
+        super().__init__((host, port), FakeOllamaHandler)
+        self.latency = latency
+        self.token_delay = token_delay
+        self.prompt_delay = prompt_delay
+        self.fail_rate = fail_rate
+        self.hang_rate = hang_rate
+        self.load_time = load_time
+        self.loaded = set()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # The bots hang up on streams when they shut down or time out a request
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self) -> threading.Thread:
+        """Serves from a background thread, for use in benchmarks and load tests."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def load(self, model: str) -> int:
+        """Returns the load duration in nanoseconds, only the first request for a model pays it."""
+        with self.lock:
+            self.requests += 1
+            if model in self.loaded:
+                return 1_000_000
+            self.loaded.add(model)
+        time.sleep(self.load_time)
+        return int(self.load_time * NANOSECONDS)
+
+def FakeReply(messages) -> str:
+    prompt = messages[-1]["content"] if messages else ""
+    return f"Fake reply to: {prompt[:200]}"
+
+def FakeEmbedding(text: str, size: int = 768):
+    """Hashed bag of words, so texts that share words come out similar like real embeddings would."""
+    vector = [0.0] * size
+    for word in text.lower().split():
+        digest = hashlib.sha256(word.strip(".,!?:;\"'()").encode()).digest()
+        index = int.from_bytes(digest[:4], "little") % size
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    return vector
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    server: FakeOllama
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._json({"models": [{"name": f"{model}:latest", "model": f"{model}:latest", "size": 4 * 1024 ** 3} for model in sorted(self.server.loaded)]})
+        elif self.path == "/api/ps":
+            self._json({"models": [{"name": f"{model}:latest", "model": f"{model}:latest", "size": 4 * 1024 ** 3, "size_vram": 4 * 1024 ** 3} for model in sorted(self.server.loaded)]})
+        elif self.path in ("/", "/api/version"):
+            self._json({"version": "0.0.0-fake"})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if random.random() < self.server.fail_rate:
+            self._json({"error": "fake backend failure"}, 500)
+            return
+        if random.random() < self.server.hang_rate:
+            time.sleep(3600)
+            return
+
+        model = body.get("model", "")
+        load_duration = self.server.load(model)
+        if self.path == "/api/chat":
+            self._generate(body, FakeReply(body.get("messages", [])), load_duration, lambda text, done: {"message": {"role": "assistant", "content": text}})
+        elif self.path == "/api/generate":
+            prompt = body.get("prompt", "")
+            context = list(body.get("context") or [])
+            reply = f"Fake reply to: {prompt[:200]}" if prompt else ""
+            # Mimic the returned context growing by the prompt and reply tokens
+            new_context = context + [len(word) for word in (prompt + " " + reply).split()]
+            # Like a warm KV cache, the tokens in context are not evaluated again
+            self._generate(body, reply, load_duration, lambda text, done: {"response": text, **({"context": new_context} if done else {})}, prompt_tokens=max(1, len(prompt) // 4))
+        elif self.path == "/api/embeddings":
+            time.sleep(self.server.latency / 10)
+            self._json({"embedding": FakeEmbedding(body.get("prompt", ""))})
+        elif self.path == "/api/embed":
+            inputs = body.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            time.sleep(self.server.latency / 10)
+            self._json({"model": model, "embeddings": [FakeEmbedding(text) for text in inputs]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def _generate(self, body, reply: str, load_duration: int, shape, prompt_tokens: int = None):
+        started = time.monotonic()
+        if prompt_tokens is None:
+            prompt_tokens = max(1, sum(len(message.get("content", "")) for message in body.get("messages", [])) // 4)
+        prompt_time = self.server.latency + prompt_tokens * self.server.prompt_delay
+        time.sleep(prompt_time)
+        words = [word + " " for word in reply.split()] or [""]
+        stats = {
+            "model": body.get("model", ""),
+            "done": True,
+            "load_duration": load_duration,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_time * NANOSECONDS),
+            "eval_count": len(words),
+        }
+
+        if body.get("stream", True) is False:
+            time.sleep(self.server.token_delay * len(words))
+            stats["eval_duration"] = int(self.server.token_delay * len(words) * NANOSECONDS) or 1
+            stats["total_duration"] = int((time.monotonic() - started) * NANOSECONDS)
+            self._json({**shape("".join(words), True), **stats})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in words:
+            time.sleep(self.server.token_delay)
+            self._chunk({**shape(word, False), "model": body.get("model", ""), "done": False})
+        stats["eval_duration"] = int(self.server.token_delay * len(words) * NANOSECONDS) or 1
+        stats["total_duration"] = int((time.monotonic() - started) * NANOSECONDS)
+        self._chunk({**shape("", True), **stats})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, data):
+        line = json.dumps(data).encode() + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, data, status: int = 200):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Ollama server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed tokens")
+    parser.add_argument("--prompt-delay", type=float, default=0.0, help="Seconds spent on each prompt token before the first token")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of requests that never answer")
+    parser.add_argument("--load-time", type=float, default=0.0, help="Seconds the first request for a model takes to load it")
+    args = parser.parse_args()
+
+    server = FakeOllama(args.port, args.latency, args.token_delay, args.fail_rate, args.hang_rate, args.load_time, args.host, args.prompt_delay)
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
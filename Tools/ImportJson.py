@@ -0,0 +1,44 @@
+"""
+Imports the JSON files the Quiz and RPG cogs used to keep in DataFiles into the store.
+
+    python Tools/ImportJson.py            # import what hasn't been imported yet
+    python Tools/ImportJson.py --force    # import again, overwriting the rows with the same keys
+
+The cogs do the same on their first start, this is for importing ahead of time or again after
+editing the JSON files by hand. The JSON files are left as they are.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Cogs.QuizCog import ImportQuizJson
+from Cogs.RPGCog import ImportRPGJson
+from Utils.Storage import OpenStore
+
+def Main():
+    parser = argparse.ArgumentParser(description="Import the quiz and RPG JSON files into the store")
+    parser.add_argument("--store", help="Database file (StoragePath, DataFiles/storage.db by default)")
+    parser.add_argument("--force", action="store_true", help="Import even if it was done before")
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.store) if args.store else None
+    # The cogs read DataFiles relative to the bot folder
+    os.chdir(ROOT)
+    store = OpenStore(path)
+    for name, load in (("quiz", ImportQuizJson), ("rpg", ImportRPGJson)):
+        if args.force:
+            with store.batch():
+                load(store)
+                store.set_meta(f"imported:{name}", "1")
+            print(f"Imported {name}")
+        elif store.import_once(name, load):
+            print(f"Imported {name}")
+        else:
+            print(f"{name} was imported before, use --force to import again")
+    store.close()
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,328 @@
+"""
+Load tests the bots locally: the real bots, cogs and discord.py stack against a stand-in
+Discord (Tools/FakeDiscord.py) and a stand-in Ollama (Tools/FakeOllama.py).
+
+    python Tools/LoadTest.py saki --rate 20 --duration 60
+    python Tools/LoadTest.py both --trace traces/evening.jsonl --speed 2
+    python Tools/LoadTest.py tama --rate 5 --duration 20 --save-trace /tmp/trace.jsonl
+
+Events are replayed from a trace, or generated at --rate events per second with the --mix of
+kinds. A trace is a JSON object per line, "at" is seconds since the start:
+
+    {"at": 0.0, "type": "message", "channel": "chat", "user": 3, "content": "hi everyone"}
+    {"at": 0.4, "type": "message", "channel": "mentions", "user": 5, "content": "saki what's up", "mentions": ["saki"]}
+    {"at": 1.2, "type": "command", "bot": "saki", "channel": "general", "user": 1, "name": "quiz_status", "options": []}
+    {"at": 2.0, "type": "button", "bot": "tama", "channel": "general", "user": 1, "custom_id": "back"}
+
+Messages in the chat channel and mentions expect a reply in their channel, commands and buttons
+expect an interaction response. Reported per kind are the time until the bot first answered
+(placeholder or deferral) and until the reply text was there, plus throughput, REST calls, 429s
+and the lag of the bots' event loop with what blocked it. Everything runs in a temporary copy of DataFiles, so the
+bots' data is not touched. Other settings come from the environment like for main.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Tools.FakeDiscord import PLACEHOLDER, Account, FakeDiscord
+from Tools.FakeOllama import FakeOllama
+from Utils.LoopMonitor import LOOP_MONITOR
+from Utils.Profiler import ProfileProcess
+from Utils.Storage import FlushAll
+
+BOT_NAMES = {"tama": ("Tamaneko", "tama"), "saki": ("Autumn", "saki")}
+# Commands and buttons that only read or write the bots' own data
+SAFE_COMMANDS = ["ping", "quiz_status", "points", "list_categories", "stats", "playrpg", "register", "queue", "nowplaying"]
+BUTTONS = {"tama": ["back"]}
+DEFAULT_MIX = "chat=3,mention=1,chatter=4,command=2,button=1"
+WORDS = "the a game tonight raid boss quest loot who wants to play later anyone up for music quiz dragon sword potion cat nap snacks pizza build base server lag fun".split()
+
+def Percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class Pending:
+    def __init__(self, kind: str, sent_at: float):
+        self.kind = kind
+        self.sent_at = sent_at
+        self.ack_at: Optional[float] = None
+        self.reply_at: Optional[float] = None
+
+class Tracker:
+    """Matches the responses the fake Discord sees to the events that are waiting for one."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels: Dict[int, Deque[Pending]] = {}
+        self.interactions: Dict[int, Pending] = {}
+        self.all: List[Pending] = []
+        self.responses = 0
+
+    def expect_message(self, kind: str, channel_id: int, sent_at: float):
+        with self.lock:
+            pending = Pending(kind, sent_at)
+            self.channels.setdefault(channel_id, deque()).append(pending)
+            self.all.append(pending)
+
+    def expect_interaction(self, kind: str, interaction_id: int, sent_at: float):
+        with self.lock:
+            pending = Pending(kind, sent_at)
+            self.interactions[interaction_id] = pending
+            self.all.append(pending)
+
+    def on_response(self, kind: str, key: int, content: str, at: float):
+        with self.lock:
+            self.responses += 1
+            if kind in ("message", "edit"):
+                waiting = self.channels.get(key)
+                if not waiting:
+                    return
+                is_text = bool(content) and not content.startswith(PLACEHOLDER)
+                for pending in waiting:
+                    if pending.ack_at is None:
+                        pending.ack_at = at
+                    if is_text:
+                        pending.reply_at = at
+                if is_text:
+                    waiting.clear()
+                return
+            pending = self.interactions.get(key)
+            if pending is None:
+                return
+            if pending.ack_at is None:
+                pending.ack_at = at
+            if kind == "reply":
+                pending.reply_at = at
+                del self.interactions[key]
+
+    def waiting(self) -> int:
+        with self.lock:
+            return sum(len(waiting) for waiting in self.channels.values()) + len(self.interactions)
+
+class LoopLag:
+    """Measures how late a sleep on the event loop wakes up, sampled every interval seconds."""
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+def SyntheticTrace(names: List[str], commands: Dict[str, List[str]], rate: float, duration: float, mix: Dict[str, float], members: int, seed: int) -> List[Dict]:
+    """Poisson arrivals at rate events per second, each event's kind drawn from mix."""
+    rng = random.Random(seed)
+    kinds = [kind for kind in mix if mix[kind] > 0 and (kind != "command" or any(commands.values())) and (kind != "button" or any(name in BUTTONS for name in names))]
+    weights = [mix[kind] for kind in kinds]
+    events = []
+    at = 0.0
+    while True:
+        at += rng.expovariate(rate)
+        if at >= duration:
+            break
+        kind = rng.choices(kinds, weights)[0]
+        user = rng.randrange(members)
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 15)))
+        if kind == "chat":
+            events.append({"at": round(at, 3), "type": "message", "channel": "chat", "user": user, "content": text})
+        elif kind == "chatter":
+            events.append({"at": round(at, 3), "type": "message", "channel": "general", "user": user, "content": text})
+        elif kind == "mention":
+            bot = rng.choice(names)
+            events.append({"at": round(at, 3), "type": "message", "channel": "mentions", "user": user, "content": f"{bot} {text}", "mentions": [bot]})
+        elif kind == "command":
+            bot = rng.choice([name for name in names if commands.get(name)])
+            events.append({"at": round(at, 3), "type": "command", "bot": bot, "channel": "general", "user": user, "name": rng.choice(commands[bot]), "options": []})
+        elif kind == "button":
+            bot = rng.choice([name for name in names if name in BUTTONS])
+            events.append({"at": round(at, 3), "type": "button", "bot": bot, "channel": "general", "user": user, "custom_id": rng.choice(BUTTONS[bot])})
+    return events
+
+def LoadTrace(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return sorted(events, key=lambda event: event.get("at", 0.0))
+
+async def Replay(events: List[Dict], fake: FakeDiscord, accounts: Dict[str, Account], tracker: Tracker, speed: float) -> float:
+    """Sends the events at their times, returns how far behind schedule the last one was sent."""
+    started = time.monotonic()
+    behind = 0.0
+    for event in events:
+        due = started + event.get("at", 0.0) / speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        behind = max(behind, time.monotonic() - due)
+        user_id = fake.member_ids[event.get("user", 0) % len(fake.member_ids)]
+        channel = event.get("channel", "general")
+        kind = event["type"]
+        now = time.monotonic()
+        if kind == "message":
+            mentions = [accounts[name] for name in event.get("mentions", []) if name in accounts]
+            channel_id = fake.send_message(list(accounts.values()), channel, user_id, event["content"], mentions)
+            if channel == "chat" or mentions:
+                tracker.expect_message("mention" if mentions else "chat", channel_id, now)
+        elif kind == "command" and event.get("bot") in accounts:
+            data = {"id": str(next(fake.ids)), "name": event["name"], "type": 1, "options": event.get("options", [])}
+            interaction_id = fake.send_interaction(accounts[event["bot"]], channel, user_id, data)
+            tracker.expect_interaction(f"/{event['name']}", interaction_id, now)
+        elif kind == "button" and event.get("bot") in accounts:
+            account = accounts[event["bot"]]
+            message = fake.message(fake.channels[channel], account.user(), "🔮 Adventure Menu - Choose an action:")
+            interaction_id = fake.send_interaction(account, channel, user_id, {"custom_id": event["custom_id"], "component_type": 2}, kind=3, message=message)
+            tracker.expect_interaction(f"button {event['custom_id']}", interaction_id, now)
+    return behind
+
+def Report(tracker: Tracker, lag: LoopLag, fake: FakeDiscord, ollama: FakeOllama, events: List[Dict], elapsed: float, behind: float):
+    print(f"\nSent {len(events)} events in {elapsed:.1f}s ({len(events) / max(elapsed, 1e-9):.1f}/s, at most {behind * 1000:.0f}ms behind schedule)")
+    print(f"Bot responses: {tracker.responses} ({tracker.responses / max(elapsed, 1e-9):.1f}/s), LLM requests: {ollama.requests}, 429s: {fake.rate_limited}")
+    print(f"\n{'kind':<22}{'sent':>6}{'answered':>10}{'first p50':>11}{'first p99':>11}{'reply p50':>11}{'reply p99':>11}{'max':>9}")
+    kinds: Dict[str, List[Pending]] = {}
+    for pending in tracker.all:
+        kinds.setdefault(pending.kind, []).append(pending)
+    for kind, items in sorted(kinds.items()):
+        first = [item.ack_at - item.sent_at for item in items if item.ack_at is not None]
+        reply = [item.reply_at - item.sent_at for item in items if item.reply_at is not None]
+        print(f"{kind:<22}{len(items):>6}{len(reply):>10}{Percentile(first, 0.5):>10.3f}s{Percentile(first, 0.99):>10.3f}s{Percentile(reply, 0.5):>10.3f}s{Percentile(reply, 0.99):>10.3f}s{max(reply, default=float('nan')):>8.2f}s")
+    samples = lag.samples
+    print(f"\nEvent loop lag: p50 {Percentile(samples, 0.5) * 1000:.1f}ms, p99 {Percentile(samples, 0.99) * 1000:.1f}ms, max {max(samples, default=0) * 1000:.1f}ms ({len(samples)} samples)")
+    if LOOP_MONITOR.blockers:
+        print(f"\nEvent loop blockers: {LOOP_MONITOR.summary(10)}")
+    print("\nREST calls:")
+    for route, count in sorted(fake.requests.items(), key=lambda item: -item[1]):
+        print(f"  {count:>6}  {route}")
+
+async def Run(args, names: List[str], ollama: FakeOllama):
+    import main
+
+    accounts = {name: Account(BOT_NAMES[name][0], os.environ["TamaToken" if name == "tama" else "SakiToken"], 200_000_000_000_000_000 + index) for index, name in enumerate(names)}
+    channels = [os.environ["ChatChannel"], "mentions", "general"]
+    fake = FakeDiscord(list(accounts.values()), channels, members=args.members, rest_latency=args.rest_latency, rate_limits=not args.no_rate_limits)
+    fake.start()
+    fake.point_discord_py()
+    tracker = Tracker()
+    fake.on_response = tracker.on_response
+
+    bots, shared = main.CreateBots(names)
+    await asyncio.gather(*(main.Cog(bot.client, name).load_cogs() for name, bot in zip(names, bots)))
+    gateways = {id(bot.gateway): bot.gateway for bot in bots}.values()
+    for gateway in gateways:
+        gateway.start()
+    clients = [asyncio.create_task(bot.client.start(bot.token)) for bot in bots]
+    lag = LoopLag()
+    try:
+        ready = asyncio.ensure_future(asyncio.gather(*(bot.client.wait_until_ready() for bot in bots)))
+        await asyncio.wait([ready, *clients], timeout=60, return_when=asyncio.FIRST_COMPLETED)
+        for client in clients:
+            if client.done():
+                # Raises what stopped the bot from connecting
+                client.result()
+        if not ready.done():
+            ready.cancel()
+            raise TimeoutError("The bots did not get ready within 60 seconds")
+        print(f"{', '.join(names)} connected to the fake Discord at {fake.url}")
+        commands = {name: [command.name for command in bot.client.tree.get_commands() if command.name in SAFE_COMMANDS] for name, bot in zip(names, bots)}
+        if args.trace:
+            events = LoadTrace(args.trace)
+        else:
+            mix = {kind: float(weight) for kind, weight in (item.split("=") for item in args.mix.split(","))}
+            events = SyntheticTrace(names, commands, args.rate, args.duration, mix, args.members, args.seed)
+        if args.save_trace:
+            with open(args.save_trace, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(event) + "\n" for event in events)
+
+        lag.start()
+        LOOP_MONITOR.start()
+        started = time.monotonic()
+        profile = asyncio.create_task(ProfileProcess(events[-1]["at"] / args.speed if events else 0)) if args.profile else None
+        behind = await Replay(events, fake, accounts, tracker, args.speed)
+        drain_until = time.monotonic() + args.drain
+        while tracker.waiting() and time.monotonic() < drain_until:
+            await asyncio.sleep(0.1)
+        elapsed = time.monotonic() - started
+        await lag.stop()
+        await LOOP_MONITOR.stop()
+        Report(tracker, lag, fake, ollama, events, elapsed, behind)
+        if profile:
+            profiler = await profile
+            with open(args.profile, "w", encoding="utf-8") as f:
+                f.write(profiler.collapsed())
+            print(f"\n{profiler.summary()}\nCollapsed stacks written to {args.profile}")
+    finally:
+        await lag.stop()
+        await LOOP_MONITOR.stop()
+        for bot in bots:
+            await bot.Shutdown()
+        await asyncio.gather(*clients, return_exceptions=True)
+        await FlushAll()
+        for gateway in gateways:
+            await gateway.stop()
+        fake.stop()
+
+def Main():
+    parser = argparse.ArgumentParser(description="Load test the bots against a fake Discord and a fake Ollama")
+    parser.add_argument("bot", choices=["tama", "saki", "both"], nargs="?", default="both")
+    parser.add_argument("--trace", help="JSON lines trace to replay instead of generating events")
+    parser.add_argument("--save-trace", help="Write the events that are sent to this file")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay the trace this many times faster")
+    parser.add_argument("--rate", type=float, default=10.0, help="Generated events per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of generated events")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Relative weights of chat, mention, chatter, command and button events")
+    parser.add_argument("--members", type=int, default=200, help="Members in the synthetic guild")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drain", type=float, default=30.0, help="Seconds to wait for outstanding replies after the last event")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="Seconds the fake Discord takes per REST call")
+    parser.add_argument("--no-rate-limits", action="store_true", help="Don't emulate Discord's per-channel message limit")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds the fake Ollama takes before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between tokens from the fake Ollama")
+    parser.add_argument("--profile", help="Profile the event loop while the events are sent and write the collapsed stacks to this file")
+    args = parser.parse_args()
+    names = list(BOT_NAMES) if args.bot == "both" else [args.bot]
+
+    ollama = FakeOllama(0, latency=args.llm_latency, token_delay=args.token_delay)
+    ollama.start()
+    os.environ.update({"TamaToken": "tama-load-test", "SakiToken": "saki-load-test", "OllamaHosts": ollama.url})
+    os.environ.setdefault("ChatChannel", "chat")
+    os.environ.pop("MetricsPort", None)
+    os.environ.pop("ShardCount", None)
+
+    workdir = tempfile.mkdtemp(prefix="xpdb-loadtest-")
+    if os.path.isdir(os.path.join(ROOT, "DataFiles")):
+        shutil.copytree(os.path.join(ROOT, "DataFiles"), os.path.join(workdir, "DataFiles"))
+    previous = os.getcwd()
+    os.chdir(workdir)
+    # main.py parses its own arguments on import
+    sys.argv = [os.path.join(ROOT, "main.py"), args.bot]
+    try:
+        asyncio.run(Run(args, names, ollama))
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+        ollama.shutdown()
+
+if __name__ == "__main__":
+    Main()
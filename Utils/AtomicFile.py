@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, List
+
+from Utils.Config import EnvInt
+
+PREFIX = b'{"sha256":"'
+MIDDLE = b'","data":'
+DIGEST_LENGTH = 64
+
+class CorruptFile(Exception):
+    """A file and all of its previous generations failed to load."""
+
+def Generations(path: str, count: int = None) -> List[str]:
+    """The file followed by its previous generations, newest first: players.json, players.json.1, ..."""
+    count = count if count is not None else EnvInt("StorageGenerations", 2)
+    return [path] + [f"{path}.{index}" for index in range(1, count + 1)]
+
+def FsyncDirectory(folder: str):
+    """Makes a rename in the folder durable. Windows has no directory fsync, a replace is durable there."""
+    if os.name == "nt":
+        return
+    descriptor = os.open(folder or ".", os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+def ShiftGenerations(path: str, count: int):
+    """Moves generation 1 to 2, 2 to 3 and so on, dropping the oldest, so a new generation 1 can be written."""
+    for index in range(count - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+
+def Rotate(path: str, count: int):
+    """Shifts the generations of a file by one and keeps the current file as generation 1."""
+    if count <= 0 or not os.path.exists(path):
+        return
+    ShiftGenerations(path, count)
+    try:
+        # A hard link keeps the file in place while the new version is moved over it
+        if os.path.exists(f"{path}.1"):
+            os.remove(f"{path}.1")
+        os.link(path, f"{path}.1")
+    except OSError:
+        shutil.copyfile(path, f"{path}.1")
+
+def WriteJson(path: str, data: Any, generations: int = None, indent: int = None):
+    """
+    Writes data to path so that a crash leaves either the old or the new file, never a mix: the
+    JSON goes to a temporary file with a SHA-256 checksum, is fsynced and renamed over the old
+    file. The old file is kept as generation 1 (StorageGenerations previous versions are kept).
+    Blocks on the disk, call it from a writer thread.
+    """
+    payload = json.dumps(data, ensure_ascii=False, indent=indent).encode("utf-8")
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp = f"{path}.tmp"
+    with open(temp, "wb") as f:
+        f.write(PREFIX + hashlib.sha256(payload).hexdigest().encode() + MIDDLE + payload + b"}")
+        f.flush()
+        os.fsync(f.fileno())
+    Rotate(path, generations if generations is not None else EnvInt("StorageGenerations", 2))
+    os.replace(temp, path)
+    FsyncDirectory(folder)
+
+def ParseJson(content: bytes) -> Any:
+    """Parses a file written by WriteJson, checking its checksum, or plain JSON written before checksums or by hand."""
+    if content.startswith(PREFIX):
+        digest = content[len(PREFIX):len(PREFIX) + DIGEST_LENGTH]
+        payload = content[len(PREFIX) + DIGEST_LENGTH + len(MIDDLE):].rstrip()[:-1]
+        if hashlib.sha256(payload).hexdigest().encode() != digest:
+            raise ValueError("checksum mismatch")
+        return json.loads(payload)
+    return json.loads(content)
+
+def ReadJson(path: str, default: Any = None, generations: int = None) -> Any:
+    """
+    Loads a file written by WriteJson. If it is missing, cut short or fails its checksum, the
+    newest previous generation that loads is used instead. Returns default if neither the file
+    nor a generation exists, raises CorruptFile if they exist but none of them loads.
+    """
+    errors = []
+    for candidate in Generations(path, generations):
+        if not os.path.exists(candidate):
+            continue
+        try:
+            with open(candidate, "rb") as f:
+                data = ParseJson(f.read())
+        except (OSError, ValueError) as e:
+            errors.append(f"{candidate}: {e}")
+            continue
+        if errors or candidate != path:
+            print(f"Warning: {path} could not be loaded ({'; '.join(errors) or 'missing'}), using {candidate}")
+        return data
+    if errors:
+        raise CorruptFile(f"{path} and its previous generations could not be loaded: {'; '.join(errors)}")
+    return default
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+from Utils.Config import EnvFloat, EnvInt, EnvList
+from Utils.LazyImport import ImportAsync, LazyImport
+from Utils.Metrics import REGISTRY
+
+# ollama pulls in httpx and pydantic, it is imported in the background while the bots connect
+ollama = LazyImport("ollama")
+
+BACKEND_REQUESTS = REGISTRY.counter("llm_backend_requests_total", "Requests sent to each Ollama backend by outcome", ("host", "outcome"))
+BACKEND_LATENCY = REGISTRY.histogram("llm_backend_probe_seconds", "Health probe round trip per Ollama backend", ("host",), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+# Message the gateway cancels a request with when it took longer than its timeout
+TIMED_OUT = "timed out"
+
+class NoBackendAvailable(Exception):
+    """Raised when every backend is unhealthy or has its circuit open."""
+
+class Backend:
+    def __init__(self, host: Optional[str]):
+        self.host = host
+        self.name = host or "default"
+        self._client = None
+        self.outstanding = 0
+        self.latency = 0.0
+        self.healthy = True
+        self.failures = 0
+        self.timeouts = 0
+        self.open_until = 0.0
+
+    @property
+    def client(self) -> "ollama.AsyncClient":
+        if self._client is None:
+            self._client = ollama.AsyncClient(host=self.host)
+        return self._client
+
+    @property
+    def circuit(self) -> str:
+        if self.open_until == 0.0:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half-open"
+
+    @property
+    def available(self) -> bool:
+        circuit = self.circuit
+        return self.healthy and (circuit == "closed" or (circuit == "half-open" and self.outstanding == 0))
+
+    def record_success(self):
+        self.failures = 0
+        self.timeouts = 0
+        self.open_until = 0.0
+        self.healthy = True
+
+    def record_failure(self, threshold: int, cooldown: float):
+        self.failures += 1
+        if self.failures >= threshold or self.circuit == "half-open":
+            self.trip(f"failed {self.failures} times", cooldown)
+
+    def record_timeout(self, threshold: int, timeout_threshold: int, cooldown: float):
+        """
+        A timeout only counts as a failure while the backend also fails its health checks. A slow
+        but healthy backend (e.g. busy with long generations) is paused after timeout_threshold
+        timeouts in a row instead, so load alone doesn't push all traffic to the other backends.
+        """
+        self.timeouts += 1
+        if not self.healthy:
+            self.record_failure(threshold, cooldown)
+        elif self.timeouts >= timeout_threshold or self.circuit == "half-open":
+            self.trip(f"timed out {self.timeouts} times", cooldown)
+
+    def trip(self, reason: str, cooldown: float):
+        if self.circuit != "open":
+            print(f"Ollama backend {self.name} {reason}, pausing it for {cooldown:.0f}s")
+        self.open_until = time.monotonic() + cooldown
+
+def IsBackendFailure(error: Exception) -> bool:
+    """Client errors such as a bad request are the caller's fault and should not trip the circuit."""
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500 or error.status_code == 404
+    return True
+
+class BackendPool:
+    """
+    Spreads requests over several Ollama hosts (OllamaHosts, comma separated).
+    Requests go to the available backend with the fewest outstanding requests; failed requests
+    are retried on another backend. A backend that fails failure_threshold times in a row is
+    skipped for cooldown seconds (circuit open) and then gets a single trial request (half-open).
+    Attempts get a share of the gateway's timeout; a timed out attempt only counts as a failure
+    while the backend fails its health checks, otherwise it takes timeout_threshold in a row.
+    A background probe checks /api/tags on every backend to track health and latency.
+
+    Calls can pass an affinity key (a channel) to keep going to the backend that served the key
+    last, as long as it is available, so Ollama there can reuse the prompt it already evaluated.
+    """
+    def __init__(self, hosts: List[str] = None, timeout: float = None):
+        hosts = hosts or EnvList("OllamaHosts") or [os.getenv("OllamaHost") or None]
+        self.backends = [Backend(host) for host in hosts]
+        self.probe_interval = EnvFloat("BackendProbeInterval", 15.0)
+        # Shorter than the gateway's whole-request timeout, so a hanging backend fails and the
+        # request still has time left on another one
+        timeout = timeout if timeout is not None else EnvFloat("LLMTimeout", 120.0)
+        self.attempt_timeout = EnvFloat("BackendTimeout", timeout / min(max(len(self.backends), 2), 3))
+        self.failure_threshold = EnvInt("BackendFailureThreshold", 3)
+        self.timeout_threshold = EnvInt("BackendTimeoutThreshold", 6)
+        self.cooldown = EnvFloat("BackendCooldown", 30.0)
+        self.task: Optional[asyncio.Task] = None
+        self.affinity: "OrderedDict[object, Backend]" = OrderedDict()
+        self.affinity_size = EnvInt("BackendAffinitySize", 4096)
+        REGISTRY.gauge("llm_backend_outstanding", "Requests in flight per Ollama backend", lambda: {(backend.name,): backend.outstanding for backend in self.backends}, ("host",))
+        REGISTRY.gauge("llm_backend_available", "1 when the backend is healthy and its circuit is not open", lambda: {(backend.name,): int(backend.available) for backend in self.backends}, ("host",))
+
+    def start(self):
+        if len(self.backends) > 1 and self.probe_interval > 0 and not self.task:
+            self.task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def pick(self, exclude=(), affinity=None) -> Backend:
+        preferred = self.affinity.get(affinity) if affinity is not None else None
+        if preferred is not None and preferred not in exclude and preferred.available:
+            return preferred
+        candidates = [backend for backend in self.backends if backend not in exclude and backend.available]
+        if not candidates:
+            # Everything is down, try whichever backend is closest to coming back rather than failing outright
+            candidates = [backend for backend in self.backends if backend not in exclude and backend.healthy] or [backend for backend in self.backends if backend not in exclude]
+            if not candidates:
+                raise NoBackendAvailable("no Ollama backend is available")
+            return min(candidates, key=lambda backend: backend.open_until)
+        return min(candidates, key=lambda backend: (backend.outstanding, backend.latency))
+
+    async def call(self, operation: Callable[["ollama.AsyncClient"], Awaitable], can_retry: Callable[[], bool] = lambda: True, affinity=None):
+        """Runs operation(client) on the best backend, failing over to the others on errors."""
+        tried = []
+        last_error = None
+        while len(tried) < len(self.backends):
+            backend = self.pick(tried, affinity)
+            tried.append(backend)
+            backend.outstanding += 1
+            try:
+                result = await asyncio.wait_for(operation(backend.client), self.attempt_timeout)
+            except asyncio.CancelledError as e:
+                # The gateway ran out of time while this backend was answering, that counts like the
+                # backend's own timeout. Other cancellations (a superseded reply) don't count.
+                if e.args and e.args[0] == TIMED_OUT:
+                    BACKEND_REQUESTS.inc(host=backend.name, outcome="timed_out")
+                    backend.record_timeout(self.failure_threshold, self.timeout_threshold, self.cooldown)
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    BACKEND_REQUESTS.inc(host=backend.name, outcome="timed_out")
+                    backend.record_timeout(self.failure_threshold, self.timeout_threshold, self.cooldown)
+                    last_error = e
+                    if not can_retry():
+                        raise
+                    print(f"Ollama backend {backend.name} took longer than {self.attempt_timeout:g}s, trying another")
+                    continue
+                if not IsBackendFailure(e):
+                    BACKEND_REQUESTS.inc(host=backend.name, outcome="rejected")
+                    raise
+                BACKEND_REQUESTS.inc(host=backend.name, outcome="failed")
+                backend.record_failure(self.failure_threshold, self.cooldown)
+                last_error = e
+                if not can_retry():
+                    raise
+                print(f"Ollama backend {backend.name} failed ({type(e).__name__}: {e}), trying another")
+                continue
+            finally:
+                backend.outstanding -= 1
+            backend.record_success()
+            BACKEND_REQUESTS.inc(host=backend.name, outcome="ok")
+            if affinity is not None and len(self.backends) > 1:
+                self.affinity[affinity] = backend
+                self.affinity.move_to_end(affinity)
+                while len(self.affinity) > self.affinity_size:
+                    self.affinity.popitem(last=False)
+            return result
+        raise last_error or NoBackendAvailable("no Ollama backend is available")
+
+    async def probe(self, backend: Backend):
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(backend.client.list(), timeout=5)
+        except Exception as e:
+            if backend.healthy:
+                print(f"Ollama backend {backend.name} failed its health check: {e}")
+            backend.healthy = False
+            return
+        elapsed = time.monotonic() - started
+        BACKEND_LATENCY.observe(elapsed, host=backend.name)
+        backend.latency = elapsed if backend.latency == 0.0 else 0.8 * backend.latency + 0.2 * elapsed
+        if not backend.healthy:
+            print(f"Ollama backend {backend.name} is healthy again")
+        backend.healthy = True
+
+    async def _probe_loop(self):
+        await ImportAsync(ollama)
+        while True:
+            await asyncio.gather(*(self.probe(backend) for backend in self.backends))
+            await asyncio.sleep(self.probe_interval)
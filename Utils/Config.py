@@ -0,0 +1,46 @@
+import os
+from typing import List
+
+def EnvInt(name: str, default: int) -> int:
+    """
+    Reads an integer setting from the environment, falling back to the default if it is missing or invalid.
+    """
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Warning: {name}={value!r} is not an integer. Using {default}.")
+        return default
+
+def EnvFloat(name: str, default: float) -> float:
+    """
+    Reads a float setting from the environment, falling back to the default if it is missing or invalid.
+    """
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Warning: {name}={value!r} is not a number. Using {default}.")
+        return default
+
+def EnvBool(name: str, default: bool) -> bool:
+    """
+    Reads a true/false setting from the environment (1/0, true/false, yes/no, on/off).
+    """
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def EnvList(name: str, default: List[str] = None) -> List[str]:
+    """
+    Reads a comma separated setting from the environment.
+    """
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return list(default or [])
+    return [item.strip() for item in value.split(",") if item.strip()]
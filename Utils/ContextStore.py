@@ -0,0 +1,116 @@
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from Utils.Config import EnvInt
+
+def EstimateTokens(text: str) -> int:
+    """Rough token count (about 4 characters per token), good enough for budgeting prompts."""
+    return max(1, len(text) // 4)
+
+class ChannelContext:
+    def __init__(self):
+        self.turns: Deque[Dict] = deque()
+        self.tokens = 0
+        # Token ids Ollama returned for the conversation so far, see ContextStore.build_prompt
+        self.kv: Optional[List[int]] = None
+        self.kv_model: Optional[str] = None
+
+class ContextStore:
+    """
+    Keeps the recent conversation turns of each channel in memory.
+    Each channel is trimmed to channel_tokens, and the least recently used channels are
+    dropped once all channels together hold more than max_tokens.
+
+    With context reuse, each channel also keeps the context Ollama returned from its last
+    generation, so the next turn only sends the new message and Ollama can reuse the cached
+    prompt instead of evaluating the persona and the whole history again. The saved context is
+    dropped once it grows past kv_tokens, and the next turn starts over from the trimmed history.
+    """
+    def __init__(self, channel_tokens: int = None, max_tokens: int = None, kv_tokens: int = None):
+        self.channel_tokens = channel_tokens or EnvInt("ContextTokens", 1024)
+        self.max_tokens = max_tokens or EnvInt("ContextMaxTokens", 500000)
+        self.kv_tokens = kv_tokens or EnvInt("ContextReuseTokens", 2048)
+        self.channels: "OrderedDict[int, ChannelContext]" = OrderedDict()
+        self.total_tokens = 0
+        self.reused = 0
+        self.restarted = 0
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self.channels
+
+    def append(self, channel_id: int, role: str, content: str):
+        if not content:
+            return
+        context = self._touch(channel_id)
+        tokens = EstimateTokens(content)
+        context.turns.append({"role": role, "content": content, "tokens": tokens})
+        context.tokens += tokens
+        self.total_tokens += tokens
+        self._trim(context, self.channel_tokens)
+        self._evict()
+
+    def build(self, channel_id: int, prompt: Dict) -> List[Dict]:
+        """Returns the channel history followed by prompt, newest turns kept first when over budget."""
+        budget = self.channel_tokens - EstimateTokens(prompt["content"])
+        history = []
+        context = self.channels.get(channel_id)
+        if context:
+            self.channels.move_to_end(channel_id)
+            for turn in reversed(context.turns):
+                budget -= turn["tokens"]
+                if budget < 0:
+                    break
+                history.append({"role": turn["role"], "content": turn["content"]})
+            history.reverse()
+        return history + [prompt]
+
+    def build_prompt(self, channel_id: int, prompt: Dict, model: str, assistant_name: str) -> Tuple[str, List[int]]:
+        """
+        Returns the prompt text and the saved context to generate with. Without a usable saved
+        context the history is written out as a transcript in front of the new message.
+        """
+        context = self.channels.get(channel_id)
+        if context and context.kv and context.kv_model == model:
+            self.channels.move_to_end(channel_id)
+            self.reused += 1
+            return prompt["content"], context.kv
+
+        self.restarted += 1
+        lines = []
+        for turn in self.build(channel_id, prompt)[:-1]:
+            lines.append(f"{assistant_name}: {turn['content']}" if turn["role"] == "assistant" else turn["content"])
+        lines.append(prompt["content"])
+        return "\n".join(lines), []
+
+    def save_kv(self, channel_id: int, model: str, kv: Optional[List[int]]):
+        context = self.channels.get(channel_id)
+        if context is None:
+            return
+        if not kv or len(kv) > self.kv_tokens:
+            kv = None
+        context.kv = kv
+        context.kv_model = model if kv else None
+
+    def clear(self, channel_id: int):
+        context = self.channels.pop(channel_id, None)
+        if context:
+            self.total_tokens -= context.tokens
+
+    def _touch(self, channel_id: int) -> ChannelContext:
+        context = self.channels.get(channel_id)
+        if context is None:
+            context = self.channels[channel_id] = ChannelContext()
+        else:
+            self.channels.move_to_end(channel_id)
+        return context
+
+    def _trim(self, context: ChannelContext, budget: int):
+        while context.tokens > budget and len(context.turns) > 1:
+            turn = context.turns.popleft()
+            context.tokens -= turn["tokens"]
+            self.total_tokens -= turn["tokens"]
+
+    def _evict(self):
+        while self.total_tokens > self.max_tokens and len(self.channels) > 1:
+            _, context = self.channels.popitem(last=False)
+            self.total_tokens -= context.tokens
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Set
+
+import discord
+
+from Utils.Config import EnvFloat
+
+class ChannelDebouncer:
+    """
+    Collects messages per channel and calls handler with the whole batch once the channel has
+    been quiet for window seconds. A message that arrives while the handler is still running
+    cancels it, and the unanswered messages are folded into the next batch. So a busy channel
+    still gets answers, a batch goes out once its oldest message has waited max_wait seconds,
+    and that batch is answered to the end: messages arriving meanwhile wait for the next one.
+    """
+    def __init__(self, handler: Callable[[List[discord.Message]], Awaitable[None]], window: float = None, max_wait: float = None):
+        self.handler = handler
+        self.window = window if window is not None else EnvFloat("ChatDebounceWindow", 2.0)
+        self.max_wait = max_wait if max_wait is not None else EnvFloat("ChatDebounceMaxWait", 8.0)
+        self.pending: Dict[int, List[discord.Message]] = {}
+        # When each pending message arrived, the first one is what max_wait counts from
+        self.arrived: Dict[int, List[float]] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.answering: Set[int] = set()
+        self.committed: Set[int] = set()
+        self.messages = 0
+        self.batches = 0
+        self.superseded = 0
+        self.capped = 0
+
+    def push(self, message: discord.Message):
+        channel_id = message.channel.id
+        self.messages += 1
+        self.pending.setdefault(channel_id, []).append(message)
+        self.arrived.setdefault(channel_id, []).append(time.monotonic())
+        if channel_id in self.committed:
+            # The batch being answered went out because of max_wait, this message goes into the next one
+            return
+        task = self.tasks.get(channel_id)
+        if task and not task.done():
+            task.cancel()
+            if channel_id in self.answering:
+                self.superseded += 1
+        self.schedule(channel_id)
+
+    def schedule(self, channel_id: int):
+        waited = time.monotonic() - self.arrived[channel_id][0]
+        delay = max(0.0, min(self.window, self.max_wait - waited))
+        self.tasks[channel_id] = asyncio.create_task(self._run(channel_id, delay))
+
+    async def _run(self, channel_id: int, delay: float):
+        await asyncio.sleep(delay)
+        batch = list(self.pending.get(channel_id, []))
+        if not batch:
+            return
+        if time.monotonic() - self.arrived[channel_id][0] >= self.max_wait:
+            self.committed.add(channel_id)
+            self.capped += 1
+        self.answering.add(channel_id)
+        self.batches += 1
+        try:
+            await self.handler(batch)
+        except Exception as e:
+            print(f"Error while answering batch in channel {channel_id}: {e}")
+        finally:
+            self.answering.discard(channel_id)
+            self.committed.discard(channel_id)
+        remaining = self.pending.get(channel_id, [])[len(batch):]
+        if remaining:
+            self.pending[channel_id] = remaining
+            self.arrived[channel_id] = self.arrived[channel_id][len(batch):]
+            self.schedule(channel_id)
+        else:
+            self.pending.pop(channel_id, None)
+            self.arrived.pop(channel_id, None)
+            self.tasks.pop(channel_id, None)
+
+    async def close(self):
+        tasks = [task for task in self.tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks.clear()
+        self.pending.clear()
+        self.arrived.clear()
@@ -0,0 +1,150 @@
+import ast
+import asyncio
+import importlib.util
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import discord
+
+from Utils.Config import EnvBool, EnvFloat, EnvInt, EnvList
+from Utils.Metrics import REGISTRY
+
+# What the bots themselves need to chat, on top of what their cogs declare
+BOT_INTENTS = ("guilds", "guild_messages", "dm_messages", "message_content")
+
+def DeclaredIntents(module: str) -> Optional[Tuple[str, ...]]:
+    """
+    Reads the REQUIRED_INTENTS tuple a cog module declares, without importing it, so working out
+    the intents doesn't load the cog twice. Returns None if the module declares none.
+    """
+    spec = importlib.util.find_spec(module)
+    if spec is None or not spec.origin:
+        return None
+    with open(spec.origin, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), spec.origin)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "REQUIRED_INTENTS" for target in node.targets):
+            return tuple(ast.literal_eval(node.value))
+    return None
+
+def BotIntents(cogs: List[str]) -> discord.Intents:
+    """
+    The intents for a bot that loads these cogs. By default that is everything, so discord.py
+    receives and caches every member and presence. With LeanIntents only the intents the bot and
+    its cogs declare are requested (plus ExtraIntents), a cog that declares nothing gets everything.
+    """
+    if not EnvBool("LeanIntents", False):
+        return discord.Intents.all()
+    names = set(BOT_INTENTS) | set(EnvList("ExtraIntents"))
+    for cog in cogs:
+        declared = DeclaredIntents(cog)
+        if declared is None:
+            print(f"Warning: {cog} doesn't declare REQUIRED_INTENTS, enabling all intents.")
+            return discord.Intents.all()
+        names.update(declared)
+    intents = discord.Intents.none()
+    for name in sorted(names):
+        if not hasattr(discord.Intents, name):
+            print(f"Warning: unknown intent {name!r}, ignoring it.")
+            continue
+        setattr(intents, name, True)
+    return intents
+
+def MemberCacheOptions(intents: discord.Intents) -> Dict:
+    """
+    Client options for the member cache. In lean mode discord.py only keeps the members the
+    intents deliver, and guilds are not chunked at startup, MemberLookup fetches them when needed.
+    """
+    if not EnvBool("LeanIntents", False):
+        return {}
+    return {
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        "chunk_guilds_at_startup": False,
+    }
+
+class MemberLookup:
+    """
+    Finds guild members without keeping every member of every guild in memory. Members discord.py
+    has cached are used as they are, others are fetched from the API and kept in a small LRU
+    (MemberCacheSize entries for MemberCacheTTL seconds), including users that left the guild.
+    When a lookup misses MemberChunkThreshold members or more and the members intent is enabled,
+    the guild is chunked once instead of fetching the members one by one.
+    """
+    def __init__(self, intents: discord.Intents, owner: str = "", size: int = None, ttl: float = None):
+        self.intents = intents
+        self.size = size or EnvInt("MemberCacheSize", 1000)
+        self.ttl = ttl if ttl is not None else EnvFloat("MemberCacheTTL", 600.0)
+        self.chunk_threshold = EnvInt("MemberChunkThreshold", 50)
+        self.concurrency = max(1, EnvInt("MemberFetchConcurrency", 4))
+        self.entries: "OrderedDict[Tuple[int, int], Tuple[float, Optional[discord.Member]]]" = OrderedDict()
+        self.counts = {"cached": 0, "hit": 0, "fetched": 0, "missing": 0, "chunked": 0}
+        REGISTRY.gauge("discord_member_lookups_total", "Member lookups by where the member came from", lambda: {(owner, result): count for result, count in self.counts.items()}, ("bot", "result"), owner, kind="counter")
+        REGISTRY.gauge("discord_member_lookup_entries", "Fetched members held by the member lookup", lambda: {(owner,): len(self.entries)}, ("bot",), owner)
+
+    async def get(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        return (await self.many(guild, [user_id]))[user_id]
+
+    async def many(self, guild: discord.Guild, user_ids: Iterable[int]) -> Dict[int, Optional[discord.Member]]:
+        found: Dict[int, Optional[discord.Member]] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            member = guild.get_member(user_id)
+            if member is not None:
+                self.counts["cached"] += 1
+                found[user_id] = member
+                continue
+            entry = self._cached(guild.id, user_id)
+            if entry is not None:
+                self.counts["hit"] += 1
+                found[user_id] = entry[1]
+                continue
+            missing.append(user_id)
+
+        if len(missing) >= self.chunk_threshold and self.intents.members and not guild.chunked:
+            await guild.chunk(cache=True)
+            self.counts["chunked"] += 1
+            still_missing = []
+            for user_id in missing:
+                member = guild.get_member(user_id)
+                if member is not None:
+                    found[user_id] = member
+                else:
+                    still_missing.append(user_id)
+            missing = still_missing
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(user_id: int):
+            async with semaphore:
+                found[user_id] = await self._fetch(guild, user_id)
+
+        await asyncio.gather(*(fetch(user_id) for user_id in missing))
+        return found
+
+    def _cached(self, guild_id: int, user_id: int) -> Optional[Tuple[float, Optional[discord.Member]]]:
+        key = (guild_id, user_id)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    async def _fetch(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        try:
+            member = await guild.fetch_member(user_id)
+            self.counts["fetched"] += 1
+        except discord.NotFound:
+            member = None
+            self.counts["missing"] += 1
+        except discord.HTTPException as e:
+            print(f"Could not fetch member {user_id} of {guild.name}: {e}")
+            return None
+        self.entries[(guild.id, user_id)] = (time.monotonic() + self.ttl, member)
+        self.entries.move_to_end((guild.id, user_id))
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return member
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from Utils.BackendPool import TIMED_OUT, BackendPool
+from Utils.Config import EnvFloat, EnvInt
+from Utils.Metrics import REGISTRY
+from Utils.ModelResidency import RecordLoad
+from Utils.PriorityScheduler import LOWEST_PRIORITY, PRIORITIES, GatewayBusy, PriorityScheduler, RequestShed
+
+LABELS = ("model", "trigger")
+QUEUE_WAIT = REGISTRY.histogram("llm_queue_wait_seconds", "Time requests spent queued before a worker picked them up", LABELS)
+FIRST_TOKEN = REGISTRY.histogram("llm_time_to_first_token_seconds", "Time from the start of generation to the first token", LABELS)
+DURATION = REGISTRY.histogram("llm_request_duration_seconds", "Time from the start of generation to the full reply", LABELS)
+TOKENS_PER_SECOND = REGISTRY.histogram("llm_tokens_per_second", "Completion tokens generated per second", LABELS, buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+PROMPT_TOKENS = REGISTRY.counter("llm_prompt_tokens_total", "Prompt tokens evaluated", LABELS)
+COMPLETION_TOKENS = REGISTRY.counter("llm_completion_tokens_total", "Completion tokens generated", LABELS)
+REQUESTS = REGISTRY.counter("llm_requests_total", "Finished LLM requests by outcome", LABELS + ("outcome",))
+ERRORS = REGISTRY.counter("llm_errors_total", "Failed LLM requests by exception class", LABELS + ("error",))
+NANOSECONDS = 1e9
+
+class LLMRequest:
+    def __init__(self, model: str, messages: List[Dict], timeout: float, on_chunk: Callable[[str], None] = None,
+                 trigger: str = "mention", user_key=None, guild_key=None, context: List[int] = None, affinity=None):
+        self.model = model
+        self.messages = messages
+        self.timeout = timeout
+        self.on_chunk = on_chunk
+        self.trigger = trigger
+        self.priority = PRIORITIES.get(trigger, LOWEST_PRIORITY)
+        self.user_key = user_key
+        self.guild_key = guild_key
+        # When context is not None the request uses Ollama's generate API with the last message as the
+        # prompt, and context is replaced by the one Ollama returns
+        self.context = context
+        self.affinity = affinity
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.stats: Dict = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def cancel(self):
+        """Cancels the request whether it is still queued or already generating."""
+        if not self.future.done():
+            self.future.cancel()
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+class LLMGateway:
+    """
+    Queues chat requests and runs them on a fixed number of workers using the async Ollama client,
+    so generations never block the event loop. The queue is a PriorityScheduler, so mentions are
+    answered before random interjections and users and guilds take turns.
+    """
+    def __init__(self, workers: int = None, max_queue: int = None, timeout: float = None, hosts: List[str] = None):
+        self.worker_count = workers or EnvInt("LLMWorkers", 2)
+        self.timeout = timeout or EnvFloat("LLMTimeout", 120.0)
+        self.queue = PriorityScheduler(max_depth=max_queue)
+        self.pool = BackendPool(hosts, self.timeout)
+        self.keep_alive = os.getenv("ModelKeepAlive", "10m")
+        self.workers: List[asyncio.Task] = []
+        self.active = 0
+        REGISTRY.gauge("llm_queue_depth", "Requests waiting for a worker", lambda: {(str(priority),): depth for priority, depth in self.queue.depth_by_priority().items()}, ("priority",))
+        REGISTRY.gauge("llm_active_requests", "Requests currently generating", lambda: self.active)
+        REGISTRY.gauge("llm_shed_total", "Low priority requests dropped by reason", lambda: {(reason,): count for reason, count in self.queue.shed.items()}, ("reason",), kind="counter")
+        REGISTRY.gauge("llm_rejected_total", "Requests rejected by reason", lambda: {(reason,): count for reason, count in self.queue.rejected.items()}, ("reason",), kind="counter")
+
+    def start(self):
+        if self.workers:
+            return
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        self.pool.start()
+        print(f"LLM gateway started with {self.worker_count} workers")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.queue.drain()
+        await self.pool.stop()
+
+    def submit(self, model: str, messages: List[Dict], timeout: float = None, on_chunk: Callable[[str], None] = None,
+               trigger: str = "mention", user_key=None, guild_key=None, context: List[int] = None, affinity=None) -> LLMRequest:
+        """
+        Queues a request without waiting. Raises GatewayBusy when the queue is full or the user/guild
+        already has too many requests queued, and RequestShed when a low priority request is dropped.
+        If on_chunk is given the reply is streamed and on_chunk receives the text generated so far.
+        Requests with the same affinity key go to the same backend while it is available.
+        """
+        if not self.workers:
+            self.start()
+        request = LLMRequest(model, messages, timeout or self.timeout, on_chunk, trigger, user_key, guild_key, context, affinity)
+        self.queue.put(request)
+        return request
+
+    async def generate(self, model: str, messages: List[Dict], timeout: float = None, on_chunk: Callable[[str], None] = None,
+                       trigger: str = "mention", user_key=None, guild_key=None) -> str:
+        """Queues a request and waits for the reply. Cancelling the caller cancels the generation."""
+        return await self.wait(self.submit(model, messages, timeout, on_chunk, trigger, user_key, guild_key))
+
+    async def wait(self, request: LLMRequest) -> str:
+        """Waits for a submitted request. Cancelling the caller cancels the generation."""
+        try:
+            return await request.future
+        except asyncio.CancelledError:
+            request.cancel()
+            raise
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self.queue.depth,
+            "active": self.active,
+            "shed": dict(self.queue.shed),
+            "rejected": dict(self.queue.rejected),
+        }
+
+    async def _worker(self, index: int):
+        while True:
+            request = await self.queue.get()
+            try:
+                await self._process(request)
+            except Exception as e:
+                print(f"LLM worker {index} error: {e}")
+
+    async def _process(self, request: LLMRequest):
+        self.active += 1
+        request.started_at = time.monotonic()
+        QUEUE_WAIT.observe(request.started_at - request.enqueued_at, model=request.model, trigger=request.trigger)
+        request.task = asyncio.create_task(self._chat(request))
+        request.future.add_done_callback(lambda future: request.task.cancel() if future.cancelled() else None)
+        try:
+            done, _ = await asyncio.wait({request.task}, timeout=request.timeout)
+            if not done:
+                request.task.cancel(TIMED_OUT)
+                if not request.future.done():
+                    request.future.set_exception(asyncio.TimeoutError(f"{request.model} did not answer within {request.timeout}s"))
+            elif request.task.cancelled():
+                request.future.cancel()
+            elif request.future.done():
+                pass
+            elif request.task.exception():
+                request.future.set_exception(request.task.exception())
+            else:
+                request.future.set_result(request.task.result())
+        except asyncio.CancelledError:
+            request.cancel()
+            raise
+        finally:
+            self.active -= 1
+            self._record(request)
+
+    def _record(self, request: LLMRequest):
+        labels = {"model": request.model, "trigger": request.trigger}
+        future = request.future
+        if not future.done() or future.cancelled():
+            REQUESTS.inc(outcome="cancelled", **labels)
+            return
+        error = future.exception()
+        if error is not None:
+            REQUESTS.inc(outcome="timeout" if isinstance(error, asyncio.TimeoutError) else "error", **labels)
+            ERRORS.inc(error=type(error).__name__, **labels)
+            return
+
+        REQUESTS.inc(outcome="ok", **labels)
+        DURATION.observe(time.monotonic() - request.started_at, **labels)
+        stats = request.stats
+        if request.first_token_at is not None:
+            FIRST_TOKEN.observe(request.first_token_at - request.started_at, **labels)
+        elif stats.get("prompt_eval_duration") is not None:
+            # Without streaming the first token time is what Ollama spent loading and reading the prompt
+            FIRST_TOKEN.observe((stats.get("load_duration", 0) + stats["prompt_eval_duration"]) / NANOSECONDS, **labels)
+        RecordLoad(request.model, stats, request.trigger)
+        PROMPT_TOKENS.inc(stats.get("prompt_eval_count", 0), **labels)
+        COMPLETION_TOKENS.inc(stats.get("eval_count", 0), **labels)
+        if stats.get("eval_count") and stats.get("eval_duration"):
+            TOKENS_PER_SECOND.observe(stats["eval_count"] / (stats["eval_duration"] / NANOSECONDS), **labels)
+
+    async def _chat(self, request: LLMRequest) -> str:
+        # A streamed reply can only move to another backend before any text was shown
+        return await self.pool.call(
+            lambda client: self._chat_on(client, request),
+            can_retry=lambda: request.first_token_at is None,
+            affinity=request.affinity,
+        )
+
+    async def _chat_on(self, client, request: LLMRequest) -> str:
+        if request.context is not None:
+            return await self._generate_on(client, request)
+        if not request.on_chunk:
+            response = await client.chat(
+                model=request.model,
+                messages=request.messages,
+                stream=False,
+                keep_alive=self.keep_alive,
+            )
+            request.stats = response
+            return response['message']['content']
+
+        text = ""
+        stream = await client.chat(
+            model=request.model,
+            messages=request.messages,
+            stream=True,
+            keep_alive=self.keep_alive,
+        )
+        async for part in stream:
+            if part.get('done'):
+                request.stats = part
+            content = part['message']['content']
+            if not content:
+                continue
+            if request.first_token_at is None:
+                request.first_token_at = time.monotonic()
+            text += content
+            request.on_chunk(text)
+        return text
+
+    async def _generate_on(self, client, request: LLMRequest) -> str:
+        prompt = request.messages[-1]['content']
+        if not request.on_chunk:
+            response = await client.generate(
+                model=request.model,
+                prompt=prompt,
+                context=request.context or None,
+                stream=False,
+                keep_alive=self.keep_alive,
+            )
+            request.stats = response
+            request.context = response.get('context')
+            return response['response']
+
+        text = ""
+        stream = await client.generate(
+            model=request.model,
+            prompt=prompt,
+            context=request.context or None,
+            stream=True,
+            keep_alive=self.keep_alive,
+        )
+        async for part in stream:
+            if part.get('done'):
+                request.stats = part
+                request.context = part.get('context')
+            content = part.get('response')
+            if not content:
+                continue
+            if request.first_token_at is None:
+                request.first_token_at = time.monotonic()
+            text += content
+            request.on_chunk(text)
+        return text
@@ -0,0 +1,50 @@
+import asyncio
+import importlib
+import threading
+from typing import List
+
+LAZY_MODULES: List[str] = []
+
+class LazyModule:
+    """Stands in for a module and imports it the first time one of its attributes is used."""
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}{' (loaded)' if self._module is not None else ''}>"
+
+def LazyImport(name: str) -> LazyModule:
+    """
+    Returns a stand-in for a heavy module that is only imported when it is first used, so it
+    doesn't add to the startup time. PreloadLazyModules imports them later in the background.
+    """
+    if name not in LAZY_MODULES:
+        LAZY_MODULES.append(name)
+    return LazyModule(name)
+
+def PreloadLazyModules() -> threading.Thread:
+    """
+    Imports the lazy modules in a background thread, in the order they were declared, while the
+    bots wait on Discord. Using a module before it is done just waits for its import to finish.
+    """
+    def load():
+        for name in list(LAZY_MODULES):
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"Could not preload {name}: {e}")
+
+    thread = threading.Thread(target=load, name="preload-modules", daemon=True)
+    thread.start()
+    return thread
+
+async def ImportAsync(module: LazyModule):
+    """Waits for a lazy module to be imported without blocking the event loop, e.g. before first using it."""
+    await asyncio.to_thread(importlib.import_module, module._name)
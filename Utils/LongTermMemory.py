@@ -0,0 +1,304 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from Utils.AtomicFile import ReadJson, WriteJson
+from Utils.Config import EnvBool, EnvFloat, EnvInt
+from Utils.LazyImport import LazyImport
+from Utils.Metrics import REGISTRY
+from Utils.OrderedWriter import WriterFor
+
+# Long-term memory is off by default, numpy is only imported once it is used
+np = LazyImport("numpy")
+
+RECALL_TIME = REGISTRY.histogram("memory_recall_seconds", "Time to embed a prompt and search the guild's long-term memory", ("model",), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+SEARCH_TIME = REGISTRY.histogram("memory_search_seconds", "Time to scan a guild's vector index", ("model",), buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+STORED = REGISTRY.counter("memory_stored_total", "Messages embedded into long-term memory", ("model",))
+DROPPED = REGISTRY.counter("memory_dropped_total", "Oldest messages dropped because MemoryMaxPending were waiting to be embedded", ("model",))
+META_FIELDS = [("offset", "<i8"), ("length", "<i4"), ("channel", "<i8")]
+DTYPES = ("int8", "float16")
+SEARCH_CHUNK = 4096
+
+def Quantize(vectors: "np.ndarray", dtype) -> "np.ndarray":
+    """Normalizes the vectors so a dot product is the cosine similarity, then stores them compactly."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.maximum(norms, 1e-12)
+    if dtype == np.int8:
+        return np.clip(np.rint(vectors * 127), -127, 127).astype(np.int8)
+    return vectors.astype(dtype)
+
+class GuildIndex:
+    """
+    Append-only vector index of one guild, memory-mapped from three files:
+    vectors.bin (count x dim, int8 or float16), meta.bin (text offset/length and channel per row)
+    and texts.bin (the message texts, utf-8). index.json holds the row count and is written
+    after the data, so rows from an interrupted append are ignored and overwritten. Opening and
+    appending run on the guild's writer thread. Once closed an index stays closed, the guild is
+    opened again as a new GuildIndex that sees the rows appended since.
+    """
+    def __init__(self, path: str, dim: int, dtype: str = "int8"):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        header = self._read_header()
+        if header and (header["dim"] != dim or header["dtype"] != dtype):
+            raise ValueError(f"{path} holds {header['dim']}-dimensional {header['dtype']} vectors, not {dim}-dimensional {dtype}")
+        self.dim = dim
+        self.dtype_name = dtype
+        self.dtype = np.dtype(dtype)
+        self.meta_dtype = np.dtype(META_FIELDS)
+        self.count = header["count"] if header else 0
+        self.capacity = 0
+        self.vectors: Optional["np.memmap"] = None
+        self.meta: Optional["np.memmap"] = None
+        self.closed = False
+        self._map(max(1024, self.count))
+        self.text_end = int(self.meta[self.count - 1]["offset"] + self.meta[self.count - 1]["length"]) if self.count else 0
+        self._open_texts()
+
+    def _open_texts(self):
+        # In append mode every write lands at the end, so cut off text from an interrupted append first
+        self.texts = open(os.path.join(self.path, "texts.bin"), "a+b")
+        self.texts.truncate(self.text_end)
+
+    def _read_header(self) -> Optional[Dict]:
+        return ReadJson(os.path.join(self.path, "index.json"), generations=0)
+
+    def _write_header(self):
+        # Replaced atomically after the rows are on disk, so a crash leaves the old count
+        WriteJson(os.path.join(self.path, "index.json"), {"dim": self.dim, "dtype": self.dtype_name, "count": self.count}, generations=0)
+
+    def _map(self, capacity: int):
+        """(Re)maps the vector and metadata files with room for capacity rows."""
+        for name, itemsize in (("vectors.bin", self.dim * self.dtype.itemsize), ("meta.bin", self.meta_dtype.itemsize)):
+            file_path = os.path.join(self.path, name)
+            with open(file_path, "ab") as file:
+                if file.tell() < capacity * itemsize:
+                    file.truncate(capacity * itemsize)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.meta.flush()
+        self.vectors = np.memmap(os.path.join(self.path, "vectors.bin"), dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+        self.meta = np.memmap(os.path.join(self.path, "meta.bin"), dtype=self.meta_dtype, mode="r+", shape=(capacity,))
+        self.capacity = capacity
+
+    def add(self, vectors: "np.ndarray", texts: List[str], channels: List[int]):
+        encoded = [text.encode("utf-8") for text in texts]
+        quantized = Quantize(vectors, self.dtype)
+        lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError(f"{self.path} was closed")
+            needed = self.count + len(encoded)
+            if needed > self.capacity:
+                capacity = self.capacity
+                while capacity < needed:
+                    capacity *= 2
+                self._map(capacity)
+            rows = slice(self.count, needed)
+            self.vectors[rows] = quantized
+            self.meta["offset"][rows] = self.text_end + np.cumsum(lengths) - lengths
+            self.meta["length"][rows] = lengths
+            self.meta["channel"][rows] = channels
+            self.texts.write(b"".join(encoded))
+            self.texts.flush()
+            os.fsync(self.texts.fileno())
+            self.vectors.flush()
+            self.meta.flush()
+            self.text_end += int(lengths.sum())
+            self.count = needed
+            self._write_header()
+
+    def search(self, query: "np.ndarray", k: int) -> List[Tuple[float, str, int]]:
+        """Returns up to k (cosine similarity, text, channel) tuples, best first, none once the index is closed."""
+        query = Quantize(query.reshape(1, -1), np.float32)[0]
+        with self.lock:
+            if self.closed:
+                return []
+            count = self.count
+            if not count:
+                return []
+            scale = 127.0 if self.dtype == np.int8 else 1.0
+            # Convert small chunks to float32 so they stay in the CPU cache, which is about twice as
+            # fast as converting everything at once and keeps the temporary memory tiny
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, SEARCH_CHUNK):
+                end = min(count, start + SEARCH_CHUNK)
+                np.matmul(self.vectors[start:end].astype(np.float32), query, out=scores[start:end])
+            k = min(k, count)
+            best_rows = np.argpartition(-scores, k - 1)[:k]
+            best_scores = scores[best_rows]
+            order = np.argsort(-best_scores)
+            results = []
+            for index in order:
+                entry = self.meta[best_rows[index]]
+                self.texts.seek(int(entry["offset"]))
+                text = self.texts.read(int(entry["length"])).decode("utf-8", errors="replace")
+                results.append((float(best_scores[index]) / scale, text, int(entry["channel"])))
+            return results
+
+    def used_bytes(self) -> int:
+        return self.count * (self.dim * self.dtype.itemsize + self.meta_dtype.itemsize) + self.text_end
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.vectors.flush()
+            self.meta.flush()
+            self.texts.close()
+            self.vectors = None
+            self.meta = None
+
+class LongTermMemory:
+    """
+    Remembers older conversation per guild beyond what fits in the prompt. Messages are embedded
+    in batches in the background (EmbedModel through the backend pool) and appended to a
+    memory-mapped GuildIndex under MemoryPath/<bot>/<guild>. Before a reply, the prompt is
+    embedded and the top-k most similar snippets are added to it.
+
+    With the default int8 vectors a 768-dimensional embedding takes 768 bytes on disk plus about
+    20 bytes of metadata and the text, and only the pages a search touches are held in memory.
+    """
+    def __init__(self, pool, owner: str, root: str = None):
+        self.pool = pool
+        self.owner = owner
+        self.enabled = EnvBool("LongTermMemory", False)
+        self.root = os.path.join(root or os.getenv("MemoryPath", "DataFiles/memory"), owner)
+        self.embed_model = os.getenv("EmbedModel", "nomic-embed-text")
+        self.dtype = os.getenv("MemoryDType", "int8")
+        if self.dtype not in DTYPES:
+            print(f"Warning: MemoryDType={self.dtype!r} is not one of {', '.join(DTYPES)}. Using int8.")
+            self.dtype = "int8"
+        # Embedding models trained for truncation (nomic-embed-text v1.5) keep most of their quality
+        # at 256 dimensions, which makes the index and each search three times cheaper
+        self.dims = EnvInt("MemoryDims", 0)
+        self.top_k = EnvInt("MemoryTopK", 3)
+        self.min_score = EnvFloat("MemoryMinScore", 0.6)
+        self.min_length = EnvInt("MemoryMinLength", 20)
+        self.batch_size = EnvInt("MemoryBatchSize", 32)
+        self.flush_interval = EnvFloat("MemoryFlushInterval", 10.0)
+        self.max_open = EnvInt("MemoryOpenGuilds", 32)
+        # While embedding fails the messages keep coming, past this the oldest are dropped
+        self.max_pending = EnvInt("MemoryMaxPending", 10000)
+        self.indexes: "OrderedDict[int, GuildIndex]" = OrderedDict()
+        self.opening: Dict[int, asyncio.Task] = {}
+        self.pending: List[Tuple[int, int, str]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.recalled = 0
+        REGISTRY.gauge("memory_pending_messages", "Messages waiting to be embedded into long-term memory", lambda: {(owner,): len(self.pending)}, ("model",), owner)
+        REGISTRY.gauge("memory_open_rows", "Rows in the guild memory indexes that are currently open", lambda: {(owner,): sum(index.count for index in list(self.indexes.values()))}, ("model",), owner)
+
+    def start(self):
+        if self.enabled and not self.task:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.enabled:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Failed to save long-term memory: {e}")
+        indexes = list(self.indexes.values())
+        self.indexes.clear()
+        await asyncio.gather(*(WriterFor(index.path).write(index.close) for index in indexes))
+
+    def remember(self, guild_id: Optional[int], channel_id: int, text: str):
+        """Queues a message to be embedded. Direct messages are never stored."""
+        if not self.enabled or guild_id is None or len(text) < self.min_length:
+            return
+        self.pending.append((guild_id, channel_id, text))
+        self._trim()
+
+    def _trim(self):
+        overflow = len(self.pending) - self.max_pending
+        if overflow > 0:
+            del self.pending[:overflow]
+            DROPPED.inc(overflow, model=self.owner)
+
+    async def recall(self, guild_id: Optional[int], text: str, exclude: Iterable[str] = ()) -> List[str]:
+        """Returns the stored snippets most similar to text, skipping those already in the prompt."""
+        if not self.enabled or guild_id is None or not os.path.exists(os.path.join(self.root, str(guild_id))):
+            return []
+        started = time.monotonic()
+        query = (await self.embed([text]))[0]
+        index = await self._index(guild_id, len(query))
+        exclude = set(exclude)
+        searched = time.monotonic()
+        results = await asyncio.to_thread(index.search, query, self.top_k + len(exclude))
+        if index.closed and not results:
+            # Evicted while the search was on its way, search the guild's current index instead
+            index = await self._index(guild_id, len(query))
+            results = await asyncio.to_thread(index.search, query, self.top_k + len(exclude))
+        SEARCH_TIME.observe(time.monotonic() - searched, model=self.owner)
+        snippets = [snippet for score, snippet, _ in results if score >= self.min_score and snippet not in exclude][:self.top_k]
+        RECALL_TIME.observe(time.monotonic() - started, model=self.owner)
+        self.recalled += len(snippets)
+        return snippets
+
+    async def embed(self, texts: List[str]) -> "np.ndarray":
+        response = await self.pool.call(lambda client: client.embed(model=self.embed_model, input=texts, keep_alive="30m"))
+        vectors = np.asarray(response["embeddings"], dtype=np.float32)
+        return vectors[:, :self.dims] if self.dims else vectors
+
+    async def flush(self):
+        while self.pending:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            try:
+                vectors = await self.embed([text for _, _, text in batch])
+            except Exception:
+                self.pending = batch + self.pending
+                self._trim()
+                raise
+            by_guild: Dict[int, List[int]] = {}
+            for row, (guild_id, _, _) in enumerate(batch):
+                by_guild.setdefault(guild_id, []).append(row)
+            for guild_id, rows in by_guild.items():
+                index = await self._index(guild_id, vectors.shape[1])
+                # Appends to one guild's files happen in order on their writer thread
+                await WriterFor(index.path).write(functools.partial(index.add, vectors[rows], [batch[row][2] for row in rows], [batch[row][1] for row in rows]))
+            STORED.inc(len(batch), model=self.owner)
+
+    async def _index(self, guild_id: int, dim: int) -> GuildIndex:
+        index = self.indexes.get(guild_id)
+        if index is not None:
+            self.indexes.move_to_end(guild_id)
+            return index
+        # Callers asking for the same guild while it opens share one index
+        task = self.opening.get(guild_id)
+        if task is None:
+            task = self.opening[guild_id] = asyncio.create_task(self._open(guild_id, dim))
+        return await asyncio.shield(task)
+
+    async def _open(self, guild_id: int, dim: int) -> GuildIndex:
+        path = os.path.join(self.root, str(guild_id))
+        try:
+            # Opening truncates texts.bin and maps the files, so it runs on the guild's writer thread:
+            # off the event loop, and after appends still queued for an evicted index of this guild,
+            # so the header it reads counts their rows
+            index = await WriterFor(path).write(functools.partial(GuildIndex, path, dim, self.dtype))
+        finally:
+            self.opening.pop(guild_id, None)
+        self.indexes[guild_id] = index
+        while len(self.indexes) > self.max_open:
+            _, oldest = self.indexes.popitem(last=False)
+            WriterFor(oldest.path).submit(oldest.close)
+        return index
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Failed to embed messages for long-term memory: {e}")
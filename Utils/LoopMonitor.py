@@ -0,0 +1,186 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from Utils.Config import EnvBool, EnvFloat, EnvInt
+from Utils.Metrics import REGISTRY
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+# Stacks taken during one block, one every poll of the watchdog
+MAX_SAMPLES = 20
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LOOP_LAG = REGISTRY.histogram("event_loop_lag_seconds", "How late a timer on the event loop fires", buckets=LAG_BUCKETS)
+LOOP_BLOCKS = REGISTRY.counter("event_loop_blocks_total", "Times a callback kept the event loop busy for longer than LoopBlockThreshold", ("owner",))
+LOOP_BLOCKED = REGISTRY.counter("event_loop_blocked_seconds_total", "Time the event loop was blocked, by the code that blocked it", ("owner",))
+
+def Attribute(stack: List[traceback.FrameSummary]) -> Tuple[str, str, List[str]]:
+    """
+    Works out who blocked the loop from the stack of the running callback: the owner is the
+    outermost function in a cog (the command or listener, e.g. "QuizCog.quiz_answer") or else in
+    the bot's own code (e.g. "main.SetActivity"), the site is the innermost line of the bot's own
+    code, so a blocking json.dump shows up at the SaveJson that called it.
+    """
+    # Drop asyncio's run loop, what is left starts at the callback
+    for index in range(len(stack) - 1, -1, -1):
+        frame = stack[index]
+        if frame.name == "_run" and frame.filename.endswith(os.path.join("asyncio", "events.py")):
+            stack = stack[index + 1:]
+            break
+    else:
+        # No callback was running: the loop itself was slow, e.g. waiting for the GIL in select()
+        return "event loop", f"{os.path.basename(stack[-1].filename)}:{stack[-1].name}" if stack else "", traceback.format_list(stack)
+    ours = [frame for frame in stack if frame.filename.startswith(ROOT)]
+    cogs = [frame for frame in ours if frame.filename.startswith(os.path.join(ROOT, "Cogs"))]
+    if cogs or ours:
+        frame = (cogs or ours)[0]
+        owner = f"{os.path.splitext(os.path.basename(frame.filename))[0]}.{frame.name}"
+    elif stack:
+        owner = f"{os.path.basename(stack[0].filename)}:{stack[0].name}"
+    else:
+        owner = "unknown"
+    site = ""
+    if ours:
+        site = f"{os.path.relpath(ours[-1].filename, ROOT)}:{ours[-1].lineno} {ours[-1].name}"
+    return owner, site, traceback.format_list(stack)
+
+class Blocker:
+    def __init__(self, owner: str, site: str):
+        self.owner = owner
+        self.site = site
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.stack: List[str] = []
+        self.last_seen = 0.0
+
+    def add(self, seconds: float, stack: List[str]):
+        self.count += 1
+        self.total += seconds
+        if seconds >= self.longest:
+            self.longest = seconds
+            self.stack = stack
+        self.last_seen = time.time()
+
+class LoopMonitor:
+    """
+    Watches the event loop for callbacks that block it. A timer on the loop measures the lag
+    every interval seconds and a watchdog thread checks that the timer keeps firing. When it stops
+    for longer than half the threshold the watchdog samples the stack of the loop's thread until
+    it fires again, and if the block lasted longer than the threshold it is counted against the
+    cog or function seen on most samples. Shared by all bots in the process, like their event loop.
+    """
+    def __init__(self, threshold: float = None, interval: float = None, keep: int = None):
+        self.enabled = EnvBool("LoopMonitor", True)
+        self.threshold = threshold if threshold is not None else EnvFloat("LoopBlockThreshold", 0.1)
+        self.interval = interval if interval is not None else EnvFloat("LoopLagInterval", 0.05)
+        self.keep = keep if keep is not None else EnvInt("LoopBlockersKept", 200)
+        self.blockers: Dict[Tuple[str, str], Blocker] = {}
+        self.blocks = 0
+        self.worst_lag = 0.0
+        self.beat = 0.0
+        self.pending: List[traceback.StackSummary] = []
+        self.lock = threading.Lock()
+        self.loop_thread: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.watchdog: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        if not self.enabled or self.task:
+            return
+        self.loop_thread = threading.get_ident()
+        self.beat = time.perf_counter()
+        self.stopping.clear()
+        self.task = asyncio.create_task(self._heartbeat())
+        self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    async def stop(self):
+        if self.task:
+            self.stopping.set()
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+            self.watchdog.join()
+
+    async def _heartbeat(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - started - self.interval)
+            with self.lock:
+                self.beat = now
+                samples, self.pending = self.pending, []
+            LOOP_LAG.observe(lag)
+            self.worst_lag = max(self.worst_lag, lag)
+            if lag >= self.threshold:
+                try:
+                    self.record(lag, samples)
+                except Exception as e:
+                    print(f"Could not record an event loop block: {e}")
+
+    def _watch(self):
+        poll = max(0.005, min(self.interval, self.threshold) / 4)
+        while not self.stopping.wait(poll):
+            with self.lock:
+                beat = self.beat
+                if time.perf_counter() - beat - self.interval < self.threshold / 2 or len(self.pending) >= MAX_SAMPLES:
+                    continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            with self.lock:
+                # Unless the loop got going again in the meantime
+                if self.beat == beat:
+                    self.pending.append(stack)
+
+    def record(self, seconds: float, samples: List[traceback.StackSummary]):
+        # A long block is sampled several times, it goes to the code that was seen the most
+        seen: Dict[Tuple[str, str], List[str]] = {}
+        counts: Dict[Tuple[str, str], int] = {}
+        for stack in samples:
+            owner, site, lines = Attribute(stack)
+            seen[(owner, site)] = lines
+            counts[(owner, site)] = counts.get((owner, site), 0) + 1
+        key = max(counts, key=counts.get) if counts else ("unknown", "")
+        owner, site = key
+        lines = seen.get(key, [])
+        blocker = self.blockers.get(key)
+        if blocker is None:
+            if len(self.blockers) >= self.keep:
+                # Forget the blocker that cost the least so far
+                del self.blockers[min(self.blockers, key=lambda k: self.blockers[k].total)]
+            blocker = self.blockers[key] = Blocker(owner, site)
+            print(f"Event loop blocked for {seconds * 1000:.0f}ms by {owner}{f' at {site}' if site else ''}")
+        blocker.add(seconds, lines)
+        self.blocks += 1
+        LOOP_BLOCKS.inc(owner=owner)
+        LOOP_BLOCKED.inc(seconds, owner=owner)
+
+    def top(self, count: int = 10) -> List[Blocker]:
+        return sorted(self.blockers.values(), key=lambda blocker: -blocker.total)[:count]
+
+    def summary(self, count: int = 10) -> str:
+        if not self.enabled:
+            return "The loop monitor is off (LoopMonitor=false)."
+        lines = [f"{self.blocks} blocks over {self.threshold * 1000:.0f}ms, worst lag {self.worst_lag * 1000:.0f}ms"]
+        for blocker in self.top(count):
+            lines.append(f"{blocker.total:7.2f}s  {blocker.count:>5}x  max {blocker.longest * 1000:.0f}ms  {blocker.owner}{f' at {blocker.site}' if blocker.site else ''}")
+        return "\n".join(lines)
+
+    def stacks(self, count: int = 10) -> str:
+        """The summary followed by the stack of the longest block of each top blocker."""
+        parts = [self.summary(count)]
+        for blocker in self.top(count):
+            parts.append(f"\n{blocker.owner}{f' at {blocker.site}' if blocker.site else ''}, longest {blocker.longest * 1000:.0f}ms:\n{''.join(blocker.stack)}")
+        return "\n".join(parts)
+
+LOOP_MONITOR = LoopMonitor()
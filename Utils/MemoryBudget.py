@@ -0,0 +1,254 @@
+import asyncio
+import os
+import sys
+import tracemalloc
+import types
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import discord
+from discord.ext import commands
+
+from Utils.Config import EnvFloat, EnvInt, EnvList
+from Utils.Metrics import REGISTRY, ResidentMemoryBytes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+CONTAINERS = (dict, list, set, frozenset, tuple, deque)
+# Objects that lead to everything else (the client, its connection state, other cogs), sizes stop there
+BOUNDARIES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.CodeType, types.FrameType,
+    asyncio.AbstractEventLoop, asyncio.Future, asyncio.Handle,
+    discord.Client, discord.Guild, discord.VoiceClient, discord.state.ConnectionState, discord.http.HTTPClient, commands.Cog,
+)
+
+def DeepSize(root, limit: int = 5_000_000) -> Tuple[int, int]:
+    """
+    Bytes held by an object and everything it references that nothing outside it is likely to
+    own, and the number of objects. Stops at BOUNDARIES and after limit objects.
+    """
+    seen = set()
+    stack = [root]
+    size = 0
+    while stack and len(seen) < limit:
+        obj = stack.pop()
+        if id(obj) in seen or (obj is not root and isinstance(obj, BOUNDARIES)):
+            continue
+        seen.add(id(obj))
+        try:
+            size += sys.getsizeof(obj)
+        except TypeError:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, CONTAINERS):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+            continue
+        else:
+            attributes = getattr(obj, "__dict__", None)
+            if attributes is not None:
+                stack.append(attributes)
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, "__slots__", ()):
+                    value = getattr(obj, slot, None) if isinstance(slot, str) else None
+                    if value is not None:
+                        stack.append(value)
+    return size, len(seen)
+
+def StateContainers(obj) -> Dict[str, object]:
+    """The attributes of a cog or bot that hold its state: containers and objects of this repo's own classes."""
+    found = {}
+    for name, value in vars(obj).items():
+        # Dunder attributes are discord.py's per-cog command copies, not state
+        if name.startswith("__") or isinstance(value, BOUNDARIES):
+            continue
+        module = getattr(type(value), "__module__", "") or ""
+        if isinstance(value, CONTAINERS) or module.startswith(("Utils.", "Cogs.")):
+            found[name] = value
+    return found
+
+def DiscordCaches(client: discord.Client) -> Dict[str, object]:
+    state = client._connection
+    members = [guild._members for guild in state._guilds.values()]
+    return {"users": state._users, "members": members, "messages": state._messages or deque(), "views": getattr(state._view_store, "_views", {})}
+
+class MemoryTracker:
+    """
+    Accounts the memory of each bot's state to the cog or structure that holds it and warns when
+    an owner goes over its budget. Owners are the cogs ("Tamaneko/Music"), the bot's own stores
+    ("Tamaneko") and discord.py's caches ("Tamaneko/discord.py"). Budgets come from MemoryBudgets,
+    e.g. "Music=64,RPG=256,discord.py=512" in MB, a cog name applies to that cog in every bot.
+    Sizes are estimates from walking the objects in a worker thread, every MemoryCheckInterval
+    seconds and on /memory, not on every metrics scrape. tracemalloc snapshots are only taken on
+    request, tracing stays on between them until stopped.
+    """
+    def __init__(self):
+        self.bots: Dict[str, object] = {}
+        self.budgets = self.parse_budgets(EnvList("MemoryBudgets"))
+        self.interval = EnvFloat("MemoryCheckInterval", 300)
+        self.frames = EnvInt("TracemallocFrames", 1)
+        self.sizes: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self.over: Dict[str, int] = {}
+        self.first: Optional[tracemalloc.Snapshot] = None
+        self.previous: Optional[tracemalloc.Snapshot] = None
+        self.task: Optional[asyncio.Task] = None
+        REGISTRY.gauge("bot_state_bytes", "Estimated bytes held by each state container of a cog, bot or discord.py cache", lambda: {key: size for key, (size, _) in self.sizes.items()}, ("owner", "container"), "tracker")
+        REGISTRY.gauge("bot_state_objects", "Objects held by each state container", lambda: {key: count for key, (_, count) in self.sizes.items()}, ("owner", "container"), "tracker")
+        REGISTRY.gauge("bot_state_budget_bytes", "Soft memory budget of each owner from MemoryBudgets", lambda: {(owner,): budget for owner, budget in self.budgets.items()}, ("owner",), "tracker")
+        REGISTRY.gauge("tracemalloc_traced_bytes", "Memory allocated since tracemalloc was started by /memory", lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0, (), "tracker")
+        self.exceeded = REGISTRY.counter("bot_state_budget_exceeded_total", "Checks that found an owner over its memory budget", ("owner",))
+
+    @staticmethod
+    def parse_budgets(items: List[str]) -> Dict[str, int]:
+        budgets = {}
+        for item in items:
+            name, _, megabytes = item.partition("=")
+            try:
+                budgets[name.strip()] = int(float(megabytes) * 1024 * 1024)
+            except ValueError:
+                print(f"Warning: ignoring memory budget {item!r}, expected name=megabytes")
+        return budgets
+
+    def track(self, name: str, bot):
+        """Registers a bot (DiscordBotBase), its cogs are looked up on every measurement so reloads are seen."""
+        self.bots[name] = bot
+
+    def start(self):
+        if self.interval > 0 and self.bots and not self.task:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.measure()
+            except Exception as e:
+                print(f"Could not measure memory: {e}")
+
+    def owners(self) -> Dict[str, Dict[str, object]]:
+        owners = {}
+        for name, bot in self.bots.items():
+            owners[name] = StateContainers(bot)
+            for cog_name, cog in bot.client.cogs.items():
+                owners[f"{name}/{cog_name}"] = StateContainers(cog)
+            owners[f"{name}/discord.py"] = DiscordCaches(bot.client)
+        return owners
+
+    @staticmethod
+    def sizes_of(owners: Dict[str, Dict[str, object]]) -> Dict[Tuple[str, str], Tuple[int, int]]:
+        # Runs in a worker thread so large states don't block the event loop. A container
+        # that changes while it is walked is walked again.
+        sizes = {}
+        for owner, containers in owners.items():
+            for container, value in containers.items():
+                for attempt in range(3):
+                    try:
+                        sizes[(owner, container)] = DeepSize(value)
+                        break
+                    except RuntimeError:
+                        continue
+        return sizes
+
+    def budget(self, owner: str) -> Optional[int]:
+        if owner in self.budgets:
+            return self.budgets[owner]
+        return self.budgets.get(owner.split("/")[-1])
+
+    async def measure(self) -> Dict[str, int]:
+        """Measures every owner's containers, warns about owners over budget and returns the total per owner."""
+        sizes = await asyncio.to_thread(self.sizes_of, self.owners())
+        totals: Dict[str, int] = {}
+        for (owner, container), (size, _) in sizes.items():
+            totals[owner] = totals.get(owner, 0) + size
+        self.sizes = sizes
+        for owner, total in totals.items():
+            budget = self.budget(owner)
+            if budget is None or total <= budget:
+                self.over.pop(owner, None)
+                continue
+            self.exceeded.inc(owner=owner)
+            biggest = max((key for key in sizes if key[0] == owner), key=lambda key: sizes[key][0])
+            print(f"Warning: {owner} holds {total / 1024 / 1024:.1f} MB, over its budget of {budget / 1024 / 1024:.1f} MB (largest: {biggest[1]} with {sizes[biggest][0] / 1024 / 1024:.1f} MB)")
+            self.over[owner] = total
+        return totals
+
+    async def report(self) -> str:
+        totals = await self.measure()
+        lines = [f"Resident memory: {ResidentMemoryBytes() / 1024 / 1024:.1f} MB, state of the bots by owner:"]
+        for owner, total in sorted(totals.items(), key=lambda item: -item[1]):
+            budget = self.budget(owner)
+            budgetText = f" / {budget / 1024 / 1024:.1f} MB budget" + (" OVER" if total > budget else "") if budget else ""
+            lines.append(f"{total / 1024 / 1024:8.2f} MB{budgetText}  {owner}")
+            containers = sorted(((container, size) for (name, container), size in self.sizes.items() if name == owner), key=lambda item: -item[1][0])
+            for container, (size, count) in containers[:5]:
+                if size >= 1024:
+                    lines.append(f"{size / 1024:11.0f} KB  {count:>8} objects  .{container}")
+        return "\n".join(lines)
+
+    async def snapshot(self, top: int = 15) -> Tuple[str, str]:
+        """
+        Takes a tracemalloc snapshot and compares it with the previous one and the first one.
+        Returns a short summary and the full comparison. The first call starts tracing, only
+        memory allocated from then on is seen.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.first = self.previous = await asyncio.to_thread(self.take_snapshot)
+            return "Started tracing allocations. Take another snapshot later to see what was allocated in between.", ""
+        snapshot = await asyncio.to_thread(self.take_snapshot)
+        previous, first = self.previous, self.first
+        self.previous = snapshot
+        since_previous = await asyncio.to_thread(snapshot.compare_to, previous, "lineno")
+        since_first = await asyncio.to_thread(snapshot.compare_to, first, "lineno")
+        traced, peak = tracemalloc.get_traced_memory()
+
+        def ownerOf(stat) -> str:
+            filename = stat.traceback[0].filename
+            if filename.startswith(os.path.join(ROOT, "Cogs")):
+                return os.path.splitext(os.path.basename(filename))[0]
+            if filename.startswith(ROOT):
+                return os.path.relpath(filename, ROOT)
+            return "libraries"
+
+        growth: Dict[str, int] = {}
+        for stat in since_first:
+            growth[ownerOf(stat)] = growth.get(ownerOf(stat), 0) + stat.size_diff
+        lines = [f"Traced: {traced / 1024 / 1024:.1f} MB (peak {peak / 1024 / 1024:.1f} MB). Growth since the first snapshot by file:"]
+        for owner, size in sorted(growth.items(), key=lambda item: -abs(item[1]))[:8]:
+            lines.append(f"{size / 1024:+10.0f} KB  {owner}")
+        lines.append("Largest changes since the last snapshot:")
+        for stat in since_previous[:top]:
+            if abs(stat.size_diff) >= 1024:
+                lines.append(f"{stat.size_diff / 1024:+10.0f} KB {stat.count_diff:+7} objects  {self.where(stat)}")
+        full = ["Since the last snapshot:"] + [str(stat) for stat in since_previous[:200]] + ["", "Since the first snapshot:"] + [str(stat) for stat in since_first[:200]]
+        return "\n".join(lines), "\n".join(full)
+
+    @staticmethod
+    def take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    @staticmethod
+    def where(stat) -> str:
+        frame = stat.traceback[0]
+        filename = frame.filename[len(ROOT):] if frame.filename.startswith(ROOT) else "/".join(frame.filename.replace("\\", "/").split("/")[-2:])
+        return f"{filename}:{frame.lineno}"
+
+    def stop_tracing(self) -> str:
+        if not tracemalloc.is_tracing():
+            return "Allocations are not being traced."
+        tracemalloc.stop()
+        self.first = self.previous = None
+        return "Stopped tracing allocations."
+
+MEMORY_TRACKER = MemoryTracker()
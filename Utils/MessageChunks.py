@@ -0,0 +1,39 @@
+import re
+from typing import List
+
+MESSAGE_LIMIT = 2000
+FENCE = re.compile(r"^```(\S*)", re.MULTILINE)
+
+def SplitMessage(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Splits text into chunks of at most limit characters, preferring paragraph breaks, then line
+    breaks, then spaces in the second half of the chunk. Without one there the text is cut at the
+    limit, a separator near the start would leave a tiny message. A code block that is cut in two
+    is closed at the end of the chunk and reopened with the same language at the start of the
+    next one.
+    """
+    chunks = []
+    opener = ""
+    text = text.strip()
+    while text:
+        text = opener + text
+        if len(text) <= limit:
+            chunks.append(text)
+            break
+        # Leave room to close a code block that is still open at the cut
+        window = text[:limit - 4]
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator)
+            if cut >= len(window) // 2:
+                break
+        else:
+            cut = len(window)
+        chunk = text[:cut].rstrip()
+        fences = FENCE.findall(chunk)
+        opener = ""
+        if len(fences) % 2 == 1:
+            chunk += "\n```"
+            opener = f"```{fences[-1]}\n"
+        chunks.append(chunk)
+        text = text[cut:].strip()
+    return chunks
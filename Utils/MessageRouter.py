@@ -0,0 +1,42 @@
+import re
+from collections import Counter
+from typing import Awaitable, Callable, Iterable, List, Optional, Pattern
+
+import discord
+
+def CompileNamePattern(names: Iterable[str]) -> Pattern:
+    """Builds one case-insensitive whole-word pattern matching any of the names."""
+    alternatives = sorted({re.escape(name) for name in names if name}, key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE)
+
+class Rule:
+    def __init__(self, name: str, match: Callable[[discord.Message], bool], action: Optional[Callable[[discord.Message], Awaitable[None]]] = None):
+        self.name = name
+        self.match = match
+        self.action = action
+
+class MessageRouter:
+    """
+    Checks each message against an ordered list of rules in a single pass and runs the action of
+    the first rule that matches, so a message triggers at most one action. Counts hits per rule.
+    """
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+        self.counts = Counter({rule.name: 0 for rule in rules})
+        self.counts["unmatched"] = 0
+
+    def route(self, message: discord.Message) -> Optional[Rule]:
+        for rule in self.rules:
+            if rule.match(message):
+                self.counts[rule.name] += 1
+                return rule
+        self.counts["unmatched"] += 1
+        return None
+
+    async def dispatch(self, message: discord.Message) -> Optional[str]:
+        rule = self.route(message)
+        if rule is None:
+            return None
+        if rule.action:
+            await rule.action(message)
+        return rule.name
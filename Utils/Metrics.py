@@ -0,0 +1,208 @@
+import bisect
+import os
+import sys
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from Utils.Config import EnvInt
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def FormatLabels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def FormatValue(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _labels(self, key: Tuple) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self) -> List[str]:
+        return []
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{FormatLabels(self._labels(key))} {FormatValue(value)}" for key, value in self.values.items()]
+
+class Gauge(Metric):
+    """
+    Values read from callbacks every time the metrics are rendered. Each owner (a bot, a cog)
+    registers its own callback, which returns either a number or a dict of label tuple -> number.
+    """
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = (), kind: str = "gauge"):
+        super().__init__(name, help_text, label_names)
+        self.kind = kind
+        self.sources: Dict[str, Callable] = {}
+
+    def samples(self) -> List[str]:
+        lines = []
+        for owner, read in list(self.sources.items()):
+            try:
+                values = read()
+            except Exception as e:
+                print(f"Failed to read {self.name} from {owner or 'default'}: {e}")
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            for key, value in values.items():
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{self.name}{FormatLabels(self._labels(key))} {FormatValue(value)}")
+        return lines
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{FormatLabels({**labels, 'le': FormatValue(bound)})} {cumulative}")
+                lines.append(f"{self.name}_bucket{FormatLabels({**labels, 'le': '+Inf'})} {count}")
+                lines.append(f"{self.name}_sum{FormatLabels(labels)} {FormatValue(total)}")
+                lines.append(f"{self.name}_count{FormatLabels(labels)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # Cogs and bots can be reloaded, keep the first instance so its values survive
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, label_names: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def gauge(self, name: str, help_text: str, read: Callable, label_names: Iterable[str] = (), owner: str = "", kind: str = "gauge") -> Gauge:
+        """
+        Adds a callback to a gauge. Registering again with the same owner replaces the callback,
+        so it always points at the live object after a reload. Use kind="counter" for callbacks
+        that return running totals.
+        """
+        gauge = self.register(Gauge(name, help_text, label_names, kind))
+        gauge.sources[owner] = read
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def ResidentMemoryBytes() -> int:
+    """Current resident set size (working set on Windows, peak RSS on Unix without /proc)."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [(name, ctypes.c_size_t) for name in (
+                "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+        return counters.WorkingSetSize
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+REGISTRY.gauge("process_resident_memory_bytes", "Resident memory of the bot process", ResidentMemoryBytes)
+
+class MetricsServer:
+    """Serves REGISTRY in the Prometheus text format on http://host:port/metrics."""
+    def __init__(self, port: int = None, host: str = "127.0.0.1"):
+        self.port = port if port is not None else EnvInt("MetricsPort", 0)
+        self.host = host
+        self.runner = None
+
+    async def start(self):
+        if not self.port or self.runner:
+            return
+        from aiohttp import web
+
+        async def metrics(request):
+            return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        print(f"Metrics available on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+from Utils.Config import EnvFloat, EnvInt, EnvList
+from Utils.Metrics import REGISTRY
+
+LOAD_TIME = REGISTRY.histogram("llm_model_load_seconds", "Time Ollama spent loading a model into memory", ("model", "reason"), buckets=(0.1, 0.5, 1, 2, 5, 10, 20, 40, 80))
+COLD_STARTS = REGISTRY.counter("llm_cold_starts_total", "Requests that had to wait for the model to load", ("model", "reason"))
+NANOSECONDS = 1e9
+
+def ModelMatches(model: str, name: str) -> bool:
+    """Ollama reports models with their tag ("Tamaneko:latest"), the bots use the bare name."""
+    return name == model or (":" not in model and name.split(":")[0] == model)
+
+def LoadedSize(entry: Dict) -> int:
+    """Memory a model listed by /api/ps takes on the GPU, or in RAM when it runs on the CPU."""
+    return entry.get("size_vram") or entry.get("size", 0)
+
+def RecordLoad(model: str, response: Dict, reason: str) -> float:
+    """Records the load time Ollama reports for a response and counts it as a cold start when significant."""
+    load = (response.get("load_duration") or 0) / NANOSECONDS
+    if load >= EnvFloat("ColdStartThreshold", 1.0):
+        LOAD_TIME.observe(load, model=model, reason=reason)
+        COLD_STARTS.inc(model=model, reason=reason)
+    return load
+
+class ModelResidency:
+    """
+    Loads the bot's models into Ollama at startup and keeps them resident with a keep-alive
+    heartbeat, so the first message after idle time doesn't pay for a cold model load.
+
+    Every backend of the pool is preloaded and checked separately.
+
+    When other models share the Ollama host (SharedModels), a model that was unloaded is only
+    reloaded by the heartbeat if it fits next to the shared models that are currently loaded, so two
+    bots don't keep pushing each other's models out of memory. The budget is OllamaMemoryBudgetMB,
+    or without it the most memory the host's loaded models took at once in /api/ps.
+    """
+    def __init__(self, pool, models: List[str], keep_alive: str = None, interval: float = None):
+        self.pool = pool
+        self.models = models
+        self.keep_alive = keep_alive or os.getenv("ModelKeepAlive", "10m")
+        self.interval = interval if interval is not None else EnvFloat("ModelHeartbeat", 240.0)
+        self.shared_models = EnvList("SharedModels")
+        self.memory_budget = EnvInt("OllamaMemoryBudgetMB", 0) * 1024 * 1024
+        self.sizes: Dict[str, int] = {}
+        # Backend name -> most memory its loaded models took at once, the budget when none is set
+        self.observed: Dict[str, int] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.resident: Dict[tuple, bool] = {}
+        self.skipped = 0
+        REGISTRY.gauge("llm_model_resident", "1 when the model was loaded in Ollama at the last check", lambda: {key: int(resident) for key, resident in self.resident.items()}, ("host", "model"), owner=",".join(models))
+
+    def start(self):
+        if self.task and not self.task.done():
+            return
+        if self.shared_models and not self.memory_budget and self.interval > 0:
+            print("OllamaMemoryBudgetMB is not set, the budget of each Ollama host is the most memory its models took at once")
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def preload(self, backend, model: str, reason: str = "preload") -> Optional[float]:
+        started = time.monotonic()
+        try:
+            response = await backend.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+        except Exception as e:
+            print(f"Failed to load {model} on {backend.name}: {e}")
+            return None
+        load = RecordLoad(model, response, reason)
+        self.resident[(backend.name, model)] = True
+        if reason != "heartbeat":
+            print(f"{model} ready on {backend.name} after {time.monotonic() - started:.2f}s (load {load:.2f}s, {reason})")
+        return load
+
+    async def _run(self):
+        await asyncio.gather(*(self.preload(backend, model) for backend in self.pool.backends for model in self.models))
+        if self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            for backend in self.pool.backends:
+                if not backend.available:
+                    continue
+                try:
+                    await self.heartbeat(backend)
+                except Exception as e:
+                    print(f"Model heartbeat on {backend.name} failed: {e}")
+
+    async def heartbeat(self, backend):
+        loaded = (await backend.client.ps()).get("models", [])
+        for entry in loaded:
+            for model in self.models + self.shared_models:
+                if ModelMatches(model, entry.get("name", "")):
+                    self.sizes[model] = LoadedSize(entry)
+        self.observed[backend.name] = max(self.observed.get(backend.name, 0), sum(LoadedSize(entry) for entry in loaded))
+
+        for model in self.models:
+            key = (backend.name, model)
+            is_loaded = any(ModelMatches(model, entry.get("name", "")) for entry in loaded)
+            if not is_loaded and self.resident.get(key):
+                print(f"{model} was unloaded by Ollama on {backend.name}")
+            self.resident[key] = is_loaded
+            if not is_loaded and not self._fits(backend, model, loaded):
+                self.skipped += 1
+                continue
+            await self.preload(backend, model, "heartbeat" if is_loaded else "reload")
+
+    def _fits(self, backend, model: str, loaded: List[Dict]) -> bool:
+        budget = self.memory_budget or self.observed.get(backend.name, 0)
+        if not budget or model not in self.sizes:
+            return True
+        shared = sum(LoadedSize(entry) for entry in loaded if any(ModelMatches(other, entry.get("name", "")) for other in self.shared_models))
+        return shared + self.sizes[model] <= budget
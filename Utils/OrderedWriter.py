@@ -0,0 +1,137 @@
+import asyncio
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, List, Optional
+
+from Utils.Config import EnvInt
+from Utils.Metrics import REGISTRY
+
+class PendingWrite:
+    __slots__ = ("target", "key", "write", "futures")
+
+    def __init__(self, target: str, key: Optional[str], write: Callable[[], Any], future: Future):
+        self.target = target
+        self.key = key
+        self.write = write
+        self.futures: List[Future] = [future]
+
+class WriterThread:
+    """
+    One of the IOWriterThreads threads that do the writes of the targets hashed to it, in the
+    order they were submitted. The pool has a fixed size, so per-guild folders don't each get a
+    thread and a metric label. The thread is started on the first write.
+    """
+    def __init__(self, index: int):
+        self.index = index
+        self.condition = threading.Condition()
+        self.pending: Deque[PendingWrite] = deque()
+        self.busy: Optional[str] = None
+        self.thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.collapsed = 0
+        self.failed = 0
+        owner = str(index)
+        REGISTRY.gauge("io_pending_writes", "Writes waiting for each writer thread", lambda: {(owner,): len(self.pending)}, ("writer",), owner)
+        REGISTRY.gauge("io_writes_total", "Writes done, replaced by a later write to the same key, or failed", lambda: {(owner, "written"): self.written, (owner, "collapsed"): self.collapsed, (owner, "failed"): self.failed}, ("writer", "kind"), owner, kind="counter")
+
+    def submit(self, target: str, write: Callable[[], Any], key: str = None) -> Future:
+        future = Future()
+        with self.condition:
+            last = next((item for item in reversed(self.pending) if item.target == target), None)
+            if key is not None and last is not None and last.key == key:
+                last.write = write
+                last.futures.append(future)
+                self.collapsed += 1
+            else:
+                self.pending.append(PendingWrite(target, key, write, future))
+            if self.thread is None:
+                # Daemon, so a write stuck on a dead disk can't keep the process alive, DrainWriters() waits on shutdown
+                self.thread = threading.Thread(target=self._run, name=f"writer {self.index}", daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        return future
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                item = self.pending.popleft()
+                self.busy = item.target
+            # The write runs even if every caller stopped waiting (e.g. a cancelled task), it holds
+            # a snapshot that isn't kept anywhere else
+            futures = [future for future in item.futures if future.set_running_or_notify_cancel()]
+            try:
+                result = item.write()
+            except BaseException as e:
+                self.failed += 1
+                print(f"Failed to write {item.target}: {e}")
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                self.written += 1
+                for future in futures:
+                    future.set_result(result)
+            with self.condition:
+                self.busy = None
+                self.condition.notify_all()
+
+    def drain(self, target: str = None, timeout: float = None) -> bool:
+        """Blocks until the writes submitted so far (of target, or all) are done, returns False on timeout."""
+        def done() -> bool:
+            if target is None:
+                return not self.pending and self.busy is None
+            return self.busy != target and all(item.target != target for item in self.pending)
+
+        with self.condition:
+            return self.condition.wait_for(done, timeout)
+
+class OrderedWriter:
+    """
+    Writes to one target (a file, a folder or a store) from a writer thread, in the order the
+    writes were submitted, so the event loop never waits for the disk and two writes to the same
+    target never interleave. Callers take a snapshot of what they write on the loop and submit a
+    function writing it. A write with a key replaces the target's write waiting right before it
+    with the same key, e.g. a file saved twice before the thread got to it is written once with
+    the latest snapshot, and both callers are told when that is done. Use WriterFor() to get the
+    writer of a target.
+    """
+    def __init__(self, target: str, thread: WriterThread):
+        self.target = target
+        self.thread = thread
+
+    def submit(self, write: Callable[[], Any], key: str = None) -> Future:
+        """Queues write() and returns a future of its result, usable from any thread."""
+        return self.thread.submit(self.target, write, key)
+
+    async def write(self, write: Callable[[], Any], key: str = None) -> Any:
+        """Queues write() and waits for it without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(write, key))
+
+    def drain(self, timeout: float = None) -> bool:
+        """Blocks until everything submitted to this target so far is written, returns False on timeout."""
+        return self.thread.drain(self.target, timeout)
+
+    async def wait(self, timeout: float = None) -> bool:
+        """drain() without blocking the event loop."""
+        return await asyncio.to_thread(self.drain, timeout)
+
+THREADS: List[WriterThread] = []
+THREADS_LOCK = threading.Lock()
+
+def WriterFor(target: str) -> OrderedWriter:
+    """The writer of a file, folder or store. A target always goes to the same thread, which keeps its writes in order."""
+    target = os.path.abspath(target)
+    with THREADS_LOCK:
+        if not THREADS:
+            THREADS.extend(WriterThread(index) for index in range(max(1, EnvInt("IOWriterThreads", 4))))
+    return OrderedWriter(target, THREADS[zlib.crc32(target.encode()) % len(THREADS)])
+
+async def DrainWriters(timeout: float = 30.0):
+    """Waits until every writer thread has written what it was given, for shutdown."""
+    for thread in list(THREADS):
+        if not await asyncio.to_thread(thread.drain, None, timeout):
+            print(f"Gave up waiting for {len(thread.pending)} writes of writer {thread.index}")
@@ -0,0 +1,167 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, Optional
+
+from Utils.Config import EnvFloat, EnvInt
+
+PRIORITIES = {
+    "mention": 0,
+    "chat_channel": 1,
+    "random": 2,
+}
+LOWEST_PRIORITY = max(PRIORITIES.values())
+
+class GatewayBusy(Exception):
+    """Raised when the gateway queue is full and the request was not accepted."""
+
+class RequestShed(GatewayBusy):
+    """Raised when a low priority request is dropped to keep the queue short."""
+
+class PriorityScheduler:
+    """
+    Queue for LLM requests. Requests are served by priority (mentions, then chat channel replies,
+    then random interjections). Within a priority, guilds take turns and so do the users of a guild,
+    so one busy guild or one spammer only gets their fair share of the workers.
+
+    Random interjections are shed when the queue depth reaches shed_depth or when they waited
+    longer than shed_wait, and are evicted to make room when a higher priority request arrives
+    at a full queue. A user or guild at its limit makes room the same way: its newest request of
+    a lower priority than the new one is dropped, so queued chatter never blocks a mention.
+    """
+    def __init__(self, max_depth: int = None, shed_depth: int = None, shed_wait: float = None, user_limit: int = None, guild_limit: int = None):
+        self.max_depth = max_depth if max_depth is not None else EnvInt("LLMQueueSize", 16)
+        self.shed_depth = shed_depth if shed_depth is not None else EnvInt("LLMShedDepth", 4)
+        self.shed_wait = shed_wait if shed_wait is not None else EnvFloat("LLMShedWait", 15.0)
+        self.user_limit = user_limit if user_limit is not None else EnvInt("LLMUserLimit", 2)
+        self.guild_limit = guild_limit if guild_limit is not None else EnvInt("LLMGuildLimit", 6)
+        # priority -> guild -> user -> requests
+        self.levels: Dict[int, "OrderedDict[object, OrderedDict[object, Deque]]"] = {priority: OrderedDict() for priority in sorted(set(PRIORITIES.values()))}
+        self.user_depth: Counter = Counter()
+        self.guild_depth: Counter = Counter()
+        self.depth = 0
+        self.shed = Counter()
+        self.rejected = Counter()
+        self.available = asyncio.Event()
+
+    def depth_by_priority(self) -> Dict[int, int]:
+        return {
+            priority: sum(len(requests) for users in guilds.values() for requests in users.values())
+            for priority, guilds in self.levels.items()
+        }
+
+    def put(self, request):
+        self._purge()
+        if self.user_depth[request.user_key] >= self.user_limit and not self._evict_below(request.priority, user_key=request.user_key):
+            self.rejected["user_limit"] += 1
+            raise GatewayBusy(f"user {request.user_key} already has {self.user_limit} requests queued")
+        if self.guild_depth[request.guild_key] >= self.guild_limit and not self._evict_below(request.priority, guild_key=request.guild_key):
+            self.rejected["guild_limit"] += 1
+            raise GatewayBusy(f"guild {request.guild_key} already has {self.guild_limit} requests queued")
+        if request.priority == LOWEST_PRIORITY and self.depth >= self.shed_depth:
+            self.shed["depth"] += 1
+            raise RequestShed(f"queue depth {self.depth} reached the shed threshold of {self.shed_depth}")
+        if self.depth >= self.max_depth and not self._evict_lowest(request.priority):
+            self.rejected["full"] += 1
+            raise GatewayBusy(f"LLM queue is full ({self.max_depth} pending)")
+
+        guilds = self.levels[request.priority]
+        guilds.setdefault(request.guild_key, OrderedDict()).setdefault(request.user_key, deque()).append(request)
+        self._count(request, 1)
+        self.available.set()
+
+    async def get(self):
+        while True:
+            request = self._pop()
+            if request is None:
+                self.available.clear()
+                await self.available.wait()
+                continue
+            if request.future.done():
+                continue
+            if request.priority == LOWEST_PRIORITY and time.monotonic() - request.enqueued_at > self.shed_wait:
+                self.shed["wait"] += 1
+                request.future.set_exception(RequestShed(f"waited more than {self.shed_wait}s"))
+                continue
+            return request
+
+    def drain(self):
+        while True:
+            request = self._pop()
+            if request is None:
+                return
+            request.cancel()
+
+    def _pop(self):
+        for guilds in self.levels.values():
+            if not guilds:
+                continue
+            guild_key, users = next(iter(guilds.items()))
+            guilds.move_to_end(guild_key)
+            user_key, requests = next(iter(users.items()))
+            users.move_to_end(user_key)
+            request = requests.popleft()
+            if not requests:
+                del users[user_key]
+            if not users:
+                del guilds[guild_key]
+            self._count(request, -1)
+            return request
+        return None
+
+    def _purge(self):
+        """Drops queued requests that finished while waiting (cancelled, e.g. a superseded reply), so they don't count against the limits."""
+        for guilds in self.levels.values():
+            for guild_key in list(guilds):
+                users = guilds[guild_key]
+                for user_key in list(users):
+                    requests = users[user_key]
+                    finished = [request for request in requests if request.future.done()]
+                    if not finished:
+                        continue
+                    for request in finished:
+                        requests.remove(request)
+                        self._count(request, -1)
+                    if not requests:
+                        del users[user_key]
+                if not users:
+                    del guilds[guild_key]
+
+    def _evict_lowest(self, priority: int) -> bool:
+        """Drops the newest lowest priority request to make room for a more important one."""
+        return priority < LOWEST_PRIORITY and self._evict_below(LOWEST_PRIORITY - 1)
+
+    def _evict_below(self, priority: int, guild_key=None, user_key=None) -> bool:
+        """Drops the newest request of the lowest priority below priority, only of guild_key or user_key if given."""
+        for level in sorted(self.levels, reverse=True):
+            if level <= priority:
+                return False
+            guilds = self.levels[level]
+            for candidate_guild in reversed(list(guilds)):
+                if guild_key is not None and candidate_guild != guild_key:
+                    continue
+                users = guilds[candidate_guild]
+                for candidate_user in reversed(list(users)):
+                    if user_key is not None and candidate_user != user_key:
+                        continue
+                    requests = users[candidate_user]
+                    request = requests.pop()
+                    if not requests:
+                        del users[candidate_user]
+                    if not users:
+                        del guilds[candidate_guild]
+                    self._count(request, -1)
+                    self.shed["evicted"] += 1
+                    if not request.future.done():
+                        request.future.set_exception(RequestShed("evicted for a higher priority request"))
+                    return True
+        return False
+
+    def _count(self, request, delta: int):
+        self.depth += delta
+        self.user_depth[request.user_key] += delta
+        self.guild_depth[request.guild_key] += delta
+        if self.user_depth[request.user_key] <= 0:
+            del self.user_depth[request.user_key]
+        if self.guild_depth[request.guild_key] <= 0:
+            del self.guild_depth[request.guild_key]
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from Utils.Config import EnvFloat
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+ASYNCIO_EVENTS = os.path.join("asyncio", "events.py")
+IDLE = "(idle)"
+
+def FrameLabel(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(ROOT):
+        filename = filename[len(ROOT):]
+    else:
+        # Library code, keep the path below site-packages or the standard library
+        parts = filename.replace("\\", "/").split("/")
+        filename = "/".join(parts[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def TaskLabel(task: Optional[asyncio.Task]) -> str:
+    if task is None:
+        return "(no task)"
+    name = task.get_name()
+    if name.startswith("Task-"):
+        # Unnamed tasks are told apart by the coroutine they run
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", None) or name
+    return f"task: {name}"
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the running process from a separate thread every interval seconds,
+    nothing runs between profiles. Samples of the event loop's thread are grouped by the asyncio
+    task that was running, samples where the loop was waiting for events count as idle. With
+    all_threads the other threads (to_thread workers, background imports) are sampled too.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, loop_thread: int, interval: float = None, all_threads: bool = False):
+        self.loop = loop
+        self.loop_thread = loop_thread
+        self.interval = interval if interval is not None else EnvFloat("ProfileInterval", 0.005)
+        self.all_threads = all_threads
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.loop_samples = 0
+        self.idle = 0
+        self.elapsed = 0.0
+        # Labels per code object, so a sample doesn't format strings for frames seen before
+        self.labels: Dict[object, str] = {}
+
+    def label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = FrameLabel(code)
+        return label
+
+    def run(self, seconds: float):
+        """Samples for the given seconds, blocking the calling thread (not the event loop's)."""
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        current_tasks = getattr(asyncio.tasks, "_current_tasks", {})
+        # The sampler needs the GIL to take a sample. With the default switch interval (5ms) the
+        # loop keeps it through short callbacks and samples pile up on the moments it waits in
+        # select(), a 0.1ms interval lets the sampler in while the loop is busy. Callbacks
+        # shorter than that are still undercounted.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, 0.0001))
+        started = time.perf_counter()
+        deadline = started + seconds
+        next_sample = started
+        try:
+            self.sample(own, names, current_tasks, deadline, next_sample)
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.elapsed = time.perf_counter() - started
+
+    def sample(self, own: int, names: Dict[int, str], current_tasks: Dict, deadline: float, next_sample: float):
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (ident != self.loop_thread and not self.all_threads):
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                if ident == self.loop_thread:
+                    self.loop_samples += 1
+                    stack = self.loop_stack(codes, current_tasks.get(self.loop))
+                else:
+                    if ident not in names:
+                        names.update({thread.ident: thread.name for thread in threading.enumerate()})
+                    stack = (f"thread: {names.get(ident, ident)}",) + tuple(self.label(code) for code in codes)
+                self.stacks[stack] += 1
+                self.samples += 1
+            next_sample += self.interval
+            time.sleep(max(0.0, next_sample - time.perf_counter()))
+
+    def loop_stack(self, codes: List, task: Optional[asyncio.Task]) -> Tuple[str, ...]:
+        # Everything up to asyncio's Handle._run is the same for every callback, start at the callback
+        for index in range(len(codes) - 1, -1, -1):
+            code = codes[index]
+            if code.co_name == "_run" and code.co_filename.endswith(ASYNCIO_EVENTS):
+                return ("event loop", TaskLabel(task)) + tuple(self.label(code) for code in codes[index + 1:])
+        if codes and codes[-1].co_name in ("select", "poll", "control", "_poll"):
+            self.idle += 1
+            return ("event loop", IDLE)
+        return ("event loop", "(loop internals)") + tuple(self.label(code) for code in codes)
+
+    def collapsed(self) -> str:
+        """The samples in the collapsed stack format of flamegraph.pl, speedscope and inferno."""
+        return "".join(f"{';'.join(frame.replace(';', ':') for frame in stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 15) -> str:
+        busy = self.samples - self.idle
+        lines = [f"{self.samples} samples in {self.elapsed:.1f}s, event loop busy in {(self.loop_samples - self.idle) / max(self.loop_samples, 1):.0%} of its samples"]
+        if not busy:
+            return lines[0]
+        own: Counter = Counter()
+        total: Counter = Counter()
+        tasks: Counter = Counter()
+        for stack, count in self.stacks.items():
+            if stack[-1] == IDLE:
+                continue
+            own[stack[-1]] += count
+            for frame in set(stack[1:]):
+                total[frame] += count
+            if stack[0] == "event loop":
+                tasks[stack[1]] += count
+        lines.append(f"Top functions (own / with callees, of {busy} busy samples):")
+        for frame, count in own.most_common(top):
+            lines.append(f"{count / busy:6.1%} {total[frame] / busy:6.1%}  {frame}")
+        if tasks:
+            lines.append("Busiest tasks:")
+            for task, count in tasks.most_common(5):
+                lines.append(f"{count / busy:6.1%}  {task}")
+        return "\n".join(lines)
+
+PROFILE_LOCK = asyncio.Lock()
+
+async def ProfileProcess(seconds: float, all_threads: bool = False) -> SamplingProfiler:
+    """Profiles the running process for the given seconds, one profile at a time."""
+    async with PROFILE_LOCK:
+        profiler = SamplingProfiler(asyncio.get_running_loop(), threading.get_ident(), all_threads=all_threads)
+        await asyncio.to_thread(profiler.run, seconds)
+        return profiler
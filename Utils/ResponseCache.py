@@ -0,0 +1,123 @@
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from Utils.AtomicFile import CorruptFile, ReadJson, WriteJson
+from Utils.Config import EnvFloat, EnvInt
+from Utils.OrderedWriter import WriterFor
+
+MENTION_PATTERN = re.compile(r"<[@#][!&]?\d+>")
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+SPACE_PATTERN = re.compile(r"\s+")
+
+def NormalizePrompt(text: str) -> str:
+    """Lowercases and strips mentions, punctuation and extra whitespace so "Tama, hi!" and "tama hi" match."""
+    text = MENTION_PATTERN.sub(" ", text.lower())
+    text = PUNCTUATION_PATTERN.sub(" ", text)
+    return SPACE_PATTERN.sub(" ", text).strip()
+
+class ResponseCache:
+    """
+    Caches model replies keyed on the model name, the normalized prompt and a hash of the
+    last context_turns turns of context, so "yes" is only answered from the cache after the
+    same conversation. Entries expire after ttl seconds and the least recently used entries are
+    dropped past max_entries.
+    """
+    def __init__(self, max_entries: int = None, ttl: float = None, context_turns: int = None, path: str = None):
+        self.max_entries = max_entries if max_entries is not None else EnvInt("ResponseCacheSize", 512)
+        self.ttl = ttl or EnvFloat("ResponseCacheTTL", 600.0)
+        self.context_turns = context_turns if context_turns is not None else EnvInt("ResponseCacheContextTurns", 4)
+        self.path = path if path is not None else os.getenv("ResponseCachePath", "")
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if self.path:
+            self.load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, model: str, prompt: str, context: List[Dict], scope: object = None) -> Optional[str]:
+        """scope keeps replies that depend on more than the prompt and context apart, e.g. the guild when they use its memory."""
+        normalized = NormalizePrompt(prompt)
+        if not normalized or (context and self.context_turns <= 0):
+            # Without the context in the key, only replies to prompts without earlier turns are safe to reuse
+            return None
+        digest = hashlib.sha256()
+        digest.update(model.encode())
+        digest.update(b"\0")
+        digest.update(normalized.encode())
+        if scope is not None:
+            digest.update(b"\0")
+            digest.update(str(scope).encode())
+        for turn in context[-self.context_turns:] if context else ():
+            digest.update(b"\0")
+            digest.update(turn["role"].encode())
+            digest.update(NormalizePrompt(turn["content"]).encode())
+        return digest.hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if not key or not self.enabled:
+            return None
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Optional[str], text: str):
+        if not key or not text or not self.enabled:
+            return
+        self.entries[key] = (time.time() + self.ttl, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def load(self):
+        try:
+            data = ReadJson(self.path)
+        except (OSError, CorruptFile) as e:
+            # Only cached replies are lost, the cache starts empty
+            print(f"Could not load response cache {self.path}: {e}")
+            return
+        if data is None:
+            return
+        now = time.time()
+        for key, (expires, text) in sorted(data.items(), key=lambda item: item[1][0]):
+            if expires > now:
+                self.entries[key] = (expires, text)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        print(f"Loaded {len(self.entries)} cached responses from {self.path}")
+
+    def save(self) -> Optional[Future]:
+        """Queues writing the entries that haven't expired to path on the file's writer thread."""
+        if not self.path:
+            return None
+        now = time.time()
+        data = {key: list(entry) for key, entry in self.entries.items() if entry[0] > now}
+        return WriterFor(self.path).submit(lambda: self.write(data), key=self.path)
+
+    def write(self, data: Dict):
+        try:
+            WriteJson(self.path, data)
+        except OSError as e:
+            print(f"Could not save response cache {self.path}: {e}")
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import discord
+
+from Utils.Config import EnvFloat, EnvInt
+from Utils.MessageChunks import MESSAGE_LIMIT, SplitMessage
+from Utils.Metrics import REGISTRY
+
+SEND_LATENCY = REGISTRY.histogram("discord_send_seconds", "Time from queueing an outgoing message until Discord accepted it", buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+SENDS = REGISTRY.counter("discord_sends_total", "Outgoing messages by result (coalesced counts messages merged into another)", ("result",))
+RATE_LIMITED = REGISTRY.counter("discord_rate_limited_total", "429 responses reported by discord.py", ("scope",))
+
+class RateLimitCounter(logging.Handler):
+    """Counts the 429 warnings discord.py logs, since it retries them without telling the caller."""
+    def emit(self, record: logging.LogRecord):
+        try:
+            message = record.getMessage()
+        except Exception:
+            return
+        if "Global rate limit" in message:
+            RATE_LIMITED.inc(scope="global")
+        elif "responded with 429" in message:
+            RATE_LIMITED.inc(scope="route")
+
+def InstallRateLimitCounter():
+    logger = logging.getLogger("discord.http")
+    if not any(isinstance(handler, RateLimitCounter) for handler in logger.handlers):
+        logger.addHandler(RateLimitCounter(logging.WARNING))
+
+class ChannelBucket:
+    """Token bucket mirroring Discord's per-channel message limit, so sends wait before a 429."""
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Takes a token and returns 0, or returns how long to wait until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.per / self.rate
+
+class OutgoingMessage:
+    def __init__(self, content: str, group: object):
+        self.content = content
+        self.group = group
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class SendQueue:
+    """
+    Sends bot messages through one queue per channel. Each channel is paced by a token bucket
+    (SendRate messages per SendPer seconds, Discord's limit is 5 per 5 seconds), so replies that
+    arrive together wait their turn instead of running into 429s. While a channel waits, queued
+    messages of the same group (e.g. the pieces of one reply) are merged into one message of up to
+    2000 characters. Messages without a group, like replies to different users, are never merged.
+    """
+    def __init__(self, rate: int = None, per: float = None, owner: str = ""):
+        self.rate = rate or EnvInt("SendRate", 5)
+        self.per = per or EnvFloat("SendPer", 5.0)
+        self.queues: Dict[int, Deque[OutgoingMessage]] = {}
+        self.buckets: Dict[int, ChannelBucket] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        InstallRateLimitCounter()
+        # One gauge source per bot, so in "both" mode the second bot doesn't replace the first
+        REGISTRY.gauge("discord_send_queue_depth", "Outgoing messages waiting in the send queues", lambda: {(owner,): sum(len(queue) for queue in list(self.queues.values()))}, ("model",), owner)
+
+    async def send(self, channel: discord.abc.Messageable, text: str, group: object = None) -> Optional[discord.Message]:
+        """
+        Splits text into messages Discord accepts, queues them and waits until they are sent.
+        Returns the last message, or None if there was nothing to send.
+        """
+        items = [self.enqueue(channel, chunk, group) for chunk in SplitMessage(text)]
+        sent = None
+        for item in items:
+            sent = await item.future
+        return sent
+
+    def enqueue(self, channel: discord.abc.Messageable, content: str, group: object = None) -> OutgoingMessage:
+        item = OutgoingMessage(content, group)
+        self.queues.setdefault(channel.id, deque()).append(item)
+        worker = self.workers.get(channel.id)
+        if worker is None or worker.done():
+            self._prune()
+            self.workers[channel.id] = asyncio.create_task(self._drain(channel))
+        return item
+
+    def _prune(self):
+        """Forgets idle channels whose bucket has refilled, so they don't pile up over time."""
+        if len(self.buckets) < 1024:
+            return
+        now = time.monotonic()
+        for channel_id, bucket in list(self.buckets.items()):
+            if channel_id not in self.queues and now - bucket.updated > self.per:
+                del self.buckets[channel_id]
+                self.workers.pop(channel_id, None)
+
+    async def close(self):
+        for worker in list(self.workers.values()):
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        for queue in self.queues.values():
+            for item in queue:
+                if not item.future.done():
+                    item.future.cancel()
+        self.queues.clear()
+        self.workers.clear()
+
+    async def _drain(self, channel: discord.abc.Messageable):
+        queue = self.queues[channel.id]
+        bucket = self.buckets.get(channel.id)
+        if bucket is None:
+            bucket = self.buckets[channel.id] = ChannelBucket(self.rate, self.per)
+        try:
+            while queue:
+                # Callers that were cancelled while waiting don't need their message anymore
+                while queue and queue[0].future.done():
+                    queue.popleft()
+                if not queue:
+                    break
+                wait = bucket.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+                    continue
+                batch = self._coalesce(queue)
+                content = "\n".join(item.content for item in batch)
+                try:
+                    sent = await channel.send(content)
+                except discord.HTTPException as e:
+                    SENDS.inc(result="rate_limited" if e.status == 429 else "error")
+                    for item in batch:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                    continue
+                now = time.monotonic()
+                SENDS.inc(result="sent")
+                SENDS.inc(len(batch) - 1, result="coalesced")
+                for item in batch:
+                    SEND_LATENCY.observe(now - item.enqueued_at)
+                    if not item.future.done():
+                        item.future.set_result(sent)
+        finally:
+            if not queue:
+                self.queues.pop(channel.id, None)
+
+    def _coalesce(self, queue: Deque[OutgoingMessage]) -> List[OutgoingMessage]:
+        batch = [queue.popleft()]
+        length = len(batch[0].content)
+        group = batch[0].group
+        while group is not None and queue and queue[0].group == group and length + 1 + len(queue[0].content) <= MESSAGE_LIMIT:
+            item = queue.popleft()
+            if item.future.done():
+                continue
+            batch.append(item)
+            length += 1 + len(item.content)
+        return batch
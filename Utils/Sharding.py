@@ -0,0 +1,175 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import discord
+from discord.ext import commands
+
+from Utils.Config import EnvFloat, EnvInt, EnvList
+from Utils.Metrics import REGISTRY
+
+IDENTIFY_INTERVAL = 5.0
+
+class ShardStats:
+    """Counts gateway events per shard over the last window seconds, in one-second buckets."""
+    def __init__(self, window: int = 60):
+        self.window = window
+        self.buckets: Dict[int, Deque[List[int]]] = {}
+        self.started = time.monotonic()
+
+    def observe(self, shard_id: int):
+        second = int(time.monotonic())
+        buckets = self.buckets.get(shard_id)
+        if buckets is None:
+            buckets = self.buckets[shard_id] = deque()
+        if buckets and buckets[-1][0] == second:
+            buckets[-1][1] += 1
+        else:
+            buckets.append([second, 1])
+            while buckets[0][0] <= second - self.window:
+                buckets.popleft()
+
+    def rate(self, shard_id: int) -> float:
+        """Events per second over the window, or since startup if that is shorter."""
+        now = time.monotonic()
+        buckets = self.buckets.get(shard_id, ())
+        count = sum(bucket[1] for bucket in buckets if bucket[0] > int(now) - self.window)
+        return count / max(1.0, min(self.window, now - self.started))
+
+def EventShard(args, shard_count: int) -> int:
+    """
+    Finds the shard an event came in on from its guild, like Discord assigns them:
+    (guild_id >> 22) % shard_count. Events without a guild (DMs) are on shard 0.
+    """
+    if shard_count <= 1 or not args:
+        return 0
+    first = args[0]
+    guild = first if isinstance(first, discord.Guild) else getattr(first, "guild", None)
+    if isinstance(guild, discord.Guild):
+        return guild.shard_id
+    # Raw events only carry the id
+    guild_id = getattr(first, "guild_id", None)
+    if not guild_id:
+        return 0
+    return (guild_id >> 22) % shard_count
+
+class ShardStatsMixin:
+    """Counts every dispatched event for /ping and the metrics."""
+    shard_stats: ShardStats
+
+    def dispatch(self, event_name: str, /, *args, **kwargs):
+        self.shard_stats.observe(EventShard(args, self.shard_count or 1))
+        super().dispatch(event_name, *args, **kwargs)
+
+class CountingBot(ShardStatsMixin, commands.Bot):
+    pass
+
+class CountingShardedBot(ShardStatsMixin, commands.AutoShardedBot):
+    pass
+
+def ShardSettings() -> Tuple[bool, Optional[int], Optional[List[int]]]:
+    """
+    Reads ShardCount ("auto" or a number, unset for a single connection) and ShardIds
+    (the shards this process runs, all of them when unset).
+    """
+    value = (os.getenv("ShardCount") or "").strip().lower()
+    if not value:
+        return False, None, None
+    if value == "auto":
+        return True, None, None
+    count = EnvInt("ShardCount", 0)
+    ids = [int(shard) for shard in EnvList("ShardIds")] or None
+    if count <= 0:
+        print(f"Warning: ShardCount={value!r} is not a positive number. Letting Discord decide.")
+        return True, None, None
+    return True, count, ids
+
+def RunsFirstShard() -> bool:
+    """
+    Whether this process runs shard 0 (or isn't split into shards). Cogs that keep state in memory
+    and write it back, like the RPG and the quiz, run only there: shard processes each holding
+    their own copy would overwrite each other's players and post the daily quiz once per process.
+    """
+    _, _, ids = ShardSettings()
+    return ids is None or 0 in ids
+
+def BuildBot(owner: str, **options) -> commands.Bot:
+    """Creates the bot's client, sharded if ShardCount is set, with per-shard event counting."""
+    sharded, shard_count, shard_ids = ShardSettings()
+    if sharded:
+        client = CountingShardedBot(shard_count=shard_count, shard_ids=shard_ids, **options)
+        print(f"{owner}: sharded mode, shards {shard_ids or 'all'} of {shard_count or 'auto'}")
+    else:
+        client = CountingBot(**options)
+    client.shard_stats = ShardStats()
+    # Latency is NaN until a shard has connected
+    REGISTRY.gauge("discord_shard_latency_seconds", "Gateway heartbeat latency per shard", lambda: {(owner, str(shard)): latency for shard, latency in ShardLatencies(client) if latency == latency}, ("bot", "shard"), owner)
+    REGISTRY.gauge("discord_shard_events_per_second", "Gateway events dispatched per shard over the last minute", lambda: {(owner, str(shard)): client.shard_stats.rate(shard) for shard in ShardIdsOf(client)}, ("bot", "shard"), owner)
+    REGISTRY.gauge("discord_shard_guilds", "Guilds served per shard", lambda: ShardGuilds(owner, client), ("bot", "shard"), owner)
+    return client
+
+def ShardIdsOf(client: commands.Bot) -> List[int]:
+    if isinstance(client, commands.AutoShardedBot):
+        return sorted(client.shards) or list(client.shard_ids or [0])
+    return [0]
+
+def ShardLatencies(client: commands.Bot) -> List[Tuple[int, float]]:
+    if isinstance(client, commands.AutoShardedBot):
+        return client.latencies
+    return [(0, client.latency)]
+
+def ShardGuilds(owner: str, client: commands.Bot) -> Dict[Tuple[str, str], int]:
+    counts = {(owner, str(shard)): 0 for shard in ShardIdsOf(client)}
+    for guild in client.guilds:
+        key = (owner, str(guild.shard_id))
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def RecommendedShards(token: str) -> int:
+    """Asks Discord how many shards the bot should use."""
+    request = urllib.request.Request("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (XPDB, 1.0)"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return int(json.load(response)["shards"])
+
+def LaunchShardProcesses(bot_name: str, token: str, processes: int, script: str) -> int:
+    """
+    Runs the bot as several processes that each own a contiguous range of shards. Processes are
+    started one after another, waiting IDENTIFY_INTERVAL seconds per shard, so their shards don't
+    identify at the same time and hit Discord's identify limit. Only the first process loads the
+    stateful cogs, see RunsFirstShard. Returns the first non-zero exit code.
+    """
+    count = EnvInt("ShardCount", 0) if (os.getenv("ShardCount") or "auto").strip().lower() != "auto" else 0
+    if count <= 0:
+        count = RecommendedShards(token)
+    processes = max(1, min(processes, count))
+    metrics_port = EnvInt("MetricsPort", 0)
+    delay = EnvFloat("ShardStartDelay", IDENTIFY_INTERVAL)
+    children: List[subprocess.Popen] = []
+    try:
+        for index in range(processes):
+            ids = list(range(count * index // processes, count * (index + 1) // processes))
+            env = dict(os.environ, ShardCount=str(count), ShardIds=",".join(map(str, ids)))
+            if metrics_port:
+                env["MetricsPort"] = str(metrics_port + index)
+            print(f"Starting {bot_name} process {index + 1}/{processes} with shards {ids[0]}-{ids[-1]} of {count}")
+            children.append(subprocess.Popen([sys.executable, script, bot_name], env=env))
+            if index < processes - 1:
+                time.sleep(delay * len(ids))
+        codes = [child.wait() for child in children]
+    except KeyboardInterrupt:
+        codes = [1]
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+        for child in children:
+            try:
+                child.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                child.kill()
+    return next((code for code in codes if code), 0)
@@ -0,0 +1,104 @@
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+# Only the standard library here, main.py imports this before everything else to time those imports
+
+class TimedLoader:
+    """Wraps a module's loader to time executing the module, everything else goes to the real loader."""
+    def __init__(self, loader, profile: "StartupProfile"):
+        self.loader = loader
+        self.profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self.profile.stack()
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += total
+            self.profile.record_import(module.__name__, total, total - children)
+
+class ImportTimer:
+    """Meta path finder that lets the other finders find the module and wraps the loader they return."""
+    def __init__(self, profile: "StartupProfile"):
+        self.profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module") and not isinstance(spec.loader, TimedLoader):
+            spec.loader = TimedLoader(spec.loader, self.profile)
+        return spec
+
+class StartupProfile:
+    """
+    Collects where the time until the bots are online goes: named steps since the process
+    started, time per cog and, once track_imports() was called, the import time of every module
+    (in total and without the modules it imported itself). Imports that ran in a background
+    thread are listed but not part of the time to online.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports: Dict[str, Tuple[float, float, bool]] = {}
+        self.cogs: Dict[str, float] = {}
+        self.marks: List[Tuple[str, float]] = []
+        self.tracking = False
+        self.local = threading.local()
+
+    def track_imports(self):
+        if not self.tracking:
+            self.tracking = True
+            sys.meta_path.insert(0, ImportTimer(self))
+
+    def stack(self) -> List[float]:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def record_import(self, name: str, total: float, own: float):
+        self.imports[name] = (total, own, threading.current_thread() is not threading.main_thread())
+
+    def record_cog(self, name: str, seconds: float):
+        self.cogs[name] = seconds
+
+    def mark(self, name: str):
+        self.marks.append((name, time.perf_counter() - self.started))
+
+    def report(self, top: int = 20) -> str:
+        lines = ["Startup profile (seconds since the process started):"]
+        previous = 0.0
+        for name, at in self.marks:
+            lines.append(f"  {at:7.3f}  {name} (+{at - previous:.3f})")
+            previous = at
+        if self.cogs:
+            lines.append("Cogs (time to load each, they load concurrently):")
+            for name, seconds in sorted(self.cogs.items(), key=lambda item: -item[1]):
+                lines.append(f"  {seconds:7.3f}  {name}")
+        if self.imports:
+            foreground = sum(own for _, own, background in self.imports.values() if not background)
+            lines.append(f"Imports: {len(self.imports)} modules, {foreground:.3f}s on the main thread. Slowest ({top}, own / with submodules):")
+            slowest = sorted(self.imports.items(), key=lambda item: -item[1][1])[:top]
+            for name, (total, own, background) in slowest:
+                lines.append(f"  {own:7.3f}  {total:7.3f}  {name}{'  (background)' if background else ''}")
+        return "\n".join(lines)
+
+STARTUP = StartupProfile()
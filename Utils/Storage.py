@@ -0,0 +1,382 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from Utils.AtomicFile import CorruptFile, FsyncDirectory, Generations, ReadJson, ShiftGenerations
+from Utils.Config import EnvFloat, EnvInt
+from Utils.Metrics import REGISTRY
+from Utils.OrderedWriter import DrainWriters, WriterFor
+
+NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+SYNC_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+# Records encoded per slice of a write-behind snapshot before letting other tasks run
+SNAPSHOT_SLICE = 100
+
+def Encode(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+class Collection:
+    """
+    A table of JSON values by key, e.g. one row per player. Writes touch only the rows given,
+    so their cost doesn't grow with the size of the collection.
+    """
+    def __init__(self, store: "Store", name: str):
+        self.store = store
+        self.name = name
+
+    def load(self) -> Dict[str, Any]:
+        rows = self.store.query(f'SELECT key, value FROM "{self.name}"')
+        return {key: json.loads(value) for key, value in rows}
+
+    def load_list(self) -> List[Any]:
+        """Values of a collection stored with put_list, in their order."""
+        return [value for _, value in sorted(self.load().items(), key=lambda item: int(item[0]))]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        rows = self.store.query(f'SELECT value FROM "{self.name}" WHERE key = ?', (str(key),))
+        return json.loads(rows[0][0]) if rows else default
+
+    def put(self, key: str, value: Any):
+        self.put_many({key: value})
+
+    def put_many(self, items: Dict[str, Any]):
+        self.put_rows(self.encode(items))
+
+    @staticmethod
+    def encode(items: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """Rows for put_rows, a snapshot of the values that later changes to them don't affect."""
+        return [(str(key), Encode(value)) for key, value in items.items()]
+
+    def put_rows(self, rows: List[Tuple[str, str]]):
+        if rows:
+            self.store.execute_many(f'INSERT INTO "{self.name}" (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value', rows)
+
+    def put_list(self, values: Iterable[Any]):
+        """Replaces the collection with a list, keyed by position."""
+        with self.store.batch():
+            self.clear()
+            self.put_many({str(index): value for index, value in enumerate(values)})
+
+    def delete(self, *keys: str):
+        if keys:
+            self.store.execute_many(f'DELETE FROM "{self.name}" WHERE key = ?', [(str(key),) for key in keys])
+
+    def clear(self):
+        self.store.execute_many(f'DELETE FROM "{self.name}"', [()])
+
+    def __len__(self) -> int:
+        return self.store.query(f'SELECT COUNT(*) FROM "{self.name}"')[0][0]
+
+class Store:
+    """
+    SQLite database in WAL mode shared by the cogs, each keeping its data in collections
+    (tables of JSON values by key). Reads and writes are serialized with a lock, so the store can
+    be used from the event loop and from worker threads. batch() groups writes into one
+    transaction. Writes made while the bot runs go through self.writer, the store's ordered
+    writer thread, so the event loop doesn't wait for SQLite. Use OpenStore() to get the process
+    wide store for a path.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.writes = 0
+        self.connection = self.connect()
+        problem = self.check(self.connection)
+        if problem:
+            self.connection.close()
+            self.restore(problem)
+            self.connection = self.connect()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # FULL syncs the WAL on every commit, so a power loss can't drop a committed write. The
+        # write-behind caches commit many changes at once, so that is one fsync per flush, not
+        # per click. NORMAL only syncs on checkpoints: faster, but the last commits can be lost.
+        sync = os.getenv("StorageSync", "FULL").upper()
+        if sync not in SYNC_MODES:
+            print(f"Warning: StorageSync={sync} is not one of {', '.join(SYNC_MODES)}, using FULL")
+            sync = "FULL"
+        self.connection.execute(f"PRAGMA synchronous={sync}")
+        self.connection.execute('CREATE TABLE IF NOT EXISTS "meta" (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.collections: Dict[str, Collection] = {}
+        self.writer = WriterFor(path)
+        self.keep_generation()
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=EnvInt("StorageBusyTimeout", 5000) / 1000)
+
+    @staticmethod
+    def check(connection: sqlite3.Connection) -> Optional[str]:
+        """What is wrong with the database, None if it passes SQLite's quick integrity check."""
+        try:
+            rows = connection.execute("PRAGMA quick_check").fetchall()
+        except sqlite3.DatabaseError as e:
+            return str(e)
+        return None if rows == [("ok",)] else "; ".join(row[0] for row in rows[:5])
+
+    def restore(self, problem: str):
+        """Replaces a corrupt database with its newest previous generation that passes the check, keeping the corrupt files aside."""
+        for candidate in Generations(self.path)[1:]:
+            if not os.path.exists(candidate):
+                continue
+            connection = sqlite3.connect(candidate)
+            try:
+                if self.check(connection) is None:
+                    break
+            finally:
+                connection.close()
+        else:
+            raise CorruptFile(f"{self.path} is corrupt ({problem}) and no previous generation passes the integrity check")
+        aside = f"{self.path}.corrupt-{time.strftime('%Y%m%d-%H%M%S')}"
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.replace(self.path + suffix, aside + suffix)
+        shutil.copyfile(candidate, self.path)
+        print(f"Warning: {self.path} is corrupt ({problem}), moved it to {aside} and restored {candidate}")
+
+    def keep_generation(self):
+        """
+        Copies the database to generation 1 (StorageGenerations are kept) when it was opened
+        after changing since the last copy, so a database corrupted later can be restored.
+        """
+        count = EnvInt("StorageGenerations", 2)
+        newest = f"{self.path}.1"
+        if count <= 0:
+            return
+        changed = max(os.path.getmtime(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix))
+        # Nothing changed since the last copy
+        if os.path.exists(newest) and os.path.getmtime(newest) >= changed:
+            return
+        temp = f"{self.path}.generation"
+        if os.path.exists(temp):
+            os.remove(temp)
+        target = sqlite3.connect(temp)
+        try:
+            with self.lock:
+                self.connection.backup(target)
+            # Generations are single files, so they can be copied back as they are
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+        with open(temp, "rb+") as f:
+            os.fsync(f.fileno())
+        ShiftGenerations(self.path, count)
+        os.replace(temp, newest)
+        FsyncDirectory(os.path.dirname(self.path))
+
+    def collection(self, name: str) -> Collection:
+        if not NAME_PATTERN.match(name) or name == "meta":
+            raise ValueError(f"Invalid collection name: {name!r}")
+        collection = self.collections.get(name)
+        if collection is None:
+            with self.lock:
+                self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            collection = self.collections[name] = Collection(self, name)
+        return collection
+
+    def query(self, sql: str, parameters: Tuple = ()) -> List[Tuple]:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def execute_many(self, sql: str, rows: List[Tuple]):
+        with self.batch():
+            self.connection.executemany(sql, rows)
+            self.writes += len(rows)
+
+    @contextmanager
+    def batch(self):
+        """Writes inside the block are committed together, or not at all if it raises."""
+        with self.lock:
+            if self.depth == 0:
+                self.connection.execute("BEGIN IMMEDIATE")
+            self.depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute("ROLLBACK")
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                self.connection.execute("COMMIT")
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self.query('SELECT value FROM "meta" WHERE key = ?', (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key: str, value: str):
+        self.execute_many('INSERT INTO "meta" (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value', [(key, value)])
+
+    def import_once(self, name: str, load) -> bool:
+        """
+        Runs load(store) the first time the store sees this name, in one transaction with marking
+        it as done, so the old JSON files are only imported once. Returns True if it ran.
+        """
+        with self.batch():
+            if self.get_meta(f"imported:{name}") is not None:
+                return False
+            load(self)
+            self.set_meta(f"imported:{name}", "1")
+        return True
+
+    def close(self):
+        self.writer.drain()
+        with self.lock:
+            self.connection.close()
+        STORES.pop(os.path.abspath(self.path), None)
+
+class WriteBehind:
+    """
+    Write-behind cache for a cog's collections: the cog keeps its records in memory, marks the
+    ones it changed and a background task writes only those, every FlushInterval seconds or as
+    soon as FlushMaxDirty records are waiting. Records marked several times in between are
+    written once. readers maps each collection to a function returning the current value of a
+    key, None deletes the row. A flush encodes the records on the event loop in slices, yielding
+    between them, and the store's writer thread writes them in one transaction. stop() flushes a
+    last time and is called from cog_unload, FlushAll() from main on shutdown.
+    """
+    def __init__(self, store: Store, name: str, readers: Dict[str, Callable[[str], Any]], interval: float = None, max_dirty: int = None):
+        self.store = store
+        self.name = name
+        self.readers = readers
+        self.collections = {collection: store.collection(collection) for collection in readers}
+        self.interval = interval if interval is not None else EnvFloat("FlushInterval", 2.0)
+        self.max_dirty = max_dirty if max_dirty is not None else EnvInt("FlushMaxDirty", 500)
+        self.dirty: Dict[str, Dict[str, None]] = {collection: {} for collection in readers}
+        self.pending = 0
+        self.marked = 0
+        self.flushed = 0
+        # One flush at a time, so an older snapshot of a record can't be written after a newer one
+        self.flushing = asyncio.Lock()
+        self.wake: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        WRITE_BEHIND[name] = self
+        owner = name
+        REGISTRY.gauge("storage_dirty_records", "Changed records waiting to be written", lambda: {(owner,): self.pending}, ("store",), owner)
+        REGISTRY.gauge("storage_writes_total", "Records marked as changed and records written", lambda: {(owner, "marked"): self.marked, (owner, "written"): self.flushed}, ("store", "kind"), owner, kind="counter")
+
+    def mark(self, collection: str, *keys):
+        self.add(collection, keys)
+        self.marked += len(keys)
+        if self.pending >= self.max_dirty and self.wake is not None:
+            self.wake.set()
+
+    def add(self, collection: str, keys: Iterable):
+        dirty = self.dirty[collection]
+        for key in keys:
+            key = str(key)
+            if key not in dirty:
+                dirty[key] = None
+                self.pending += 1
+
+    def restore(self, dirty: Dict[str, Dict[str, None]]):
+        """Marks the records of a failed flush again, for the next one."""
+        for collection, keys in dirty.items():
+            self.add(collection, keys)
+
+    def start(self):
+        if self.task is None:
+            self.wake = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush()
+
+    async def snapshot(self, dirty: Dict[str, Dict[str, None]]) -> Dict[str, Tuple[List[Tuple[str, str]], List[str]]]:
+        """Rows to write and keys to delete per collection. A record changed after it was encoded is marked again, the next flush writes it."""
+        rows = {}
+        encoded = 0
+        for collection, keys in dirty.items():
+            read = self.readers[collection]
+            puts, deletes = [], []
+            for key in keys:
+                value = read(key)
+                if value is None:
+                    deletes.append(key)
+                else:
+                    puts.append((key, Encode(value)))
+                encoded += 1
+                if encoded % SNAPSHOT_SLICE == 0:
+                    await asyncio.sleep(0)
+            rows[collection] = (puts, deletes)
+        return rows
+
+    def write(self, rows: Dict[str, Tuple[List[Tuple[str, str]], List[str]]]):
+        # Runs on the store's writer thread
+        with self.store.batch():
+            for collection, (puts, deletes) in rows.items():
+                self.collections[collection].put_rows(puts)
+                self.collections[collection].delete(*deletes)
+
+    async def flush(self) -> int:
+        """Writes the pending records, returns how many."""
+        async with self.flushing:
+            if not self.pending:
+                return 0
+            dirty, self.dirty = self.dirty, {collection: {} for collection in self.readers}
+            count, self.pending = self.pending, 0
+            try:
+                rows = await self.snapshot(dirty)
+                await self.store.writer.write(lambda: self.write(rows))
+            except asyncio.CancelledError:
+                # Stopped mid-flush, stop() flushes them again
+                self.restore(dirty)
+                raise
+            except Exception as e:
+                print(f"Failed to write {count} records of {self.name}: {e}")
+                self.restore(dirty)
+                return 0
+            self.flushed += count
+            return count
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+WRITE_BEHIND: Dict[str, WriteBehind] = {}
+
+async def FlushAll():
+    """Writes what every write-behind cache still holds and waits for the writer threads, for shutdown."""
+    for writer in list(WRITE_BEHIND.values()):
+        await writer.flush()
+    await DrainWriters()
+
+STORES: Dict[str, Store] = {}
+STORES_LOCK = threading.Lock()
+
+def OpenStore(path: str = None) -> Store:
+    """The store for a path (StoragePath, DataFiles/storage.db by default), shared by every cog of the process."""
+    path = path or os.getenv("StoragePath") or "DataFiles/storage.db"
+    with STORES_LOCK:
+        store = STORES.get(os.path.abspath(path))
+        if store is None:
+            store = STORES[os.path.abspath(path)] = Store(path)
+        return store
+
+def LoadJson(filename: str) -> dict:
+    """
+    Loads JSON data from a file, used to import the files the cogs kept before the store.
+    Returns an empty dictionary if the file doesn't exist. A file that is cut short or invalid
+    falls back to its previous generation, if none loads CorruptFile is raised, so the import
+    stops instead of replacing everyone's progress with nothing.
+    """
+    return ReadJson(filename, {})
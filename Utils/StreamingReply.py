@@ -0,0 +1,129 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+import discord
+
+from Utils.Config import EnvFloat
+from Utils.Metrics import REGISTRY
+from Utils.MessageChunks import MESSAGE_LIMIT, SplitMessage
+from Utils.SendQueue import SendQueue
+
+FIRST_TEXT = REGISTRY.histogram("discord_reply_first_text_seconds", "Time from deciding to reply until the first generated text is visible", ("model", "trigger"))
+
+class StreamingReply:
+    """
+    Posts a placeholder message and edits it while the reply streams in.
+    Edits are throttled to one per edit_interval seconds so a channel never gets close to
+    Discord's message edit rate limit (5 edits per 5 seconds). New messages (the placeholder and
+    the rest of a reply longer than one message) go through sender when one is given.
+    """
+    def __init__(self, channel: discord.abc.Messageable, edit_interval: float = None, placeholder: str = "💭 ...", labels: Dict[str, str] = None, sender: SendQueue = None):
+        self.channel = channel
+        self.sender = sender
+        self.labels = labels or {}
+        self.edit_interval = edit_interval or EnvFloat("StreamEditInterval", 1.2)
+        self.placeholder = placeholder
+        self.message: Optional[discord.Message] = None
+        self.text = ""
+        self.shown = ""
+        self.edits = 0
+        self.started_at = time.monotonic()
+        self.first_text_at: Optional[float] = None
+        self.changed = asyncio.Event()
+        self.placeholder_task: Optional[asyncio.Task] = None
+        self.editor: Optional[asyncio.Task] = None
+        self.sending_placeholder = False
+
+    def start(self):
+        """
+        Schedules the placeholder. It is sent on the next loop iteration, so a reply that is
+        rejected or answered from the cache right away never posts one.
+        """
+        self.placeholder_task = asyncio.create_task(self._send_placeholder())
+
+    def feed(self, text: str):
+        """Called with the full text generated so far. Never blocks, the edit loop picks it up."""
+        self.text = text
+        self.changed.set()
+
+    async def finish(self, text: Optional[str]):
+        """Shows the final text, or removes the placeholder if there is no reply."""
+        await self._stop_editor()
+        if not self.message:
+            if text and text.strip():
+                await self._send(text, self)
+            return
+        if not text or not text.strip():
+            try:
+                await self.message.delete()
+            except discord.HTTPException:
+                pass
+            return
+
+        chunks = SplitMessage(text)
+        await self._show(chunks[0])
+        for chunk in chunks[1:]:
+            await self._send(chunk, self)
+        self.report()
+
+    def report(self):
+        total = time.monotonic() - self.started_at
+        first_text = "n/a"
+        if self.first_text_at:
+            FIRST_TEXT.observe(self.first_text_at - self.started_at, **self.labels)
+            first_text = f"{self.first_text_at - self.started_at:.2f}s"
+        print(f"Streamed reply in #{getattr(self.channel, 'name', self.channel)}: first text {first_text}, done {total:.2f}s, {self.edits} edits")
+
+    async def _stop_editor(self):
+        if self.placeholder_task and not self.placeholder_task.done():
+            if self.sending_placeholder:
+                # Let a placeholder that is already on its way land, so it can be edited or deleted
+                await asyncio.wait({self.placeholder_task})
+            else:
+                self.placeholder_task.cancel()
+        if self.editor and not self.editor.done():
+            self.editor.cancel()
+            try:
+                await self.editor
+            except asyncio.CancelledError:
+                pass
+
+    async def _send_placeholder(self):
+        self.sending_placeholder = True
+        try:
+            self.message = await self._send(self.placeholder, None)
+        except discord.HTTPException as e:
+            print(f"Failed to send placeholder: {e}")
+            return
+        finally:
+            self.sending_placeholder = False
+        self.editor = asyncio.create_task(self._edit_loop())
+
+    async def _send(self, text: str, group: object) -> Optional[discord.Message]:
+        if self.sender:
+            return await self.sender.send(self.channel, text, group)
+        sent = None
+        for chunk in SplitMessage(text):
+            sent = await self.channel.send(chunk)
+        return sent
+
+    async def _edit_loop(self):
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            await self._show(self.text[:MESSAGE_LIMIT])
+            await asyncio.sleep(self.edit_interval)
+
+    async def _show(self, text: str):
+        if not text.strip() or text == self.shown:
+            return
+        try:
+            await self.message.edit(content=text)
+        except discord.HTTPException as e:
+            print(f"Failed to edit streamed reply: {e}")
+            return
+        self.shown = text
+        self.edits += 1
+        if self.first_text_at is None:
+            self.first_text_at = time.monotonic()
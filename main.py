@@ -1,96 +1,45 @@
+import sys
+from Utils.StartupProfile import STARTUP
+if "--profile-startup" in sys.argv:
+    # Installed before the other imports so their time is counted too
+    STARTUP.track_imports()
+
 import os
 import asyncio
+import time
 import discord
 from discord.ext import commands
 import random
 from dotenv import load_dotenv
 import argparse
-import ollama
 import json
-
+from Utils.Config import EnvBool, EnvFloat, EnvInt
+from Utils.ContextStore import ContextStore
+from Utils.Debouncer import ChannelDebouncer
+from Utils.Intents import BotIntents, MemberCacheOptions, MemberLookup
+from Utils.LazyImport import PreloadLazyModules
+from Utils.LLMGateway import LLMGateway, GatewayBusy, RequestShed
+from Utils.LongTermMemory import LongTermMemory
+from Utils.LoopMonitor import LOOP_MONITOR
+from Utils.MemoryBudget import MEMORY_TRACKER
+from Utils.Metrics import REGISTRY, MetricsServer, ResidentMemoryBytes
+from Utils.ModelResidency import ModelResidency
+from Utils.MessageRouter import CompileNamePattern, MessageRouter, Rule
+from Utils.ResponseCache import ResponseCache
+from Utils.SendQueue import SendQueue
+from Utils.Sharding import BuildBot, LaunchShardProcesses, RunsFirstShard
+from Utils.Storage import FlushAll
+from Utils.StreamingReply import StreamingReply
+
+STARTUP.mark("imports")
 load_dotenv()
-parser = argparse.ArgumentParser(description="Run TamaBot or SakiBot")
-parser.add_argument("bot", choices=["tama", "saki"], help="Specify the bot to run (tama or saki)", nargs="?", default="tama")
+parser = argparse.ArgumentParser(description="Run TamaBot, SakiBot or both")
+parser.add_argument("bot", choices=["tama", "saki", "both"], help="Specify the bot to run (tama, saki, or both in one process)", nargs="?", default="tama")
+parser.add_argument("--shard-processes", type=int, default=1, help="Run the bot as this many processes that split its shards (sets ShardCount=auto if unset)")
+parser.add_argument("--dry-run", action="store_true", help="Create the bots and load their cogs without connecting, print the memory use and exit")
+parser.add_argument("--profile-startup", action="store_true", help="Print the import time per module, the time per cog and the time until the bots are online")
 args = parser.parse_args()
 
-def GenerateResponse(message, modelName):
-    try:
-        response = ollama.chat(
-            model=modelName,
-            messages=[{'role': 'user', 'content': message.content}],
-            stream=False,
-        )
-        AIResponse = response['message']['content']
-        return AIResponse
-    except Exception as e:
-        print(f"An error occurred in GenerateResponse: {e}")
-        return None
-
-def GenerateGameList():
-    # Path to the bot folder
-    bot_directory = os.path.dirname(os.path.abspath(__file__))
-    game_list_file = os.path.join(bot_directory, "GameList.json")
-
-    games = []
-
-    # Read games from GameList.json in the bot folder
-    try:
-        with open(game_list_file, "r") as file:
-            gamelist = json.load(file)["games"]
-            games.extend(gamelist)
-        print(f"Loaded {len(gamelist)} games from GameList.json")
-    except FileNotFoundError:
-        print(f"GameList.json not found: {game_list_file}")
-    except json.JSONDecodeError as e:
-        print(f"Error parsing GameList.json: {e}")
-    except KeyError:
-        print("'games' key not found in GameList.json")
-
-    steam_directory = os.path.join(r"C:\\Program Files (x86)\\Steam\\steamapps\\common")
-    if os.path.isdir(steam_directory):
-        try:
-            steam_games = [name for name in os.listdir(steam_directory) if os.path.isdir(os.path.join(steam_directory, name))]
-            games.extend(steam_games)
-            print(f"Found {len(steam_games)} games in Steam directory")
-        except Exception as e:
-            print(f"Error accessing Steam directory {steam_directory}: {e}")
-
-    print(f"Total games found: {len(games)}")
-    return games
-
-async def SetActivity(self):
-    while True:
-        print("SetActivity function called")  # Debug print
-        try:
-            games = GenerateGameList()
-            print(f"Found {len(games)} games")  # Debug print
-            if not games:
-                print("No games found.")
-                return
-
-            game = random.choice(games)
-            print(f"Changing status to: {game}")  # Debug print
-            await self.client.change_presence(status=discord.Status.online, activity=discord.Game(name=game))
-            print("Status changed successfully")  # Debug print
-            print("Activity loop started")
-            await asyncio.sleep(43200)
-                
-        except Exception as e:
-            print(f"An error occurred in SetActivity: {e}")
-
-def GenerateResponse(message, modelName):
-    try:
-        response = ollama.chat(
-            model=modelName,
-            messages=[{'role': 'user', 'content': message.content}],
-            stream=False,
-        )
-        AIResponse = response['message']['content']
-        return AIResponse
-    except Exception as e:
-        print(f"An error occurred in GenerateResponse: {e}")
-        return None
-
 def GenerateGameList():
     # Path to the bot folder
     bot_directory = os.path.dirname(os.path.abspath(__file__))
@@ -133,99 +82,262 @@ async def SetActivity(self):
         await asyncio.sleep(43200)
 
 class DiscordBotBase:
-    def __init__(self, modelName, commandPrefix, intents, token, chatChannel):
-        self.client = commands.Bot(command_prefix=commandPrefix, case_insensitive=True, intents=intents)
+    def __init__(self, modelName, commandPrefix, intents, token, chatChannel, botNames, gateway=None, responseCache=None, connector=None):
+        # gateway, responseCache and connector are passed in when several bots share one process
+        self.client = BuildBot(modelName, command_prefix=commandPrefix, case_insensitive=True, intents=intents, connector=connector, **MemberCacheOptions(intents))
         self.client.chatlog_dir = "logs/"
+        self.client.member_lookup = MemberLookup(intents, modelName)
         self.token = token
         self.chatChannel = chatChannel
         self.modelName = modelName
+        self.botNames = botNames
+        self.gateway = gateway or LLMGateway()
+        self.residency = ModelResidency(self.gateway.pool, [modelName])
+        self.streamReplies = EnvBool("StreamReplies", True)
+        self.context = ContextStore()
+        self.contextReuse = EnvBool("ContextReuse", False)
+        self.memory = LongTermMemory(self.gateway.pool, modelName)
+        self.sharedCache = responseCache is not None
+        self.responseCache = responseCache or ResponseCache()
+        self.sendQueue = SendQueue(owner=modelName)
+        self.debouncer = ChannelDebouncer(lambda batch: self.SendResponse(batch, "chat_channel"))
+        self.router = self.BuildRouter()
+        self.RegisterMetrics()
+        MEMORY_TRACKER.track(modelName, self)
 
         self.client.event(self.on_ready)
         self.client.event(self.on_message)
 
-    async def on_ready(self):
-        self.client.loop.create_task(SetActivity(self))
-        channel = discord.utils.get(name=self.chatChannel)
-        messages = []
-        async for message in channel.history(limit=10):
-            messages.append(message)
-        for message in messages:
-            if message.author.bot:
-                continue
+    def FormatTurn(self, message):
+        if message.author == self.client.user:
+            return {'role': 'assistant', 'content': message.content}
+        return {'role': 'user', 'content': f"{message.author.display_name}: {message.content}"}
+
+    def FormatBatch(self, batch):
+        """Merges several messages into one user turn, naming each author once per run of messages."""
+        if len(batch) == 1:
+            return self.FormatTurn(batch[0])
+        lines = []
+        lastAuthor = None
+        for message in batch:
+            if message.author != lastAuthor:
+                lines.append(f"{message.author.display_name}: {message.content}")
+            else:
+                lines.append(message.content)
+            lastAuthor = message.author
+        return {'role': 'user', 'content': "\n".join(lines)}
+
+    async def Recall(self, message, prompt, history):
+        """Prefixes the prompt with related snippets from the guild's long-term memory."""
+        guildId = message.guild.id if message.guild else None
+        try:
+            snippets = await self.memory.recall(guildId, prompt['content'], exclude=[turn['content'] for turn in history])
+        except Exception as e:
+            print(f"Could not search long-term memory: {e}")
+            return prompt
+        if not snippets:
+            return prompt
+        remembered = "\n".join(f"- {snippet}" for snippet in snippets)
+        return {'role': prompt['role'], 'content': f"(Earlier in this server:\n{remembered})\n\n{prompt['content']}"}
+
+    async def GenerateResponse(self, batch, trigger, on_chunk=None):
+        message = batch[-1]
+        guildId = message.guild.id if message.guild else None
+        prompt = self.FormatBatch(batch)
+        messages = self.context.build(message.channel.id, prompt)
+        # Replies that used the guild's long-term memory are only reused in that guild
+        cacheKey = self.responseCache.key(self.modelName, "\n".join(m.content for m in batch), messages[:-1], guildId if self.memory.enabled else None)
+        try:
+            AIResponse = self.responseCache.get(cacheKey)
+            if AIResponse is None:
+                kvContext = None
+                fullPrompt = await self.Recall(message, prompt, messages[:-1]) if self.memory.enabled else prompt
+                requestMessages = messages[:-1] + [fullPrompt]
+                if self.contextReuse:
+                    promptText, kvContext = self.context.build_prompt(message.channel.id, fullPrompt, self.modelName, self.botNames[0].capitalize())
+                    requestMessages = [{'role': 'user', 'content': promptText}]
+                request = self.gateway.submit(
+                    self.modelName,
+                    requestMessages,
+                    on_chunk=on_chunk,
+                    trigger=trigger,
+                    user_key=message.author.id,
+                    guild_key=guildId,
+                    context=kvContext,
+                    affinity=message.channel.id,
+                )
+                try:
+                    AIResponse = await self.gateway.wait(request)
+                except Exception:
+                    if self.contextReuse:
+                        self.context.save_kv(message.channel.id, self.modelName, None)
+                    raise
+                self.responseCache.put(cacheKey, AIResponse)
+                if AIResponse:
+                    self.context.append(message.channel.id, prompt['role'], prompt['content'])
+                    self.context.append(message.channel.id, 'assistant', AIResponse)
+                    if self.contextReuse:
+                        self.context.save_kv(message.channel.id, self.modelName, request.context)
+                    self.memory.remember(guildId, message.channel.id, prompt['content'])
+                    self.memory.remember(guildId, message.channel.id, f"{self.botNames[0].capitalize()}: {AIResponse}")
+            elif AIResponse:
+                # A cached reply is not in Ollama's context for this channel, start over next turn
+                self.context.append(message.channel.id, prompt['role'], prompt['content'])
+                self.context.append(message.channel.id, 'assistant', AIResponse)
+                self.context.save_kv(message.channel.id, self.modelName, None)
+            return AIResponse
+        except RequestShed:
+            return None
+        except GatewayBusy as e:
+            print(f"Skipping reply to message {message.id}: {e}")
+            return None
+        except asyncio.TimeoutError as e:
+            print(f"GenerateResponse timed out: {e}")
+            return None
+        except Exception as e:
+            print(f"An error occurred in GenerateResponse: {e}")
+            return None
 
-    async def on_message(self, message):
-        if message.author.bot or message.content.startswith("!"):
+    async def SendResponse(self, batch, trigger):
+        message = batch[-1]
+        if not self.streamReplies:
+            AIResponse = await self.GenerateResponse(batch, trigger)
+            if AIResponse:
+                try:
+                    await self.sendQueue.send(message.channel, AIResponse)
+                except discord.HTTPException as e:
+                    print(f"Failed to send reply in #{getattr(message.channel, 'name', message.channel)}: {e}")
             return
 
-        if message.channel.name == self.chatChannel:
-            AIResponse = GenerateResponse(message, self.modelName)
-            if AIResponse:
-                await message.channel.send(AIResponse)
-        
-        elif "tama" in message.content.lower() or "saki" in message.content.lower():
-            AIResponse = GenerateResponse(message, self.modelName)
-            if AIResponse:
-                await message.channel.send(AIResponse)
-    
-        elif message.channel.name != self.chatChannel:
-            rand = random.randrange(0, 6)
-            if rand == 0:
-                AIResponse = GenerateResponse(message)
-                if AIResponse:
-                    await message.channel.send(AIResponse)
+        reply = StreamingReply(message.channel, labels={'model': self.modelName, 'trigger': trigger}, sender=self.sendQueue)
+        AIResponse = None
+        reply.start()
+        try:
+            AIResponse = await self.GenerateResponse(batch, trigger, on_chunk=reply.feed)
+        finally:
+            await reply.finish(AIResponse)
 
-        if message.channel.name == self.chatChannel:
-            AIResponse = GenerateResponse(message, self.modelName)
-            if AIResponse:
-                await message.channel.send(AIResponse)
-        
-        elif "tama" in message.content.lower() or "saki" in message.content.lower():
-            AIResponse = GenerateResponse(message, self.modelName)
-            if AIResponse:
-                await message.channel.send(AIResponse)
-    
-        elif message.channel.name != self.chatChannel:
-            rand = random.randrange(0, 6)
-            if rand == 0:
-                AIResponse = GenerateResponse(message)
-                if AIResponse:
-                    await message.channel.send(AIResponse)
+    async def on_ready(self):
+        self.client.loop.create_task(SetActivity(self))
+        self.residency.start()
+        self.memory.start()
+        await self.WarmContext()
+
+    async def WarmContext(self):
+        """Loads the recent history of every chat channel into the context store."""
+        limit = EnvInt("ContextWarmMessages", 10)
+        for guild in self.client.guilds:
+            for channel in guild.text_channels:
+                if channel.name != self.chatChannel or channel.id in self.context:
+                    continue
+                try:
+                    messages = [message async for message in channel.history(limit=limit)]
+                except discord.HTTPException as e:
+                    print(f"Could not read history of #{channel.name}: {e}")
+                    continue
+                for message in reversed(messages):
+                    if message.author.bot and message.author != self.client.user:
+                        continue
+                    turn = self.FormatTurn(message)
+                    self.context.append(channel.id, turn['role'], turn['content'])
+
+    def BuildRouter(self):
+        namePattern = CompileNamePattern(self.botNames)
+        randomChance = EnvFloat("RandomReplyChance", 1 / 6)
+
+        async def push(message):
+            self.debouncer.push(message)
+
+        async def mention(message):
+            await self.SendResponse([message], "mention")
+
+        async def interject(message):
+            await self.SendResponse([message], "random")
+
+        return MessageRouter([
+            Rule("ignored", lambda message: message.author.bot or message.content.startswith("!")),
+            Rule("chat_channel", lambda message: getattr(message.channel, "name", None) == self.chatChannel, push),
+            Rule("mention", lambda message: namePattern.search(message.content) is not None or self.client.user in message.mentions, mention),
+            Rule("random", lambda message: random.random() < randomChance, interject),
+        ])
+
+    def RegisterMetrics(self):
+        owner = self.modelName
+        cacheOwner = "shared" if self.sharedCache else owner
+        REGISTRY.gauge("bot_message_routes_total", "Messages handled by each routing rule", lambda: {(owner, rule): count for rule, count in self.router.counts.items()}, ("model", "rule"), owner, kind="counter")
+        REGISTRY.gauge("llm_response_cache_total", "Response cache lookups by result", lambda: {(cacheOwner, "hit"): self.responseCache.hits, (cacheOwner, "miss"): self.responseCache.misses}, ("model", "result"), cacheOwner, kind="counter")
+        REGISTRY.gauge("llm_response_cache_entries", "Replies held in the response cache", lambda: {(cacheOwner,): len(self.responseCache.entries)}, ("model",), cacheOwner)
+        REGISTRY.gauge("chat_debounce_total", "Chat channel messages, batches answered, replies superseded and batches sent after ChatDebounceMaxWait", lambda: {(owner, "messages"): self.debouncer.messages, (owner, "batches"): self.debouncer.batches, (owner, "superseded"): self.debouncer.superseded, (owner, "capped"): self.debouncer.capped}, ("model", "kind"), owner, kind="counter")
+        REGISTRY.gauge("llm_context_reuse_total", "Replies generated on top of the saved Ollama context, or starting over from the history", lambda: {(owner, "reused"): self.context.reused, (owner, "restarted"): self.context.restarted}, ("model", "result"), owner, kind="counter")
+        REGISTRY.gauge("memory_recalled_total", "Snippets from long-term memory added to prompts", lambda: {(owner,): self.memory.recalled}, ("model",), owner, kind="counter")
+        REGISTRY.gauge("context_store_tokens", "Estimated tokens held in the conversation context store", lambda: {(owner,): self.context.total_tokens}, ("model",), owner)
+
+    async def on_message(self, message):
+        await self.router.dispatch(message)
+
+    async def Shutdown(self):
+        """Stops this bot's background work. Shared resources are stopped by main()."""
+        await self.debouncer.close()
+        await self.sendQueue.close()
+        await self.residency.stop()
+        await self.memory.stop()
+        if not self.client.is_closed():
+            await self.client.close()
+        if not self.sharedCache:
+            self.responseCache.save()
+            print(f"Response cache: {self.responseCache.stats()}")
+        print(f"{self.modelName} message routes: {dict(self.router.counts)}")
 
 class TamaBot(DiscordBotBase):
-    def __init__(self):
-        super().__init__(modelName="Tamaneko", commandPrefix=["tama"], intents=discord.Intents.all(), token=os.getenv("TamaToken"), chatChannel=os.getenv("ChatChannel"))
-        self.botNames = ["tama", "tamaneko"]
+    def __init__(self, **shared):
+        super().__init__(modelName="Tamaneko", commandPrefix=["tama"], intents=BotIntents(COG_SETS["tama"]), token=os.getenv("TamaToken"), chatChannel=os.getenv("ChatChannel"), botNames=["tama", "tamaneko"], **shared)
 
     async def on_ready(self):
         await super().on_ready()
 
 class SakiBot(DiscordBotBase):
-    def __init__(self):
-        super().__init__(modelName="Autumn", commandPrefix=["saki"], intents=discord.Intents.all(), token=os.getenv("SakiToken"), chatChannel=os.getenv("ChatChannel"))
-        # self.modelName = "Autumn"
-        self.botNames = ["saki", "autumn"]
+    def __init__(self, **shared):
+        super().__init__(modelName="Autumn", commandPrefix=["saki"], intents=BotIntents(COG_SETS["saki"]), token=os.getenv("SakiToken"), chatChannel=os.getenv("ChatChannel"), botNames=["saki", "autumn"], **shared)
 
     async def on_ready(self):
         await super().on_ready()
 
+BOTS = {
+    "tama": TamaBot,
+    "saki": SakiBot,
+}
+
+# Cogs each bot loads
+COG_SETS = {
+    "tama": ['Cogs.ModerationCog', 'Cogs.MusicCog', 'Cogs.RPGCog'],
+    "saki": ['Cogs.ModerationCog', 'Cogs.QuizCog'],
+}
+# Cogs that keep their players and state in memory, loaded only by the process running shard 0
+STATEFUL_COGS = ['Cogs.QuizCog', 'Cogs.RPGCog']
+
 class Cog:
-    def __init__(self, client):
+    def __init__(self, client, botName):
         self.client = client
+        self.botName = botName
 
     async def load_cogs(self):
         # First unload ALL possible cogs
         await self.remove_cogs()
         
-        # Then load specific ones per bot
-        if args.bot == "tama":
-            await self.client.load_extension('Cogs.ModerationCog')
-            await self.client.load_extension('Cogs.MusicCog')
-            await self.client.load_extension('Cogs.RPGCog')
-            print("Loaded Tama cogs: Moderation, Music, RPG")
-        elif args.bot == "saki":
-            await self.client.load_extension('Cogs.ModerationCog')
-            await self.client.load_extension('Cogs.QuizCog')
-            print("Loaded Saki cogs: Moderation, Quiz")
+        # Then load specific ones per bot, together so their data files are read at the same time
+        cogs = COG_SETS[self.botName]
+        if not RunsFirstShard():
+            skipped = [cog for cog in cogs if cog in STATEFUL_COGS]
+            cogs = [cog for cog in cogs if cog not in STATEFUL_COGS]
+            if skipped:
+                print(f"Not loading {', '.join(skipped)}: only the process with shard 0 loads them")
+        await asyncio.gather(*(self.load_cog(cog) for cog in cogs))
+        print(f"Loaded {self.botName.capitalize()} cogs: {', '.join(cog.split('.')[-1].replace('Cog', '') for cog in cogs)}")
+
+    async def load_cog(self, cog):
+        started = time.perf_counter()
+        await self.client.load_extension(cog)
+        STARTUP.record_cog(f"{self.botName}: {cog}", time.perf_counter() - started)
 
     async def remove_cogs(self):
         # List of ALL possible cogs
@@ -244,21 +356,86 @@ class Cog:
             except commands.ExtensionNotLoaded:
                 continue
 
+async def ReportStartup(bots):
+    """Notes when each bot is online and prints the startup profile when they all are."""
+    async def online(bot):
+        await bot.client.wait_until_ready()
+        STARTUP.mark(f"{bot.modelName} online")
+
+    await asyncio.gather(*(online(bot) for bot in bots))
+    print(f"Online {STARTUP.marks[-1][1]:.2f}s after starting")
+    if args.profile_startup:
+        print(STARTUP.report())
+
+def CreateBots(names):
+    """Creates the named bots and returns them with the resources they share."""
+    shared = {}
+    if len(names) > 1:
+        # One LLM queue and backend pool, one response cache file and one HTTP connection pool
+        # for both bots. The connector belongs to the client sessions, so all bots close together.
+        import aiohttp
+        shared = {"gateway": LLMGateway(), "responseCache": ResponseCache(), "connector": aiohttp.TCPConnector(limit=0)}
+    return [BOTS[name](**shared) for name in names], shared
+
 async def main():
-    if args.bot == "tama":
-        bot = TamaBot()
-    elif args.bot == "saki":
-        bot = SakiBot()
+    names = list(BOTS) if args.bot == "both" else [args.bot]
+    bots, shared = CreateBots(names)
+    STARTUP.mark("bots created")
+
+    # Each bot gets a cog manager with its own client, all bots load their cogs at the same time
+    await asyncio.gather(*(Cog(bot.client, name).load_cogs() for name, bot in zip(names, bots)))
+    STARTUP.mark("cogs loaded")
+
+    # Heavy modules the bots don't need to get online are imported while they connect
+    preload = PreloadLazyModules()
+
+    if args.dry_run:
+        preload.join()
+        STARTUP.mark("background imports done")
+        print(f"Loaded {', '.join(names)} without connecting: {ResidentMemoryBytes() / 1024 / 1024:.1f} MB resident")
+        if args.profile_startup:
+            print(STARTUP.report())
+        if "connector" in shared:
+            await shared["connector"].close()
+        return
+
+    print(f"\n{' and '.join(name.capitalize() for name in names)} Online!")
     
-    # Initialize cog manager with THIS bot's client
-    cog_manager = Cog(bot.client)
-    
-    # Load fresh cogs for this bot
-    await cog_manager.load_cogs()
-    
-    print(f"\n{args.bot.capitalize()} Online!")
-    
-    await bot.client.start(bot.token)
+    metrics = MetricsServer()
+    await metrics.start()
+    LOOP_MONITOR.start()
+    MEMORY_TRACKER.start()
+    gateways = {id(bot.gateway): bot.gateway for bot in bots}.values()
+    for gateway in gateways:
+        gateway.start()
+    clients = [asyncio.create_task(bot.client.start(bot.token)) for bot in bots]
+    startupReport = asyncio.create_task(ReportStartup(bots))
+    try:
+        await asyncio.gather(*clients)
+    finally:
+        startupReport.cancel()
+        for bot in bots:
+            await bot.Shutdown()
+        await asyncio.gather(*clients, return_exceptions=True)
+        if "responseCache" in shared:
+            shared["responseCache"].save()
+            print(f"Response cache: {shared['responseCache'].stats()}")
+        # Closing the clients unloads the cogs, which flushes their writes, this catches the rest
+        # and waits for the writer threads
+        await FlushAll()
+        for gateway in gateways:
+            await gateway.stop()
+            print(f"LLM gateway: {gateway.stats()}")
+        await LOOP_MONITOR.stop()
+        await MEMORY_TRACKER.stop()
+        if LOOP_MONITOR.blockers:
+            print(f"Event loop blockers:\n{LOOP_MONITOR.summary(5)}")
+        await metrics.stop()
 
 if __name__ == "__main__":
+    if args.shard_processes > 1:
+        if args.bot == "both":
+            parser.error("--shard-processes runs one bot, start tama and saki separately")
+        token = os.getenv("TamaToken" if args.bot == "tama" else "SakiToken")
+        raise SystemExit(LaunchShardProcesses(args.bot, token, args.shard_processes, os.path.abspath(__file__)))
     asyncio.run(main())
@@ -0,0 +1,49 @@
+import pytest
+
+from Utils.AtomicFile import CorruptFile, ReadJson, WriteJson
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "data.json")
+    WriteJson(path, {"players": {"1": [1, 2]}, "name": "Tämä"}, generations=2)
+    assert ReadJson(path, generations=2) == {"players": {"1": [1, 2]}, "name": "Tämä"}
+
+def test_missing_file_returns_default(tmp_path):
+    assert ReadJson(str(tmp_path / "missing.json"), default={}, generations=2) == {}
+
+def test_keeps_previous_generations(tmp_path):
+    path = str(tmp_path / "data.json")
+    for version in range(4):
+        WriteJson(path, {"version": version}, generations=2)
+    assert ReadJson(path, generations=0) == {"version": 3}
+    assert ReadJson(f"{path}.1", generations=0) == {"version": 2}
+    assert ReadJson(f"{path}.2", generations=0) == {"version": 1}
+    assert not (tmp_path / "data.json.3").exists()
+
+def test_truncated_file_falls_back_to_previous_generation(tmp_path):
+    path = str(tmp_path / "data.json")
+    WriteJson(path, {"version": 1}, generations=2)
+    WriteJson(path, {"version": 2}, generations=2)
+    content = (tmp_path / "data.json").read_bytes()
+    (tmp_path / "data.json").write_bytes(content[:len(content) // 2])
+    assert ReadJson(path, generations=2) == {"version": 1}
+
+def test_checksum_mismatch_falls_back(tmp_path):
+    path = str(tmp_path / "data.json")
+    WriteJson(path, {"version": 1}, generations=2)
+    WriteJson(path, {"version": 2}, generations=2)
+    content = (tmp_path / "data.json").read_bytes()
+    (tmp_path / "data.json").write_bytes(content.replace(b'"version": 2', b'"version": 9'))
+    assert ReadJson(path, generations=2) == {"version": 1}
+
+def test_plain_json_still_loads(tmp_path):
+    (tmp_path / "old.json").write_text('{"written": "by hand"}')
+    assert ReadJson(str(tmp_path / "old.json"), generations=2) == {"written": "by hand"}
+
+def test_no_loadable_generation_raises(tmp_path):
+    path = str(tmp_path / "data.json")
+    WriteJson(path, {"version": 1}, generations=1)
+    WriteJson(path, {"version": 2}, generations=1)
+    (tmp_path / "data.json").write_bytes(b"{")
+    (tmp_path / "data.json.1").write_bytes(b"{")
+    with pytest.raises(CorruptFile):
+        ReadJson(path, generations=1)
@@ -0,0 +1,34 @@
+import asyncio
+
+from Utils.BackendPool import BackendPool
+
+def test_attempt_timeout_follows_the_gateway_timeout(monkeypatch):
+    monkeypatch.delenv("BackendTimeout", raising=False)
+    assert BackendPool(["http://a", "http://b"], timeout=30.0).attempt_timeout == 15.0
+    assert BackendPool(["http://a", "http://b", "http://c"], timeout=30.0).attempt_timeout == 10.0
+
+def test_slow_healthy_backend_keeps_its_circuit_closed(monkeypatch):
+    monkeypatch.setenv("BackendTimeout", "0.01")
+    monkeypatch.setenv("BackendFailureThreshold", "2")
+    monkeypatch.setenv("BackendTimeoutThreshold", "4")
+    pool = BackendPool(["http://slow", "http://fast"])
+    slow, fast = pool.backends
+
+    async def operation(client):
+        if client == "http://slow":
+            await asyncio.sleep(1)
+        return client
+
+    async def main():
+        return [await pool.call(operation) for _ in range(3)]
+
+    for backend in pool.backends:
+        backend._client = backend.host
+    fast.outstanding = 10
+    assert asyncio.run(main()) == ["http://fast"] * 3
+    assert slow.timeouts == 3 and slow.circuit == "closed"
+
+    slow.healthy = False
+    slow.record_timeout(pool.failure_threshold, pool.timeout_threshold, pool.cooldown)
+    slow.record_timeout(pool.failure_threshold, pool.timeout_threshold, pool.cooldown)
+    assert slow.circuit == "open"
@@ -0,0 +1,45 @@
+import asyncio
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from Utils.LongTermMemory import LongTermMemory
+
+DIM = 8
+
+class Client:
+    async def embed(self, model, input, keep_alive):
+        # One-hot vectors on the first letter, so a text is found by a query starting the same way
+        return {"embeddings": [[1.0 if index == ord(text[0]) % DIM else 0.0 for index in range(DIM)] for text in input]}
+
+class Pool:
+    async def call(self, operation):
+        return await operation(Client())
+
+def test_stale_search_after_eviction_keeps_newer_rows(monkeypatch, tmp_path):
+    monkeypatch.setenv("LongTermMemory", "true")
+    monkeypatch.setenv("MemoryOpenGuilds", "1")
+    monkeypatch.setenv("MemoryMinLength", "1")
+    monkeypatch.setenv("MemoryMinScore", "0.5")
+    memory = LongTermMemory(Pool(), "test", root=str(tmp_path))
+    query = np.eye(DIM, dtype=np.float32)[ord("a") % DIM]
+
+    async def main():
+        memory.remember(1, 10, "a first message")
+        await memory.flush()
+        stale = memory.indexes[1]
+        memory.remember(2, 20, "b other guild")
+        await memory.flush()
+        memory.remember(1, 10, "a second message")
+        await memory.flush()
+        results = await asyncio.to_thread(stale.search, query, 5)
+        recalled = await memory.recall(1, "a question")
+        await memory.stop()
+        return stale.closed, results, recalled
+
+    closed, results, recalled = asyncio.run(main())
+    assert closed and results == []
+    assert sorted(recalled) == ["a first message", "a second message"]
+    assert os.path.getsize(tmp_path / "test" / "1" / "texts.bin") == len("a first message") + len("a second message")
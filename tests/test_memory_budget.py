@@ -0,0 +1,80 @@
+import asyncio
+import sys
+
+import pytest
+
+pytest.importorskip("discord")
+
+from discord.ext import commands
+
+from Utils.MemoryBudget import DeepSize, MemoryTracker, StateContainers
+
+class Player:
+    __slots__ = ("name", "items")
+
+    def __init__(self, name: str, items: list):
+        self.name = name
+        self.items = items
+
+class FakeCog(commands.Cog):
+    pass
+
+class State:
+    def __init__(self):
+        self.players = {"1": Player("alice", ["sword"])}
+        self.history = []
+        self.cog = FakeCog()
+        self.limit = 5
+
+def test_deep_size_counts_nested_and_shared_objects_once():
+    text = "x" * 1000
+    size, count = DeepSize({"a": [text, text], "b": (text,)})
+    assert size >= 1000 + sys.getsizeof({})
+    assert size < 2000 + 1000
+    assert count == 6
+
+def test_deep_size_follows_slots_and_stops_at_boundaries():
+    player = Player("bob", ["x" * 5000])
+    assert DeepSize(player)[0] > 5000
+    assert DeepSize({"cog": FakeCog()})[1] == 2
+    assert DeepSize(list(range(100)), limit=10)[1] == 10
+
+def test_state_containers_skip_cogs_and_plain_values():
+    assert set(StateContainers(State())) == {"players", "history"}
+
+def test_budgets_by_owner_and_cog_name():
+    tracker = MemoryTracker()
+    tracker.budgets = tracker.parse_budgets(["RPG=1", "Tamaneko/Music=0.5", "broken"])
+    assert tracker.budgets == {"RPG": 1024 * 1024, "Tamaneko/Music": 512 * 1024}
+    assert tracker.budget("Sakiko/RPG") == 1024 * 1024
+    assert tracker.budget("Tamaneko/Music") == 512 * 1024
+    assert tracker.budget("Sakiko/Music") is None
+
+def test_measure_flags_owners_over_budget(monkeypatch):
+    tracker = MemoryTracker()
+    tracker.budgets = {"RPG": 10_000}
+    big = {"players": {str(index): "x" * 100 for index in range(200)}}
+    small = {"shop": {"potion": 5}}
+    monkeypatch.setattr(tracker, "owners", lambda: {"Tamaneko/RPG": big, "Sakiko/RPG": small})
+    totals = asyncio.run(tracker.measure())
+    assert totals["Tamaneko/RPG"] > 10_000 > totals["Sakiko/RPG"]
+    assert set(tracker.over) == {"Tamaneko/RPG"}
+    assert ("Tamaneko/RPG", "players") in tracker.sizes
+
+def test_snapshot_diff_shows_growth():
+    tracker = MemoryTracker()
+
+    async def main():
+        started, _ = await tracker.snapshot()
+        held = [bytearray(1024) for _ in range(2000)]
+        summary, full = await tracker.snapshot()
+        del held
+        return started, summary, full
+
+    try:
+        started, summary, full = asyncio.run(main())
+    finally:
+        tracker.stop_tracing()
+    assert started.startswith("Started tracing")
+    assert "test_memory_budget.py" in summary
+    assert "Since the first snapshot:" in full
@@ -0,0 +1,36 @@
+from Utils.MessageChunks import SplitMessage
+
+def test_short_message_is_one_chunk():
+    assert SplitMessage("  hello  ") == ["hello"]
+    assert SplitMessage("") == []
+
+def test_prefers_paragraphs_then_lines_then_spaces():
+    assert SplitMessage("first part\n\nsecond part", limit=20) == ["first part", "second part"]
+    assert SplitMessage("first line\nsecond line", limit=20) == ["first line", "second line"]
+    assert SplitMessage("one two three four five", limit=18) == ["one two three", "four five"]
+
+def test_chunks_stay_under_the_limit():
+    text = " ".join(f"word{index}" for index in range(2000))
+    chunks = SplitMessage(text, limit=100)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert " ".join(chunks) == text
+
+def test_text_without_separators_is_cut():
+    chunks = SplitMessage("x" * 250, limit=100)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks) == "x" * 250
+
+def test_code_block_is_closed_and_reopened():
+    code = "\n".join(f"print({index})" for index in range(40))
+    chunks = SplitMessage(f"Here:\n```python\n{code}\n```", limit=120)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 120
+        assert chunk.count("```") % 2 == 0
+    for chunk in chunks[1:]:
+        assert chunk.startswith("```python\n")
+
+def test_separator_near_the_start_is_ignored():
+    chunks = SplitMessage("short " + "x" * 300, limit=100)
+    assert len(chunks[0]) == 96
+    assert "".join(chunks) == "short " + "x" * 300
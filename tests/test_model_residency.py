@@ -0,0 +1,59 @@
+import asyncio
+
+from Utils.ModelResidency import ModelResidency
+
+GB = 1024 ** 3
+
+class Client:
+    def __init__(self, loaded):
+        self.loaded = loaded
+        self.generated = []
+
+    async def ps(self):
+        return {"models": self.loaded}
+
+    async def generate(self, model, prompt, keep_alive):
+        self.generated.append(model)
+        return {}
+
+class Backend:
+    name = "gpu"
+    available = True
+
+    def __init__(self, loaded):
+        self.client = Client(loaded)
+
+class Pool:
+    def __init__(self, backend):
+        self.backends = [backend]
+
+def Residency(monkeypatch, backend) -> ModelResidency:
+    monkeypatch.setenv("SharedModels", "Autumn")
+    monkeypatch.delenv("OllamaMemoryBudgetMB", raising=False)
+    return ModelResidency(Pool(backend), ["Tamaneko"], interval=0)
+
+def test_no_reload_over_a_shared_model_that_never_fit_next_to_it(monkeypatch):
+    backend = Backend([{"name": "Tamaneko:latest", "size": 6 * GB, "size_vram": 6 * GB}])
+    residency = Residency(monkeypatch, backend)
+
+    async def main():
+        await residency.heartbeat(backend)
+        backend.client.loaded[:] = [{"name": "Autumn:latest", "size": 5 * GB, "size_vram": 5 * GB}]
+        await residency.heartbeat(backend)
+
+    asyncio.run(main())
+    assert backend.client.generated == ["Tamaneko"]
+    assert residency.skipped == 1
+
+def test_reload_when_both_fit_before(monkeypatch):
+    backend = Backend([{"name": "Tamaneko:latest", "size": 6 * GB, "size_vram": 6 * GB}, {"name": "Autumn:latest", "size": 5 * GB, "size_vram": 5 * GB}])
+    residency = Residency(monkeypatch, backend)
+
+    async def main():
+        await residency.heartbeat(backend)
+        del backend.client.loaded[0]
+        await residency.heartbeat(backend)
+
+    asyncio.run(main())
+    assert backend.client.generated == ["Tamaneko", "Tamaneko"]
+    assert residency.skipped == 0
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+import pytest
+
+from Utils.PriorityScheduler import PRIORITIES, GatewayBusy, PriorityScheduler, RequestShed
+
+class Request:
+    def __init__(self, kind: str, guild_key, user_key, name: str = ""):
+        self.priority = PRIORITIES[kind]
+        self.guild_key = guild_key
+        self.user_key = user_key
+        self.name = name
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def cancel(self):
+        if not self.future.done():
+            self.future.cancel()
+
+def Scheduler(**limits) -> PriorityScheduler:
+    settings = dict(max_depth=16, shed_depth=16, shed_wait=60.0, user_limit=16, guild_limit=16)
+    settings.update(limits)
+    return PriorityScheduler(**settings)
+
+async def Names(scheduler: PriorityScheduler, count: int):
+    return [(await scheduler.get()).name for _ in range(count)]
+
+def test_higher_priority_first():
+    async def main():
+        scheduler = Scheduler()
+        scheduler.put(Request("random", 1, 1, "random"))
+        scheduler.put(Request("chat_channel", 1, 2, "chat"))
+        scheduler.put(Request("mention", 1, 3, "mention"))
+        return await Names(scheduler, 3)
+
+    assert asyncio.run(main()) == ["mention", "chat", "random"]
+
+def test_guilds_and_users_take_turns():
+    async def main():
+        scheduler = Scheduler()
+        for index in range(3):
+            scheduler.put(Request("mention", "busy", "spammer", f"spam{index}"))
+        scheduler.put(Request("mention", "busy", "other", "other"))
+        scheduler.put(Request("mention", "quiet", "user", "quiet"))
+        return await Names(scheduler, 5)
+
+    assert asyncio.run(main()) == ["spam0", "quiet", "other", "spam1", "spam2"]
+
+def test_random_shed_at_depth():
+    async def main():
+        scheduler = Scheduler(shed_depth=2)
+        scheduler.put(Request("mention", 1, 1))
+        scheduler.put(Request("mention", 1, 2))
+        with pytest.raises(RequestShed):
+            scheduler.put(Request("random", 1, 3))
+        scheduler.put(Request("chat_channel", 1, 3))
+        return scheduler.shed["depth"], scheduler.depth
+
+    assert asyncio.run(main()) == (1, 3)
+
+def test_random_shed_after_waiting():
+    async def main():
+        scheduler = Scheduler(shed_wait=0.0)
+        stale = Request("random", 1, 1)
+        scheduler.put(stale)
+        await asyncio.sleep(0.01)
+        scheduler.put(Request("chat_channel", 1, 2, "chat"))
+        names = await Names(scheduler, 1)
+        getter = asyncio.ensure_future(scheduler.get())
+        await asyncio.sleep(0.01)
+        getter.cancel()
+        return names, isinstance(stale.future.exception(), RequestShed)
+
+    assert asyncio.run(main()) == (["chat"], True)
+
+def test_full_queue_evicts_random():
+    async def main():
+        scheduler = Scheduler(max_depth=2)
+        evicted = Request("random", 1, 1)
+        scheduler.put(Request("random", 1, 2))
+        scheduler.put(evicted)
+        scheduler.put(Request("mention", 2, 3))
+        with pytest.raises(GatewayBusy):
+            scheduler.put(Request("random", 2, 4))
+        return isinstance(evicted.future.exception(), RequestShed), scheduler.depth
+
+    assert asyncio.run(main()) == (True, 2)
+
+def test_user_and_guild_limits():
+    async def main():
+        scheduler = Scheduler(user_limit=1, guild_limit=2)
+        scheduler.put(Request("mention", 1, 1))
+        with pytest.raises(GatewayBusy):
+            scheduler.put(Request("mention", 1, 1))
+        scheduler.put(Request("mention", 1, 2))
+        with pytest.raises(GatewayBusy):
+            scheduler.put(Request("mention", 1, 3))
+        return dict(scheduler.rejected)
+
+    assert asyncio.run(main()) == {"user_limit": 1, "guild_limit": 1}
+
+def test_cancelled_requests_free_their_slot():
+    async def main():
+        scheduler = Scheduler(user_limit=1)
+        superseded = Request("chat_channel", 1, 1)
+        scheduler.put(superseded)
+        superseded.cancel()
+        scheduler.put(Request("chat_channel", 1, 1, "latest"))
+        return scheduler.depth, await Names(scheduler, 1)
+
+    assert asyncio.run(main()) == (1, ["latest"])
+
+def test_explicit_zero_is_kept(monkeypatch):
+    monkeypatch.setenv("LLMShedDepth", "4")
+    scheduler = PriorityScheduler(shed_depth=0)
+    assert scheduler.shed_depth == 0
+
+def test_limit_evicts_lower_priority_of_the_same_user():
+    async def main():
+        scheduler = Scheduler(user_limit=2)
+        chatter = [Request("random", 1, 1), Request("chat_channel", 1, 1)]
+        for request in chatter:
+            scheduler.put(request)
+        scheduler.put(Request("mention", 1, 1, "mention"))
+        with pytest.raises(GatewayBusy):
+            scheduler.put(Request("random", 1, 1))
+        return isinstance(chatter[0].future.exception(), RequestShed), chatter[1].future.done(), await Names(scheduler, 1)
+
+    assert asyncio.run(main()) == (True, False, ["mention"])
+
+def test_guild_limit_evicts_lower_priority_of_the_same_guild():
+    async def main():
+        scheduler = Scheduler(guild_limit=2)
+        scheduler.put(Request("random", "other", 5))
+        scheduler.put(Request("chat_channel", 1, 1))
+        scheduler.put(Request("chat_channel", 1, 2))
+        with pytest.raises(GatewayBusy):
+            scheduler.put(Request("chat_channel", 1, 3))
+        scheduler.put(Request("mention", 1, 3, "mention"))
+        return scheduler.guild_depth[1], scheduler.guild_depth["other"], await Names(scheduler, 1)
+
+    assert asyncio.run(main()) == (2, 1, ["mention"])
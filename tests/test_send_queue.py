@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("discord")
+
+from Utils.SendQueue import SendQueue
+
+class Channel:
+    id = 1
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content: str):
+        self.sent.append(content)
+        return content
+
+def test_only_pieces_of_one_reply_are_merged():
+    async def main():
+        channel = Channel()
+        queue = SendQueue(rate=1, per=0.05, owner="test")
+        reply = object()
+        await asyncio.gather(
+            queue.send(channel, "first"),
+            queue.send(channel, "to alice"),
+            queue.send(channel, "to bob"),
+            queue.send(channel, "part one", reply),
+            queue.send(channel, "part two", reply),
+        )
+        await queue.close()
+        return channel.sent
+
+    assert asyncio.run(main()) == ["first", "to alice", "to bob", "part one\npart two"]
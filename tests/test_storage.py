@@ -0,0 +1,24 @@
+from Utils.Storage import Store
+
+def test_collection_round_trip(tmp_path):
+    store = Store(str(tmp_path / "storage.db"))
+    players = store.collection("players")
+    players.put_many({"1": {"level": 3}, "2": {"level": 5}})
+    players.delete("2")
+    store.collection("questions").put_list(["a", "b", "c"])
+    store.close()
+
+    store = Store(str(tmp_path / "storage.db"))
+    assert store.collection("players").load() == {"1": {"level": 3}}
+    assert store.collection("questions").load_list() == ["a", "b", "c"]
+    store.close()
+
+def test_import_once(tmp_path):
+    store = Store(str(tmp_path / "storage.db"))
+    imported = []
+    load = lambda target: (imported.append(1), target.collection("points").put("5", 3))
+    assert store.import_once("quiz", load)
+    assert not store.import_once("quiz", load)
+    assert imported == [1]
+    assert store.collection("points").get("5") == 3
+    store.close()
@@ -0,0 +1,28 @@
+import asyncio
+
+from Utils.Storage import Store, WriteBehind
+
+def test_write_behind_round_trip(tmp_path):
+    path = str(tmp_path / "storage.db")
+    players = {str(index): {"gold": 0} for index in range(5)}
+
+    async def main():
+        store = Store(path)
+        cache = WriteBehind(store, "test_players", {"players": players.get}, interval=60.0, max_dirty=1000)
+        cache.start()
+        for index in range(5):
+            players[str(index)]["gold"] += 10
+            cache.mark("players", index)
+        cache.mark("players", 0)
+        assert cache.pending == 5
+        del players["4"]
+        cache.mark("players", 4)
+        await cache.stop()
+        store.writer.drain()
+        store.close()
+        return cache.flushed
+
+    assert asyncio.run(main()) == 5
+    store = Store(path)
+    assert store.collection("players").load() == {str(index): {"gold": 10} for index in range(4)}
+    store.close()